@@ -1,21 +1,46 @@
-import apify_client
-from fastapi import FastAPI,HTTPException
+from fastapi import FastAPI,HTTPException,Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse
+from typing import List,Dict, Any, Optional
+from datetime import datetime
 import asyncio
-from typing import List,Dict, Any
-from tiktok_metrics_processor import transform_items
+import os
+import time
+from tiktok_metrics_processor import normalize_hashtag, LIMA_TZ
+from ranking import TopNByHashtag, rank_all, DEFAULT_TOP_N, DEFAULT_RANK_BY
+from parallel_transform import transform_batch_async, shutdown_pool as shutdown_transform_pool
+from ingestion import ingest_pages, IngestResult, APIFY_PAGE_SIZE
+from apify_connector import ApifyRunError, runs as apify_runs, iter_dataset_pages, pool as apify_pool
 # al inicio de tus imports
 from db_mongo import ensure_indexes
+from migrations import run_migrations, start_online_migrations
 from contextlib import asynccontextmanager
 from db_mongo import get_collection
-from db_mongo import get_collection_by
+from db_mongo import get_admin_collection
 from queries_controller import router as queries_router
-from models import ApifyRequest, InsertResponse
+from series_controller import router as series_router
+from export_controller import router as export_router
+from models import ApifyRequest, InsertResponse, JobStatus, shape_metric
+from fast_json import FastJSONResponse
+from jobs import manager as jobs, JobQueueFull
+from watermarks import WatermarkTracker, targets_of, since_date, INCREMENTAL_REFRESH_DAYS
+import metrics
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # migraciones primero: el índice único (dueño, postId) necesita la colección sin duplicados
+    await run_migrations()
     await ensure_indexes()
+    # formato tipado de los documentos: por lotes, con el servicio ya atendiendo
+    online_migrations = start_online_migrations()
+    await jobs.start()
     yield
+    online_migrations.cancel()
+    await asyncio.gather(online_migrations, return_exceptions=True)
+    await jobs.stop()
+    await apify_pool.close()
+    shutdown_transform_pool()
 
 app = FastAPI(lifespan=lifespan,
     title="TikTok Metrics API",
@@ -32,135 +57,319 @@ app.add_middleware(
 )
 
 app.include_router(queries_router)
+app.include_router(series_router)
+app.include_router(export_router)
 
 
-async def fetch_data(run_input):
+@app.middleware("http")
+async def _request_timing(request: Request, call_next):
+    t0 = time.perf_counter()
+    status = 500
     try:
-        print(run_input)
-        run_input.pop("userId", None)
-        run_input.pop("adminId", None)
-        client = apify_client.ApifyClient(run_input["apifyToken"])
-        run_input.pop("apifyToken",None)
-        loop = asyncio.get_event_loop()
-        run = await loop.run_in_executor(None, lambda: client.actor("clockworks/free-tiktok-scraper").call(run_input=run_input))
-        dataset_id = run.get("defaultDatasetId")
-        if not dataset_id:
-            return {"onError": {"error": "datasetId not found on the Apify response"}}
-        data = await loop.run_in_executor(None, lambda: list(client.dataset(dataset_id).iterate_items()))
-        return {"Success": data}
-    except Exception as ApifyApiError:
-        print("Error: " + str(ApifyApiError))
-        # Pasa cuando no hay ningún post que hagan match con filtros envíados 
-        return {"Error": str(ApifyApiError)}
-    
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # path de la ruta (/apify-connection/jobs/{job_id}), no la URL: cardinalidad acotada
+        route = request.scope.get("route")
+        metrics.observe_request(request.method, getattr(route, "path", "unmatched"), status, time.perf_counter() - t0)
 
 
-@app.post("/apify-connection/normalized",response_model=InsertResponse,
-    summary="Obtener métricas de TikTok para usuario",
-    description="Obtiene métricas de TikTok desde Apify por username y las guarda en la colección de usuario")
-async def fetch_and_save_tiktok_data(request: ApifyRequest):
-    raw = await fetch_data(request.model_dump(exclude_none=True))
-    if "Success" not in raw:
-        raise HTTPException(status_code=502, detail=raw)
-    normalized: List[Dict[str, Any]] = transform_items(
-        raw,
-        username_fallback=request.profiles[0] if request.profiles else None,
-        user_id=request.userId
+# campos de ApifyRequest que son nuestros y no se envían al actor
+_NON_ACTOR_FIELDS = {
+    "apifyToken", "userId", "adminId", "chunkSize", "includeData", "asyncJob", "topN", "rankBy",
+    "incremental", "refreshDays", "fanOut", "fanOutBatchSize", "fanOutConcurrency",
+}
+_TARGET_FIELDS = ("profiles", "hashtags", "searchQueries")
+APIFY_FANOUT_CONCURRENCY = int(os.getenv("APIFY_FANOUT_CONCURRENCY", "4"))
+
+def _actor_input(request: ApifyRequest) -> Dict[str, Any]:
+    return request.model_dump(exclude_none=True, exclude=_NON_ACTOR_FIELDS)
+
+
+def _chain(*fns):
+    fns = [f for f in fns if f is not None]
+
+    def call(docs: List[Dict[str, Any]]) -> None:
+        for f in fns:
+            f(docs)
+    return call
+
+
+async def _incremental_request(request: ApifyRequest, coll_name: str, owner_id: Any, targets) -> ApifyRequest:
+    # con searchQueries no hay watermark que aplique: oldestPostDate también filtraría esas búsquedas
+    if not request.incremental or request.oldestPostDate or request.searchQueries:
+        return request
+    refresh = INCREMENTAL_REFRESH_DAYS if request.refreshDays is None else request.refreshDays
+    since = await since_date(coll_name, owner_id, targets, refresh)
+    if since is None:
+        return request
+    return request.model_copy(update={"oldestPostDate": since})
+
+
+async def _run_and_ingest(request: ApifyRequest, coll, transform, owner_field: str,
+                          on_docs=None, on_chunk=None, result=None):
+    # watermarks por (dueño, profile/hashtag): se registran siempre, se aplican con incremental=true
+    owner_id = getattr(request, owner_field)
+    targets = targets_of(request.profiles, request.hashtags)
+    tracker = WatermarkTracker(targets)
+    request = await _incremental_request(request, coll.name, owner_id, targets)
+    # mismo token e input en curso o reciente -> se comparte el run (ver RunCoalescer)
+    # el tracking es cuando terminó el run (finishedAt), no la hora del request ni la
+    # de lectura: un run largo, o uno reutilizado, quedaba fechado lejos de sus datos
+    dataset_id, tracked_at = await apify_runs.run(request.apifyToken, _actor_input(request))
+    # cuenta para los items sin autor: la del request de este run (con fanOut, la de su target)
+    username_fallback = request.profiles[0] if request.profiles else None
+    result = await ingest_pages(
+        iter_dataset_pages(request.apifyToken, dataset_id, APIFY_PAGE_SIZE),
+        lambda page: transform(page, tracked_at, username_fallback),
+        coll,
+        owner_field,
+        chunk_size=request.chunkSize,
+        on_docs=_chain(tracker.add, on_docs),
+        on_chunk=on_chunk,
+        result=result,
     )
-    if not normalized:
-        return InsertResponse(inserted=0, data=[])
-    coll = get_collection()
-    docs_to_insert = [doc.copy() for doc in normalized]
-    result = await coll.insert_many(docs_to_insert)
-    return InsertResponse(
-        inserted=len(result.inserted_ids),
-        data=normalized
+    # solo con el scrape completo: uno cortado a la mitad no puede adelantar el watermark
+    await tracker.save(coll.name, owner_id)
+    return result
+
+
+def _split_targets(request: ApifyRequest) -> List[Any]:
+    """(nombre, sub-request) con fanOutBatchSize targets de un mismo tipo cada uno."""
+    size = request.fanOutBatchSize or 1
+    empty = {f: None for f in _TARGET_FIELDS}
+    subs = []
+    for field in _TARGET_FIELDS:
+        values = getattr(request, field) or []
+        for i in range(0, len(values), size):
+            batch = values[i:i + size]
+            subs.append((
+                f"{field}:{','.join(batch)}",
+                request.model_copy(update={**empty, field: batch, "fanOut": False}),
+            ))
+    return subs
+
+
+async def _fan_out(request: ApifyRequest, coll, transform, owner_field: str, on_docs=None, on_chunk=None):
+    result = IngestResult()
+    slots = asyncio.Semaphore(request.fanOutConcurrency or APIFY_FANOUT_CONCURRENCY)
+    # un post que aparece en varios targets se escribe una sola vez (el primero que llega):
+    # dos upserts concurrentes del mismo post sumarían dos veces su aporte a los rollups
+    seen: set = set()
+
+    async def one(name: str, sub: ApifyRequest) -> Dict[str, Any]:
+        status = {"target": name, "status": "succeeded", "received": 0, "inserted": 0, "upserted": 0,
+                  "duplicates": 0, "error": None}
+
+        async def first_seen(page: List[Dict[str, Any]], tracked_at: datetime,
+                             username_fallback: Optional[str]) -> List[Dict[str, Any]]:
+            docs = transform(page, tracked_at, username_fallback)
+            if asyncio.iscoroutine(docs):
+                docs = await docs
+            out = []
+            for d in docs:
+                pid = d.get("postId")
+                if pid:
+                    if pid in seen:
+                        status["duplicates"] += 1
+                        continue
+                    seen.add(pid)
+                out.append(d)
+            return out
+
+        async def count(progress: Dict[str, Any]) -> None:
+            for k in ("received", "inserted", "upserted"):
+                status[k] += progress[k]
+            if on_chunk is not None:
+                maybe = on_chunk(progress)
+                if asyncio.iscoroutine(maybe):
+                    await maybe
+
+        async with slots:
+            try:
+                await _run_and_ingest(sub, coll, first_seen, owner_field, on_docs, count, result)
+            except ApifyRunError as e:
+                status.update(status="failed", error=e.detail)
+        return status
+
+    tasks = [asyncio.ensure_future(one(name, sub)) for name, sub in _split_targets(request)]
+    try:
+        result.targets = list(await asyncio.gather(*tasks))
+    except BaseException:
+        # error inesperado en un target (o request cancelado): los demás no pueden seguir
+        # escribiendo en Mongo después de que la respuesta ya falló
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    if result.targets and all(t["status"] == "failed" for t in result.targets):
+        raise HTTPException(status_code=502, detail={"Error": "all targets failed", "targets": result.targets})
+    return result
+
+
+async def _stream_into(request: ApifyRequest, coll, transform, owner_field: str, on_docs=None, on_chunk=None):
+    try:
+        if request.fanOut:
+            return await _fan_out(request, coll, transform, owner_field, on_docs, on_chunk)
+        return await _run_and_ingest(request, coll, transform, owner_field, on_docs, on_chunk)
+    except ApifyRunError as e:
+        raise HTTPException(status_code=502, detail=e.detail)
+
+
+async def _submit_job(kind: str, request: ApifyRequest) -> JSONResponse:
+    payload = request.model_dump(exclude={"apifyToken", "asyncJob"})
+    try:
+        job = await jobs.submit(kind, payload, secrets={"apifyToken": request.apifyToken})
+    except JobQueueFull:
+        raise HTTPException(status_code=503, detail={"Error": "scrape job queue is full"})
+    return JSONResponse(status_code=202, content=jsonable_encoder(_job_status(job)))
+
+def _job_status(job: Dict[str, Any]) -> JobStatus:
+    result = job.get("result") or {}
+    return JobStatus(
+        jobId=job["_id"],
+        kind=job["kind"],
+        status=job["status"],
+        createdAt=job["createdAt"],
+        startedAt=job.get("startedAt"),
+        finishedAt=job.get("finishedAt"),
+        attempts=job.get("attempts", 0),
+        progress=job.get("progress") or {},
+        inserted=result.get("inserted"),
+        upserted=result.get("upserted"),
+        chunks=result.get("chunks") or [],
+        targets=result.get("targets") or [],
+        error=job.get("error"),
     )
 
+def _job_handler(scrape):
+    async def handler(payload: Dict[str, Any], on_chunk) -> Dict[str, Any]:
+        # en modo job los documentos no se guardan en el job: solo conteos
+        request = ApifyRequest(**{**payload, "includeData": False, "asyncJob": False})
+        resp = await scrape(request, on_chunk=on_chunk)
+        return {"inserted": resp["inserted"], "upserted": resp["upserted"], "chunks": resp["chunks"],
+                "targets": resp["targets"]}
+    return handler
 
+def _insert_response(result, data: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # misma forma que InsertResponse, armada sin pasar cada item por MetricOut
+    return {
+        "inserted": result.inserted,
+        "upserted": result.upserted,
+        "data": [shape_metric(d) for d in data],
+        "chunks": result.chunks,
+        "targets": result.targets,
+    }
 
-@app.post("/apify-connection/admin/normalized",response_model=InsertResponse,
-    summary="Obtener métricas de TikTok para admin",
-    description="Obtiene métricas de TikTok desde Apify (username, hashtags o keywords) y las guarda en la colección de admin. Retorna Top 5 por hashtag ordenado por views.")
-async def fetch_and_save_tiktok_data_admin(request: ApifyRequest):
-    # 1) trae datos crudos de Apify
-    raw = await fetch_data(request.model_dump(exclude_none=True))
-    if "Success" not in raw:
-        raise HTTPException(status_code=502, detail=raw)
-
-    # 2) normaliza (sin userId)
-    normalized: List[Dict[str, Any]] = transform_items(
-        raw,
-        username_fallback=request.profiles[0] if request.profiles else None,
-        user_id=None
+
+async def scrape_user(request: ApifyRequest, on_chunk=None) -> Dict[str, Any]:
+    # tracked_at y username_fallback los pone _run_and_ingest para cada run
+    async def transform(page: List[Dict[str, Any]], tracked_at: datetime,
+                        username_fallback: Optional[str]) -> List[Dict[str, Any]]:
+        return await transform_batch_async(page, username_fallback, "userId", request.userId, tracked_at)
+
+    data: List[Dict[str, Any]] = []
+    result = await _stream_into(
+        request,
+        get_collection(),
+        transform,
+        "userId",
+        on_docs=data.extend if request.includeData else None,
+        on_chunk=on_chunk,
     )
+    return _insert_response(result, data)
+
+
+
+def _split_csv(s: Any) -> List[str]:
+    if not isinstance(s, str):
+        return []
+    return [p.strip() for p in s.split(",") if p.strip()]
 
-    # 3) setea adminId y limpia userId
+async def scrape_admin(request: ApifyRequest, on_chunk=None) -> Dict[str, Any]:
     admin_id = request.adminId
-    for doc in normalized:
-        doc["adminId"] = admin_id if admin_id is not None else "N/A"
-        doc.pop("userId", None)
-
-    # 4) inserta en AdminTiktokMetrics SIN contaminar la respuesta con ObjectId
-    if not normalized:
-        return InsertResponse(inserted=0, data=[])
-    coll = get_collection_by("AdminTiktokMetrics")
-    docs_to_insert = [d.copy() for d in normalized]
-    result = await coll.insert_many(docs_to_insert)
-
-    # ======== ORDEN ÚNICO: Top 5 por cada hashtag del body, concatenado ========
-    TOP_N = 5
-
-    def _split_csv(s: Any) -> List[str]:
-        if not isinstance(s, str):
-            return []
-        return [p.strip() for p in s.split(",") if p.strip()]
-
-    def _norm_tag(t: str) -> str:
-        t = t.strip().lower()
-        return t if t.startswith("#") else f"#{t}"
-
-    def _has_hashtag(doc: Dict[str, Any], tag: str) -> bool:
-        # hashtags viene como string con espacios: "#a #b #c"
-        hs = (doc.get("hashtags") or "").lower().split()
-        return tag in hs
-
-    ordered: List[Dict[str, Any]] = []
-    hashtags_param = request.hashtags
-    if hashtags_param:
-        if isinstance(hashtags_param, list):
-            hashtags_str = ",".join(hashtags_param)
-        else:
-            hashtags_str = hashtags_param
-        tags_req = _split_csv(hashtags_str)
+
+    # tracked_at y username_fallback los pone _run_and_ingest para cada run
+    async def transform(page: List[Dict[str, Any]], tracked_at: datetime,
+                        username_fallback: Optional[str]) -> List[Dict[str, Any]]:
+        # 1-2) normaliza con adminId (sin userId)
+        return await transform_batch_async(page, username_fallback, "adminId", admin_id, tracked_at)
+
+    # ======== ORDEN ÚNICO: Top N por cada hashtag del body, concatenado ========
+    # se arma mientras llegan los chunks: con hashtags solo quedan los candidatos
+    # de cada heap, sin retener todo lo normalizado
+    tags_req = _split_csv(",".join(request.hashtags or []))
+    rank_by = request.rankBy or DEFAULT_RANK_BY
+    ranker = TopNByHashtag(
+        [normalize_hashtag(t) for t in tags_req],
+        n=request.topN or DEFAULT_TOP_N,
+        metric=rank_by,
+    ) if tags_req else None
+    normalized: List[Dict[str, Any]] = []
+    if not request.includeData:
+        on_docs = None
+    elif ranker is not None:
+        on_docs = ranker.add
     else:
-        tags_req = []
-
-    if tags_req:
-        tags_norm = [_norm_tag(t) for t in tags_req]
-        seen_post_ids: set[str] = set()
-        for tag in tags_norm:
-            subset = [
-                d for d in normalized
-                if _has_hashtag(d, tag) and str(d.get("postId")) not in seen_post_ids
-            ]
-            subset.sort(key=lambda x: int(x.get("views") or 0), reverse=True)
-            top = subset[:TOP_N]
-            ordered.extend(top)
-            for d in top:
-                pid = str(d.get("postId"))
-                if pid:
-                    seen_post_ids.add(pid)
+        on_docs = normalized.extend
+
+    # 3) trae, normaliza e inserta en AdminTiktokMetrics por chunks
+    result = await _stream_into(
+        request,
+        get_admin_collection(),
+        transform,
+        "adminId",
+        on_docs=on_docs,
+        on_chunk=on_chunk,
+    )
+
+    if ranker is not None:
+        ordered = ranker.result() if request.includeData else []
     else:
-        # si no mandan hashtags, devolvemos todo ordenado por views desc
-        ordered = sorted(normalized, key=lambda x: int(x.get("views") or 0), reverse=True)
+        # si no mandan hashtags, devolvemos todo ordenado por la métrica desc
+        ordered = rank_all(normalized, rank_by)
 
     # 5) Respuesta ÚNICA: inserted + data (lista única ya ordenada)
-    return InsertResponse(
-        inserted=len(result.inserted_ids),
-        data=ordered
-    )
+    return _insert_response(result, ordered)
+
+jobs.register("user", _job_handler(scrape_user))
+jobs.register("admin", _job_handler(scrape_admin))
+
+
+@app.post("/apify-connection/normalized",response_model=InsertResponse,
+    responses={202: {"model": JobStatus, "description": "Job encolado (asyncJob=true)"}},
+    summary="Obtener métricas de TikTok para usuario",
+    description="Obtiene métricas de TikTok desde Apify por username y las guarda en la colección de usuario")
+async def fetch_and_save_tiktok_data(request: ApifyRequest):
+    if request.asyncJob:
+        return await _submit_job("user", request)
+    return FastJSONResponse(await scrape_user(request))
+
+
+@app.post("/apify-connection/admin/normalized",response_model=InsertResponse,
+    responses={202: {"model": JobStatus, "description": "Job encolado (asyncJob=true)"}},
+    summary="Obtener métricas de TikTok para admin",
+    description="Obtiene métricas de TikTok desde Apify (username, hashtags o keywords) y las guarda en la colección de admin. Retorna Top N (topN, 5 por defecto) por hashtag ordenado por rankBy (views por defecto).")
+async def fetch_and_save_tiktok_data_admin(request: ApifyRequest):
+    if request.asyncJob:
+        return await _submit_job("admin", request)
+    return FastJSONResponse(await scrape_admin(request))
+
+
+@app.get("/apify-connection/jobs/{job_id}",response_model=JobStatus,
+    summary="Estado de un scrape en modo job",
+    description="Devuelve el estado, el progreso por chunk y los insertados de un job encolado con asyncJob=true")
+async def get_scrape_job(job_id: str):
+    job = await jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail={"Error": "job not found"})
+    return _job_status(job)
 
 @app.get("/") 
 async def healthy():
     return {"status":"up"}
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
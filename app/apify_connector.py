@@ -0,0 +1,273 @@
+# apify_connector.py
+# Conexión a Apify con el cliente async nativo (ApifyClientAsync -> httpx).
+# Un cliente por token, reutilizado entre requests para no rehacer el pool HTTP,
+# con desalojo LRU + por inactividad. Nada de run_in_executor en el camino caliente.
+# Runs del actor con single-flight por token + input canónico y reutilización de
+# los runs recientes (RunCoalescer).
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from apify_client import ApifyClientAsync
+
+from metrics import logger, span, APIFY_RUNS
+
+APIFY_ACTOR_ID = os.getenv("APIFY_ACTOR_ID", "clockworks/free-tiktok-scraper")
+# permite apuntar a un Apify local/falso (benchmarks, pruebas de carga)
+APIFY_API_URL = os.getenv("APIFY_API_URL") or None
+APIFY_MAX_CLIENTS = int(os.getenv("APIFY_MAX_CLIENTS", "32"))
+APIFY_CLIENT_IDLE_SECS = float(os.getenv("APIFY_CLIENT_IDLE_SECS", "600"))
+APIFY_MAX_CONCURRENT_RUNS = int(os.getenv("APIFY_MAX_CONCURRENT_RUNS", "8"))
+APIFY_MAX_CONCURRENT_PAGES = int(os.getenv("APIFY_MAX_CONCURRENT_PAGES", "16"))
+APIFY_HTTP_TIMEOUT_SECS = int(os.getenv("APIFY_HTTP_TIMEOUT_SECS", "360"))
+APIFY_MAX_RETRIES = int(os.getenv("APIFY_MAX_RETRIES", "4"))
+# 0 = sin límite (el actor usa su propio timeout)
+APIFY_RUN_TIMEOUT_SECS = int(os.getenv("APIFY_RUN_TIMEOUT_SECS", "0"))
+APIFY_PAGE_TIMEOUT_SECS = float(os.getenv("APIFY_PAGE_TIMEOUT_SECS", "120"))
+# ventana en la que un run terminado se reutiliza para el mismo input (0 = no reutilizar)
+APIFY_RUN_REUSE_SECS = float(os.getenv("APIFY_RUN_REUSE_SECS", "120"))
+APIFY_RUN_REUSE_MAX = int(os.getenv("APIFY_RUN_REUSE_MAX", "256"))
+
+
+class ApifyRunError(Exception):
+    """Error de Apify con el detalle que se devuelve en el 502."""
+
+    def __init__(self, detail: Dict[str, Any]):
+        super().__init__(str(detail))
+        self.detail = detail
+
+
+class _PooledClient:
+    __slots__ = ("client", "last_used", "leases", "evicted")
+
+    def __init__(self, client: ApifyClientAsync):
+        self.client = client
+        self.last_used = time.monotonic()
+        self.leases = 0
+        self.evicted = False
+
+
+async def _close_client(client: ApifyClientAsync) -> None:
+    # ApifyClientAsync no expone close(); cerramos el httpx.AsyncClient interno si está
+    http = getattr(client, "http_client", None)
+    httpx_client = getattr(http, "httpx_async_client", None)
+    if httpx_client is not None:
+        try:
+            await httpx_client.aclose()
+        except Exception:
+            pass
+
+
+class ApifyClientPool:
+    """Pool de ApifyClientAsync por token con desalojo LRU e inactividad."""
+
+    def __init__(self, max_clients: int = APIFY_MAX_CLIENTS, idle_secs: float = APIFY_CLIENT_IDLE_SECS):
+        self.max_clients = max(1, max_clients)
+        self.idle_secs = idle_secs
+        self._clients: "OrderedDict[str, _PooledClient]" = OrderedDict()
+        self.created = 0
+        self.evictions = 0
+
+    def _new_client(self, token: str) -> ApifyClientAsync:
+        kwargs: Dict[str, Any] = {
+            "max_retries": APIFY_MAX_RETRIES,
+            "timeout_secs": APIFY_HTTP_TIMEOUT_SECS,
+        }
+        if APIFY_API_URL:
+            kwargs["api_url"] = APIFY_API_URL
+        self.created += 1
+        return ApifyClientAsync(token, **kwargs)
+
+    async def _evict(self, token: str) -> None:
+        entry = self._clients.pop(token, None)
+        if entry is None:
+            return
+        self.evictions += 1
+        entry.evicted = True
+        # si alguien lo está usando, se cierra al devolverlo
+        if entry.leases == 0:
+            await _close_client(entry.client)
+
+    async def _sweep(self) -> None:
+        now = time.monotonic()
+        for token in [t for t, e in self._clients.items() if e.leases == 0 and now - e.last_used > self.idle_secs]:
+            await self._evict(token)
+        while len(self._clients) > self.max_clients:
+            oldest = next(iter(self._clients))
+            await self._evict(oldest)
+
+    @asynccontextmanager
+    async def lease(self, token: str) -> AsyncIterator[ApifyClientAsync]:
+        entry = self._clients.get(token)
+        if entry is None:
+            entry = _PooledClient(self._new_client(token))
+            self._clients[token] = entry
+        self._clients.move_to_end(token)
+        entry.leases += 1
+        await self._sweep()
+        try:
+            yield entry.client
+        finally:
+            entry.leases -= 1
+            entry.last_used = time.monotonic()
+            if entry.evicted and entry.leases == 0:
+                await _close_client(entry.client)
+
+    async def close(self) -> None:
+        for token in list(self._clients):
+            await self._evict(token)
+
+    def stats(self) -> Dict[str, int]:
+        return {"clients": len(self._clients), "created": self.created, "evictions": self.evictions}
+
+
+pool = ApifyClientPool()
+_run_slots = asyncio.Semaphore(APIFY_MAX_CONCURRENT_RUNS)
+_page_slots = asyncio.Semaphore(APIFY_MAX_CONCURRENT_PAGES)
+
+
+async def run_actor(token: str, run_input: Dict[str, Any]) -> Tuple[str, datetime]:
+    """Corre el actor hasta que termine y devuelve (id de su dataset, cuándo terminó)."""
+    async with _run_slots, pool.lease(token) as client:
+        try:
+            with span("apify_run"):
+                run = await client.actor(APIFY_ACTOR_ID).call(
+                    run_input=run_input,
+                    timeout_secs=APIFY_RUN_TIMEOUT_SECS or None,
+                    # sin redirección de logs/status del run: el watcher agrega ~5 s por run
+                    logger=None,
+                )
+        except Exception as ApifyApiError:
+            logger.warning("apify run failed: %s", ApifyApiError)
+            # Pasa cuando no hay ningún post que hagan match con filtros envíados
+            raise ApifyRunError({"Error": str(ApifyApiError)}) from ApifyApiError
+    status = (run or {}).get("status")
+    if status and status != "SUCCEEDED":
+        # FAILED / ABORTED / TIMED-OUT: el dataset puede estar vacío o a medias
+        logger.warning("apify run %s finished with status %s", run.get("id"), status)
+        raise ApifyRunError({"Error": f"Actor run finished with status {status}", "runId": run.get("id")})
+    dataset_id = (run or {}).get("defaultDatasetId")
+    if not dataset_id:
+        raise ApifyRunError({"onError": {"error": "datasetId not found on the Apify response"}})
+    # apify-client ya parsea finishedAt a datetime UTC
+    finished_at = run.get("finishedAt")
+    if not isinstance(finished_at, datetime):
+        finished_at = datetime.now(tz=timezone.utc)
+    return dataset_id, finished_at
+
+
+# listas del input donde el orden no cambia lo que scrapea el actor
+_UNORDERED_INPUTS = ("profiles", "hashtags", "searchQueries")
+
+def run_key(token: str, run_input: Dict[str, Any]) -> str:
+    """Clave canónica de (token, input del actor).
+
+    El token entra en la clave: un run solo se comparte entre requests de la misma
+    cuenta de Apify (lo paga ella y su dataset se lee con su token). Se guarda el
+    hash, no el token.
+    """
+    canon = dict(run_input)
+    for f in _UNORDERED_INPUTS:
+        if isinstance(canon.get(f), list):
+            canon[f] = sorted(set(canon[f]))
+    raw = json.dumps([token, canon], sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class RunCoalescer:
+    """Single-flight de runs del actor por token + input canónico, con reutilización
+    de runs recientes.
+
+    Requests concurrentes con el mismo token e input esperan el mismo run; si uno
+    terminó hace menos de `reuse_secs` se devuelve su dataset y solo se
+    re-normaliza para el nuevo dueño. Requests con otro token nunca comparten run.
+    """
+
+    def __init__(self, reuse_secs: float = APIFY_RUN_REUSE_SECS, max_recent: int = APIFY_RUN_REUSE_MAX):
+        self.reuse_secs = reuse_secs
+        self.max_recent = max(1, max_recent)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # key -> ((dataset_id, finishedAt del run), monotonic al terminar)
+        self._recent: "OrderedDict[str, Tuple[Tuple[str, datetime], float]]" = OrderedDict()
+
+    def _fresh(self, key: str) -> Optional[Tuple[str, datetime]]:
+        hit = self._recent.get(key)
+        if hit is None:
+            return None
+        run, done_at = hit
+        if time.monotonic() - done_at > self.reuse_secs:
+            del self._recent[key]
+            return None
+        return run
+
+    async def _start(self, key: str, token: str, run_input: Dict[str, Any]) -> Tuple[str, datetime]:
+        try:
+            run = await run_actor(token, run_input)
+        finally:
+            self._inflight.pop(key, None)
+        if self.reuse_secs > 0:
+            self._recent[key] = (run, time.monotonic())
+            self._recent.move_to_end(key)
+            while len(self._recent) > self.max_recent:
+                self._recent.popitem(last=False)
+        return run
+
+    async def run(self, token: str, run_input: Dict[str, Any]) -> Tuple[str, datetime]:
+        """Devuelve (dataset_id, finishedAt) del run; el dataset se lee con el mismo token.
+
+        Un run reutilizado puede haber terminado hace hasta `reuse_secs`: el que lo
+        ingesta tiene que fecharlo con finishedAt, no con la hora actual.
+        """
+        key = run_key(token, run_input)
+        fresh = self._fresh(key)
+        if fresh is not None:
+            APIFY_RUNS.inc("reused")
+            return fresh
+        task = self._inflight.get(key)
+        if task is None:
+            APIFY_RUNS.inc("started")
+            task = self._inflight[key] = asyncio.create_task(self._start(key, token, run_input))
+            # si todos los que esperaban se cancelan, que el error no quede sin leer
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        else:
+            APIFY_RUNS.inc("coalesced")
+        # shield: si se cae el request que lanzó el run, los demás lo siguen esperando
+        return await asyncio.shield(task)
+
+    def clear(self) -> None:
+        self._recent.clear()
+
+
+runs = RunCoalescer()
+
+
+async def iter_dataset_pages(token: str, dataset_id: str, page_size: int) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Pagina el dataset (offset/limit) en vez de cargarlo entero en memoria."""
+    offset = 0
+    async with pool.lease(token) as client:
+        dataset = client.dataset(dataset_id)
+        while True:
+            async with _page_slots:
+                try:
+                    with span("apify_dataset_page") as s:
+                        page = await asyncio.wait_for(
+                            dataset.list_items(offset=offset, limit=page_size),
+                            timeout=APIFY_PAGE_TIMEOUT_SECS,
+                        )
+                        s.items = len(page.items or [])
+                except Exception as ApifyApiError:
+                    logger.warning("apify dataset page failed: %s", ApifyApiError)
+                    raise ApifyRunError({"Error": str(ApifyApiError) or type(ApifyApiError).__name__}) from ApifyApiError
+            items = page.items or []
+            if not items:
+                return
+            yield items
+            offset += len(items)
+            if len(items) < page_size:
+                return
@@ -1,6 +1,8 @@
 # db_mongo.py
 import os
+from typing import Any, Dict, List, Tuple
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import CollectionInvalid, OperationFailure
 from dotenv import load_dotenv
 from fastapi import FastAPI
 
@@ -9,6 +11,14 @@ load_dotenv()
 MONGO_URI = os.getenv("MONGODB_URI")
 DB_NAME = os.getenv("MONGODB_DB", "Microservicio3")
 COLL_NAME = os.getenv("MONGODB_COLLECTION", "UserTiktokMetrics")
+ADMIN_COLL_NAME = os.getenv("MONGODB_ADMIN_COLLECTION", "AdminTiktokMetrics")
+# snapshots legacy: la ingesta ya no escribe ahí, solo lo lee migrations.backfill_series
+HISTORY_SUFFIX = "History"
+SERIES_SUFFIX = "Series"
+SERIES_GRANULARITY = os.getenv("MONGODB_SERIES_GRANULARITY", "hours")
+DAILY_ROLLUP_SUFFIX = "DailyRollup"
+HASHTAG_ROLLUP_SUFFIX = "HashtagRollup"
+SOUND_ROLLUP_SUFFIX = "SoundRollup"
 
 client: AsyncIOMotorClient | None = None
 
@@ -26,5 +36,206 @@ def get_collection():
     cli = get_client()
     return cli[DB_NAME][COLL_NAME]
 
-async def ensure_indexes():
-    pass
+def get_admin_collection():
+    return get_collection_by(ADMIN_COLL_NAME)
+
+def get_series_collection(coll_name: str):
+    # snapshots como time-series: trackedAt (datetime) + meta {dueño, postId, account, hashtags}
+    return get_collection_by(coll_name + SERIES_SUFFIX)
+
+async def ensure_series_collections() -> List[str]:
+    """Crea las colecciones time-series si no existen (antes de cualquier insert o índice:
+    un insert en una colección inexistente la crearía como colección normal)."""
+    db = get_client()[DB_NAME]
+    existing = set(await db.list_collection_names())
+    created = []
+    for base in (COLL_NAME, ADMIN_COLL_NAME):
+        name = base + SERIES_SUFFIX
+        if name in existing:
+            continue
+        try:
+            await db.create_collection(
+                name,
+                timeseries={"timeField": "trackedAt", "metaField": "meta", "granularity": SERIES_GRANULARITY},
+            )
+            created.append(name)
+        except CollectionInvalid:
+            pass  # la creó otra réplica en paralelo
+    return created
+
+
+# ---- índices ----
+# Cada índice se declara junto a las "formas" de consulta que cubre, tal como las
+# arma queries_controller._build_match_from_request y los pipelines de /dbquery.
+# Todos empiezan por el campo dueño (userId/adminId) porque ambos endpoints
+# siempre filtran por él; así el planner nunca cae en un COLLSCAN por usuario.
+IndexSpec = Tuple[str, List[Tuple[str, int]], List[str], Dict[str, Any]]
+
+def _index_specs(owner: str) -> List[IndexSpec]:
+    return [
+        (
+            f"{owner}_postedAt_postId",
+            [(owner, 1), ("postedAt", -1), ("postId", -1)],
+            [
+                f"{owner} =",
+                f"{owner} = & postedAt rango (datePostedFrom/datePostedTo)",
+                "sort postedAt desc, postId desc",
+                "keyset (cursor) sobre postedAt, postId",
+            ],
+            {},
+        ),
+        (
+            f"{owner}_postId_unique",
+            [(owner, 1), ("postId", 1)],
+            [
+                f"{owner} = & postId $in",
+                "upsert del último estado por (postId, dueño)",
+            ],
+            {"unique": True},
+        ),
+        (
+            f"{owner}_username_postedAt",
+            [(owner, 1), ("usernameTiktokAccount", 1), ("postedAt", -1)],
+            [
+                f"{owner} = & usernameTiktokAccount $in (tiktokUsernames)",
+                f"{owner} = & usernameTiktokAccount $in & postedAt rango",
+            ],
+            {},
+        ),
+        (
+            f"{owner}_hashtagList_postedAt",
+            [(owner, 1), ("hashtagList", 1), ("postedAt", -1)],
+            [
+                f"{owner} = & hashtagList $in (hashtags, multikey)",
+                f"{owner} = & hashtagList $in & postedAt rango",
+            ],
+            {},
+        ),
+        (
+            f"{owner}_soundId",
+            [(owner, 1), ("soundId", 1)],
+            [f"{owner} = & soundId $in"],
+            {},
+        ),
+        (
+            f"{owner}_views",
+            [(owner, 1), ("views", -1)],
+            [f"{owner} = & minViews/maxViews"],
+            {},
+        ),
+        (
+            f"{owner}_likes",
+            [(owner, 1), ("likes", -1)],
+            [f"{owner} = & minLikes/maxLikes"],
+            {},
+        ),
+        (
+            f"{owner}_totalInteractions",
+            [(owner, 1), ("totalInteractions", -1)],
+            [f"{owner} = & minTotalInteractions/maxTotalInteractions"],
+            {},
+        ),
+        (
+            f"{owner}_engagement",
+            [(owner, 1), ("engagement", -1)],
+            [f"{owner} = & minEngagement/maxEngagement"],
+            {},
+        ),
+    ]
+
+def _series_index_specs(owner: str) -> List[IndexSpec]:
+    return [
+        (
+            f"meta_{owner}_postId_trackedAt",
+            [(f"meta.{owner}", 1), ("meta.postId", 1), ("trackedAt", 1)],
+            [f"series/growth de un post (meta.{owner} = & meta.postId = & trackedAt rango)"],
+            {},
+        ),
+        (
+            f"meta_{owner}_account_trackedAt",
+            [(f"meta.{owner}", 1), ("meta.account", 1), ("trackedAt", 1)],
+            [f"series/growth de una cuenta (meta.{owner} = & meta.account = & trackedAt rango)"],
+            {},
+        ),
+        (
+            f"meta_{owner}_hashtags_trackedAt",
+            [(f"meta.{owner}", 1), ("meta.hashtags", 1), ("trackedAt", 1)],
+            [f"series/growth de un hashtag (meta.{owner} = & meta.hashtags = & trackedAt rango)"],
+            {},
+        ),
+    ]
+
+def _rollup_index_specs(key: str, covers: str):
+    def specs(owner: str) -> List[IndexSpec]:
+        return [
+            (
+                f"{owner}_{key}_unique",
+                [(owner, 1), *[(k, 1) for k in key.split("_")]],
+                [f"$inc/$max incremental por ({owner}, {key.replace('_', ', ')})", covers],
+                {"unique": True},
+            ),
+        ]
+    return specs
+
+# índices reemplazados por otros más completos; se borran en ensure_indexes
+def _obsolete_indexes(owner: str) -> List[str]:
+    return [
+        f"{owner}_datePosted_hourPosted",
+        # sobre los strings de fecha del formato anterior (ahora postedAt)
+        f"{owner}_datePosted_hourPosted_postId",
+        f"{owner}_username_datePosted",
+        f"{owner}_hashtagList_datePosted",
+    ]
+
+INDEX_PLAN: Dict[str, Tuple[str, Any]] = {
+    COLL_NAME: ("userId", _index_specs),
+    ADMIN_COLL_NAME: ("adminId", _index_specs),
+    COLL_NAME + SERIES_SUFFIX: ("userId", _series_index_specs),
+    ADMIN_COLL_NAME + SERIES_SUFFIX: ("adminId", _series_index_specs),
+    **{
+        base + suffix: (owner, _rollup_index_specs(key, f"dashboard desde rollups ({owner} =)"))
+        for base, owner in ((COLL_NAME, "userId"), (ADMIN_COLL_NAME, "adminId"))
+        for suffix, key in (
+            (DAILY_ROLLUP_SUFFIX, "day_account"),
+            (HASHTAG_ROLLUP_SUFFIX, "hashtag"),
+            (SOUND_ROLLUP_SUFFIX, "soundId"),
+        )
+    },
+}
+
+async def ensure_indexes() -> Dict[str, List[Dict[str, Any]]]:
+    """Crea los índices de ambas colecciones y reporta qué consultas cubre cada uno."""
+    report: Dict[str, List[Dict[str, Any]]] = {}
+    # create_index sobre una colección inexistente la crearía como colección normal
+    await ensure_series_collections()
+    for coll_name, (owner, specs) in INDEX_PLAN.items():
+        coll = get_collection_by(coll_name)
+        covers: Dict[str, List[str]] = {}
+        for name, keys, shapes, opts in specs(owner):
+            try:
+                await coll.create_index(keys, name=name, **opts)
+            except OperationFailure as e:
+                # p.ej. el índice único con duplicados previos: lo resuelve migrations.dedupe_latest
+                print(f"[indexes] {coll_name}.{name} no se pudo crear: {e}")
+                continue
+            covers[name] = shapes
+        existing = await coll.index_information()
+        for name in _obsolete_indexes(owner):
+            if name in existing:
+                await coll.drop_index(name)
+                existing.pop(name)
+        report[coll_name] = [
+            {"name": name, "key": info.get("key"), "covers": covers.get(name, [])}
+            for name, info in existing.items()
+        ]
+    _print_index_report(report)
+    return report
+
+def _print_index_report(report: Dict[str, List[Dict[str, Any]]]) -> None:
+    for coll_name, indexes in report.items():
+        print(f"[indexes] {DB_NAME}.{coll_name}: {len(indexes)} índices")
+        for idx in indexes:
+            keys = ", ".join(f"{k}:{d}" for k, d in idx["key"] or [])
+            print(f"  - {idx['name']} ({keys})")
+            for shape in idx["covers"]:
+                print(f"      cubre: {shape}")
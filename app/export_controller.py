@@ -0,0 +1,192 @@
+# export_controller.py
+# Exportación masiva de métricas con los mismos filtros que /dbquery
+# (_build_match_from_request), sin el tope de 10k items: se lee del cursor de
+# Motor por lotes y cada lote se codifica y se manda apenas está listo, así la
+# memoria no depende del tamaño de la exportación.
+#   csv      columnas de MetricOut (mismos valores que la respuesta JSON)
+#   arrow    Arrow IPC stream, un record batch por lote     (requiere pyarrow)
+#   parquet  un row group por lote                          (requiere pyarrow)
+# pyarrow es opcional (no está en requirements.txt; en Docker con WITH_PYARROW=1):
+# sin él arrow/parquet responden 501 y csv sigue andando.
+import csv
+import io
+import os
+from typing import Any, AsyncIterator, Dict, List, Optional
+from fastapi import HTTPException, APIRouter
+from fastapi.responses import StreamingResponse
+from db_mongo import get_collection, get_admin_collection
+from models import ExportRequest, MetricOut, METRIC_OUT_FIELDS, shape_metric
+from queries_controller import _build_match_from_request, _split_csv, _ITEM_SORT
+from metrics import span
+from migrations import typed_storage_done
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - pyarrow es opcional (solo arrow/parquet)
+    pa = pq = None
+
+router = APIRouter()
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+
+_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+# columnas de la respuesta que en Mongo salen de otro campo (y el nombre del formato anterior)
+_STORED_AS = {
+    "datePosted": ("postedAt", "datePosted"),
+    "hourPosted": ("postedAt", "hourPosted"),
+    "dateTracking": ("trackedAt", "dateTracking"),
+    "timeTracking": ("trackedAt", "timeTracking"),
+}
+
+
+# ---- helpers ----
+def _columns(fields: Optional[str]) -> List[str]:
+    cols = list(dict.fromkeys(_split_csv(fields))) or list(METRIC_OUT_FIELDS)
+    unknown = [c for c in cols if c not in METRIC_OUT_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail={
+            "Error": f"Campos desconocidos: {', '.join(unknown)}", "fields": list(METRIC_OUT_FIELDS)})
+    return cols
+
+def _projection(cols: List[str]) -> Dict[str, int]:
+    proj = {"_id": 0}
+    for c in cols:
+        for stored in _STORED_AS.get(c, (c,)):
+            proj[stored] = 1
+    return proj
+
+def _arrow_schema(cols: List[str]):
+    def arrow_type(annotation: Any):
+        if annotation is str:
+            return pa.string()
+        if annotation is float:
+            return pa.float64()
+        return pa.int64()  # int y Optional[int] (userId/adminId)
+    return pa.schema([pa.field(c, arrow_type(MetricOut.model_fields[c].annotation)) for c in cols])
+
+
+class _ChunkSink:
+    """Archivo de solo escritura para pyarrow: acumula lo escrito hasta que el
+    generador lo toma y lo manda al cliente."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._pos = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def take(self) -> bytes:
+        out = b"".join(self._parts)
+        self._parts.clear()
+        return out
+
+
+# ---- lectura y codificación por lotes ----
+async def _batches(coll, match: Dict[str, Any], cols: List[str], limit: Optional[int]) -> AsyncIterator[List[List[Any]]]:
+    # orden de /dbquery (índice dueño + postedAt); allow_disk_use por si el filtro no lo aprovecha
+    cursor = coll.find(match, _projection(cols)).sort(_ITEM_SORT).batch_size(EXPORT_BATCH_SIZE).allow_disk_use(True)
+    if limit:
+        cursor = cursor.limit(limit)
+    batch: List[List[Any]] = []
+    try:
+        async for doc in cursor:
+            row = shape_metric(doc)
+            batch.append([row[c] for c in cols])
+            if len(batch) >= EXPORT_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        # cliente desconectado a mitad de la descarga: no dejar el cursor abierto en el servidor
+        await cursor.close()
+
+async def _csv_chunks(batches: AsyncIterator[List[List[Any]]], cols: List[str]) -> AsyncIterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(cols)
+    async for batch in batches:
+        writer.writerows(batch)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+async def _arrow_chunks(batches: AsyncIterator[List[List[Any]]], cols: List[str], fmt: str) -> AsyncIterator[bytes]:
+    schema = _arrow_schema(cols)
+    sink = _ChunkSink()
+    writer = pa.ipc.new_stream(sink, schema) if fmt == "arrow" else pq.ParquetWriter(sink, schema)
+    async for batch in batches:
+        columns = [pa.array(list(values), type=f.type) for values, f in zip(zip(*batch), schema)]
+        writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=schema))
+        yield sink.take()
+    # fin del stream / footer de parquet
+    writer.close()
+    yield sink.take()
+
+async def _export_stream(coll, match: Dict[str, Any], cols: List[str], fmt: str, limit: Optional[int]) -> AsyncIterator[bytes]:
+    with span(f"export_{fmt}") as s:
+        s.items, s.bytes = 0, 0
+
+        async def counted() -> AsyncIterator[List[List[Any]]]:
+            async for batch in _batches(coll, match, cols, limit):
+                s.items += len(batch)
+                yield batch
+
+        chunks = _csv_chunks(counted(), cols) if fmt == "csv" else _arrow_chunks(counted(), cols, fmt)
+        async for chunk in chunks:
+            if chunk:
+                s.bytes += len(chunk)
+                yield chunk
+
+async def _run_export(req: ExportRequest, coll, id_field_name: str) -> StreamingResponse:
+    params = req.model_dump(exclude_none=True)
+    if params.get(id_field_name) is None:
+        raise HTTPException(status_code=400, detail={"Error": f"{id_field_name} es obligatorio"})
+    if req.format != "csv" and pa is None:
+        raise HTTPException(status_code=501, detail={"Error": f"El formato {req.format} requiere pyarrow instalado"})
+    cols = _columns(req.fields)
+    # validaciones antes de empezar a responder: con el stream en curso ya no se puede devolver un 400
+    legacy_dates = not await typed_storage_done(coll.name)
+    match = _build_match_from_request(params, id_field_name=id_field_name, legacy_dates=legacy_dates)
+    media_type, ext = _FORMATS[req.format]
+    filename = f"tiktok_metrics_{id_field_name}_{params[id_field_name]}.{ext}"
+    return StreamingResponse(
+        _export_stream(coll, match, cols, req.format, req.limit),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.post("/dbquery/user/export",
+    summary="Exportar métricas de usuario",
+    description="Todas las métricas que matchean los filtros de /dbquery/user, en streaming como CSV, Arrow o Parquet")
+async def dbquery_user_export(req: ExportRequest):
+    return await _run_export(req, get_collection(), "userId")
+
+@router.post("/dbquery/admin/export",
+    summary="Exportar métricas de admin",
+    description="Todas las métricas que matchean los filtros de /dbquery/admin, en streaming como CSV, Arrow o Parquet")
+async def dbquery_admin_export(req: ExportRequest):
+    return await _run_export(req, get_admin_collection(), "adminId")
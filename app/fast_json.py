@@ -0,0 +1,32 @@
+# fast_json.py
+# Respuesta JSON para datos que ya armamos nosotros con la forma de los modelos
+# (models.shape_metric): sin re-validar item por item con Pydantic y codificada
+# con orjson si está instalado. La salida es la misma que la de JSONResponse
+# (UTF-8 sin escapar, separadores compactos).
+import json
+from typing import Any
+
+from fastapi.responses import Response
+
+from metrics import span
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson es opcional
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        with span("response_encode") as s:
+            body = dumps(content)
+            s.bytes = len(body)
+        return body
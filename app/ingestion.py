@@ -0,0 +1,207 @@
+# ingestion.py
+# Pipeline de ingesta por streaming: páginas del dataset de Apify -> transformación
+# -> bulk upsert en chunks acotados. La descarga de la siguiente página corre en
+# paralelo con la inserción del chunk actual, y la cola entre ambas tiene tamaño
+# fijo, así que en memoria nunca hay más de (PAGE_BUFFER + 1) páginas a la vez.
+import asyncio
+import os
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from db_mongo import get_series_collection
+from tiktok_metrics_processor import parse_tracking, LEGACY_DATE_FIELDS
+from rollups import apply_rollups
+from query_cache import query_cache
+from metrics import span
+
+APIFY_PAGE_SIZE = int(os.getenv("APIFY_PAGE_SIZE", "500"))
+INSERT_CHUNK_SIZE = int(os.getenv("INSERT_CHUNK_SIZE", "500"))
+PAGE_BUFFER = int(os.getenv("INGEST_PAGE_BUFFER", "1"))
+# upserts en vuelo por chunk (uno por post: cada uno devuelve el estado anterior)
+UPSERT_CONCURRENCY = int(os.getenv("INGEST_UPSERT_CONCURRENCY", "32"))
+
+Doc = Dict[str, Any]
+
+# lo que se guarda en cada punto de la time-series *Series (la marca va en trackedAt)
+SERIES_FIELDS = ("views", "likes", "comments", "saves", "reposts", "totalInteractions", "engagement")
+
+
+class IngestResult:
+    def __init__(self) -> None:
+        self.received = 0
+        self.inserted = 0
+        self.upserted = 0
+        self.chunks: List[Dict[str, Any]] = []
+        # estado por target cuando el request se reparte en varios runs (fan-out)
+        self.targets: List[Dict[str, Any]] = []
+
+    def add_chunk(self, received: int, inserted: int, upserted: int) -> Dict[str, Any]:
+        self.received += received
+        self.inserted += inserted
+        self.upserted += upserted
+        progress = {
+            "chunk": len(self.chunks) + 1,
+            "received": received,
+            "inserted": inserted,
+            "upserted": upserted,
+            "totalInserted": self.inserted,
+        }
+        self.chunks.append(progress)
+        return progress
+
+
+_END = object()
+
+async def _produce(pages: AsyncIterator[List[Doc]], queue: asyncio.Queue) -> None:
+    try:
+        async for page in pages:
+            if page:
+                await queue.put(page)
+    except asyncio.CancelledError:
+        # el consumidor falló o se canceló y ya no lee la cola: un put podría no volver nunca
+        raise
+    except Exception as exc:  # se re-lanza del lado del consumidor (que sigue leyendo)
+        await queue.put(exc)
+        return
+    await queue.put(_END)
+
+_ROLLUP_PROJECTION = {
+    "_id": 0, "postId": 1, "userId": 1, "adminId": 1, "postedAt": 1, "datePosted": 1, "hourPosted": 1,
+    "usernameTiktokAccount": 1, "hashtagList": 1, "soundId": 1, "engagement": 1,
+    "views": 1, "likes": 1, "comments": 1, "saves": 1, "reposts": 1, "totalInteractions": 1,
+}
+
+def _snapshot(doc: Doc, owner_field: str, tracked_at) -> Doc:
+    # documento de la colección time-series *Series (ver db_mongo.ensure_series_collections)
+    snap = {
+        "trackedAt": tracked_at,
+        "meta": {
+            owner_field: doc.get(owner_field),
+            "postId": doc.get("postId"),
+            "account": doc.get("usernameTiktokAccount"),
+            "hashtags": doc.get("hashtagList") or [],
+        },
+    }
+    for f in SERIES_FIELDS:
+        snap[f] = doc.get(f)
+    return snap
+
+def series_snapshots(docs: Iterable[Doc], owner_field: str) -> List[Doc]:
+    # los snapshots legacy de *History traen la marca como strings: todo un scrape
+    # comparte la misma, así que se parsea una vez por par (fecha, hora)
+    parsed: Dict[Any, Any] = {}
+    out = []
+    for d in docs:
+        if d.get("trackedAt") is not None:
+            out.append(_snapshot(d, owner_field, d["trackedAt"]))
+            continue
+        key = (d.get("dateTracking"), d.get("timeTracking"))
+        if key not in parsed:
+            parsed[key] = parse_tracking(*key)
+        if parsed[key] is not None:
+            out.append(_snapshot(d, owner_field, parsed[key]))
+    return out
+
+async def _swap(coll, pid: Any, owner: Any, doc: Doc, owner_field: str, slots: asyncio.Semaphore) -> Optional[Doc]:
+    """Escribe el estado nuevo del post y devuelve el anterior en la misma operación."""
+    # $unset: un post guardado con el formato anterior queda tipado al re-scrapearlo
+    update = {"$set": doc, "$unset": {f: "" for f in LEGACY_DATE_FIELDS}}
+    async with slots:
+        try:
+            return await coll.find_one_and_update(
+                {"postId": pid, owner_field: owner}, update, projection=_ROLLUP_PROJECTION,
+                upsert=True, return_document=ReturnDocument.BEFORE,
+            )
+        except DuplicateKeyError:
+            # otra ingesta insertó el mismo post a la vez: ahora es un update y su estado es el anterior
+            return await coll.find_one_and_update(
+                {"postId": pid, owner_field: owner}, update, projection=_ROLLUP_PROJECTION,
+                return_document=ReturnDocument.BEFORE,
+            )
+
+async def upsert_latest(coll, docs: List[Doc], owner_field: str):
+    """Upsert idempotente del último estado por (postId, dueño) + snapshot en *Series
+    + deltas en los rollups + invalidación de la caché de consultas de esos dueños.
+
+    Devuelve (escritos, nuevos). Si el mismo post viene repetido en el chunk gana
+    la última aparición, así dos upserts del mismo key no compiten entre sí.
+    El estado anterior de cada post (para sumar solo deltas a los rollups) sale del
+    mismo find_one_and_update que escribe el nuevo: con un find aparte, dos ingestas
+    concurrentes del mismo dueño veían "sin anterior" y contaban el post dos veces.
+    """
+    latest: Dict[Any, Doc] = {}
+    for d in docs:
+        latest[(d.get("postId"), d.get(owner_field))] = d
+    if not latest:
+        return 0, 0
+    owners = list({owner for _, owner in latest})
+    slots = asyncio.Semaphore(max(1, UPSERT_CONCURRENCY))
+    with span("mongo_upsert_swap", items=len(latest)):
+        before = await asyncio.gather(*(_swap(coll, pid, owner, d, owner_field, slots)
+                                        for (pid, owner), d in latest.items()))
+    previous = dict(zip(latest, before))
+    inserted = sum(1 for old in before if old is None)
+    snapshots = series_snapshots(latest.values(), owner_field)
+    if snapshots:
+        with span("mongo_series_insert", items=len(snapshots)):
+            await get_series_collection(coll.name).insert_many(snapshots, ordered=False)
+    with span("rollups_apply", items=len(latest)):
+        await apply_rollups(coll.name, owner_field, ((d, previous[k]) for k, d in latest.items()))
+    await query_cache.invalidate(coll.name, owners)
+    return len(latest), inserted
+
+def _chunked(docs: List[Doc], size: int):
+    for i in range(0, len(docs), size):
+        yield docs[i:i + size]
+
+async def ingest_pages(
+    pages: AsyncIterator[List[Doc]],
+    transform: Callable[[List[Doc]], Any],
+    coll,
+    owner_field: str,
+    chunk_size: Optional[int] = None,
+    on_docs: Optional[Callable[[List[Doc]], None]] = None,
+    on_chunk: Optional[Callable[[Dict[str, Any]], Any]] = None,
+    result: Optional[IngestResult] = None,
+) -> IngestResult:
+    """Consume `pages`, transforma cada página y la upsertea en chunks de `chunk_size`.
+
+    `transform` puede ser sync o async (p.ej. parallel_transform.transform_batch_async).
+    `on_docs` recibe cada chunk ya escrito para que el endpoint arme
+    su respuesta; `on_chunk` recibe el progreso de cada chunk (puede ser async).
+    Con `result` varias ingestas concurrentes acumulan en el mismo IngestResult.
+    """
+    size = max(1, chunk_size or INSERT_CHUNK_SIZE)
+    result = result if result is not None else IngestResult()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, PAGE_BUFFER))
+    producer = asyncio.create_task(_produce(pages, queue))
+    try:
+        while True:
+            page = await queue.get()
+            if page is _END:
+                break
+            if isinstance(page, BaseException):
+                raise page
+            with span("transform", items=len(page)):
+                docs = transform(page)
+                if asyncio.iscoroutine(docs):
+                    docs = await docs
+            for chunk in _chunked(docs, size):
+                written, upserted = await upsert_latest(coll, chunk, owner_field)
+                if on_docs is not None:
+                    on_docs(chunk)
+                progress = result.add_chunk(len(chunk), written, upserted)
+                if on_chunk is not None:
+                    maybe = on_chunk(progress)
+                    if asyncio.iscoroutine(maybe):
+                        await maybe
+    finally:
+        if not producer.done():
+            producer.cancel()
+        try:
+            await producer
+        except (asyncio.CancelledError, Exception):
+            pass
+    return result
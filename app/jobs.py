@@ -0,0 +1,271 @@
+# jobs.py
+# Modo "job" para los scrapes largos: el endpoint encola y responde al toque con un
+# jobId; un pool de workers (tamaño fijo) corre fetch -> transform -> insert.
+# El estado vive en Mongo (colección ScrapeJobs): los workers reclaman jobs con
+# find_one_and_update, así que un job encolado o uno cuyo worker murió (heartbeat
+# vencido, p.ej. por un reinicio) lo vuelve a tomar cualquier réplica, hasta
+# SCRAPE_JOB_MAX_ATTEMPTS intentos.
+# El token de Apify no se guarda en claro: con SCRAPE_JOB_SECRETS_KEY (clave Fernet,
+# requiere el paquete cryptography) va cifrado en el documento; sin clave queda solo
+# en memoria del proceso que recibió el request y ese job no lo toma otra réplica
+# (la réplica lo mantiene vivo con holderBeatAt; si deja de hacerlo, el job falla).
+import asyncio
+import json
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+
+from db_mongo import get_collection_by
+from metrics import logger, span
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:  # pragma: no cover - solo hace falta con SCRAPE_JOB_SECRETS_KEY
+    Fernet = InvalidToken = None
+
+JOBS_COLL_NAME = os.getenv("MONGODB_JOBS_COLLECTION", "ScrapeJobs")
+JOB_WORKERS = int(os.getenv("SCRAPE_JOB_WORKERS", "2"))
+JOB_MAX_PENDING = int(os.getenv("SCRAPE_JOB_MAX_PENDING", "100"))
+JOB_POLL_SECS = float(os.getenv("SCRAPE_JOB_POLL_SECS", "5"))
+JOB_HEARTBEAT_SECS = float(os.getenv("SCRAPE_JOB_HEARTBEAT_SECS", "30"))
+JOB_STALE_SECS = float(os.getenv("SCRAPE_JOB_STALE_SECS", "180"))
+JOB_MAX_ATTEMPTS = int(os.getenv("SCRAPE_JOB_MAX_ATTEMPTS", "3"))
+JOB_SECRETS_KEY = os.getenv("SCRAPE_JOB_SECRETS_KEY", "")
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+_TOKEN_LOST = {"Error": "El token de Apify del job ya no está disponible (réplica reiniciada); reenviar el request"}
+
+# handler(payload, on_chunk) -> dict con el resultado (inserted, chunks, ...)
+JobHandler = Callable[[Dict[str, Any], Callable[[Dict[str, Any]], Awaitable[None]]], Awaitable[Dict[str, Any]]]
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+def _now() -> datetime:
+    return datetime.now(tz=timezone.utc)
+
+
+class JobManager:
+    def __init__(self, workers: int = JOB_WORKERS, max_pending: int = JOB_MAX_PENDING,
+                 max_attempts: int = JOB_MAX_ATTEMPTS, secrets_key: str = JOB_SECRETS_KEY):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.max_attempts = max(1, max_attempts)
+        self._handlers: Dict[str, JobHandler] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._fernet = None
+        if secrets_key:
+            if Fernet is None:
+                raise RuntimeError("SCRAPE_JOB_SECRETS_KEY requiere el paquete 'cryptography'")
+            self._fernet = Fernet(secrets_key)
+        # sin clave: secretos de los jobs de esta réplica, solo en memoria
+        self.instance = uuid.uuid4().hex
+        self._secrets: Dict[str, Dict[str, Any]] = {}
+
+    def register(self, kind: str, handler: JobHandler) -> None:
+        self._handlers[kind] = handler
+
+    @property
+    def coll(self):
+        return get_collection_by(JOBS_COLL_NAME)
+
+    async def start(self) -> None:
+        await self.coll.create_index([("status", 1), ("createdAt", 1)], name="status_createdAt")
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._holder_beat()))
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _seal(self, job_id: str, secrets: Dict[str, Any]) -> Dict[str, Any]:
+        """Campos del documento para `secrets`: cifrados, o solo una marca de esta réplica."""
+        if not secrets:
+            return {"secrets": None, "secretsHolder": None, "holderBeatAt": None}
+        if self._fernet is not None:
+            return {"secrets": self._fernet.encrypt(json.dumps(secrets).encode()).decode(),
+                    "secretsHolder": None, "holderBeatAt": None}
+        self._secrets[job_id] = secrets
+        return {"secrets": None, "secretsHolder": self.instance, "holderBeatAt": _now()}
+
+    def _unseal(self, job: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Secretos del job; None si no se pueden recuperar (réplica que murió / otra clave)."""
+        if job.get("secretsHolder"):
+            return self._secrets.get(job["_id"]) if job["secretsHolder"] == self.instance else None
+        if not job.get("secrets"):
+            return {}
+        if isinstance(job["secrets"], dict):
+            return job["secrets"]  # encolado antes del cifrado
+        if self._fernet is None:
+            return None
+        try:
+            return json.loads(self._fernet.decrypt(job["secrets"].encode()))
+        except InvalidToken:
+            return None
+
+    async def submit(self, kind: str, payload: Dict[str, Any], secrets: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Encola un job. `secrets` no se guarda en claro y se borra al terminar el job."""
+        if kind not in self._handlers:
+            raise ValueError(f"tipo de job desconocido: {kind}")
+        # los huérfanos (réplica dueña del token muerta) no cuentan: los va a fallar _fail_abandoned
+        stale = _now() - timedelta(seconds=JOB_STALE_SECS)
+        pending = await self.coll.count_documents(
+            {"status": QUEUED, "$or": [{"secretsHolder": None}, {"holderBeatAt": {"$gte": stale}}]},
+            limit=self.max_pending,
+        )
+        if pending >= self.max_pending:
+            raise JobQueueFull()
+        now = _now()
+        job_id = uuid.uuid4().hex
+        job = {
+            "_id": job_id,
+            "kind": kind,
+            "status": QUEUED,
+            "request": payload,
+            **self._seal(job_id, secrets or {}),
+            "createdAt": now,
+            "startedAt": None,
+            "finishedAt": None,
+            "heartbeatAt": None,
+            "attempts": 0,
+            "progress": {"chunks": 0, "inserted": 0},
+            "result": None,
+            "error": None,
+        }
+        try:
+            await self.coll.insert_one(job)
+        except BaseException:
+            self._secrets.pop(job_id, None)
+            raise
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self.coll.find_one({"_id": job_id}, {"secrets": 0, "secretsHolder": 0, "holderBeatAt": 0})
+
+    async def _holder_beat(self) -> None:
+        # los jobs encolados con el token en memoria de esta réplica siguen vivos
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECS)
+            try:
+                await self.coll.update_many({"status": QUEUED, "secretsHolder": self.instance},
+                                            {"$set": {"holderBeatAt": _now()}})
+            except Exception as e:
+                logger.warning("scrape job holder heartbeat failed: %s", e)
+
+    async def _fail_abandoned(self) -> None:
+        stale = _now() - timedelta(seconds=JOB_STALE_SECS)
+        # worker muerto en el último intento: no se reintenta más, queda como fallido
+        await self.coll.update_many(
+            {"status": RUNNING, "heartbeatAt": {"$lt": stale}, "attempts": {"$gte": self.max_attempts}},
+            {"$set": {"status": FAILED, "finishedAt": _now(),
+                      "error": {"Error": f"El job se interrumpió {self.max_attempts} veces sin terminar"}},
+             "$unset": {"secrets": ""}},
+        )
+        # encolado con el token en memoria de una réplica que ya no late: nadie lo puede correr
+        await self.coll.update_many(
+            {"status": QUEUED, "secretsHolder": {"$nin": [None, self.instance]}, "holderBeatAt": {"$lt": stale}},
+            {"$set": {"status": FAILED, "finishedAt": _now(), "error": _TOKEN_LOST}},
+        )
+
+    async def _claim(self) -> Optional[Dict[str, Any]]:
+        now = _now()
+        stale = now - timedelta(seconds=JOB_STALE_SECS)
+        return await self.coll.find_one_and_update(
+            {
+                "kind": {"$in": list(self._handlers)},
+                "$or": [
+                    # con el token solo en memoria de otra réplica, el job es de esa réplica
+                    {"status": QUEUED, "secretsHolder": {"$in": [None, self.instance]}},
+                    {"status": RUNNING, "heartbeatAt": {"$lt": stale}, "attempts": {"$lt": self.max_attempts}},
+                ],
+            },
+            {
+                "$set": {"status": RUNNING, "startedAt": now, "heartbeatAt": now,
+                         "progress": {"chunks": 0, "inserted": 0}},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("createdAt", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _heartbeat(self, mine: Dict[str, Any]) -> None:
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECS)
+            try:
+                await self.coll.update_one(mine, {"$set": {"heartbeatAt": _now()}})
+            except Exception as e:
+                # un fallo suelto no puede cortar el latido: el job quedaría vencido y otro lo retomaría
+                logger.warning("scrape job %s heartbeat failed: %s", mine["_id"], e)
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        job_id = job["_id"]
+        # este intento: si el job se reclamó en otro worker, attempts ya no coincide
+        # y las escrituras de acá no pisan las del intento nuevo
+        mine = {"_id": job_id, "status": RUNNING, "attempts": job["attempts"]}
+
+        async def on_chunk(progress: Dict[str, Any]) -> None:
+            await self.coll.update_one(
+                mine,
+                {"$set": {"heartbeatAt": _now(), "progress.chunks": progress["chunk"],
+                          "progress.inserted": progress["totalInserted"]}},
+            )
+
+        beat = asyncio.create_task(self._heartbeat(mine))
+        try:
+            secrets = self._unseal(job)
+            if secrets is None:
+                raise HTTPException(status_code=410, detail=_TOKEN_LOST)
+            payload = {**job["request"], **secrets}
+            with span("job_" + job["kind"]):
+                result = await self._handlers[job["kind"]](payload, on_chunk)
+            update = {"status": SUCCEEDED, "result": result, "error": None}
+        except asyncio.CancelledError:
+            # apagado del proceso: el job queda RUNNING y otro worker lo retoma cuando venza el heartbeat
+            raise
+        except HTTPException as e:
+            update = {"status": FAILED, "error": e.detail}
+        except Exception as e:
+            logger.exception("scrape job %s failed", job_id)
+            update = {"status": FAILED, "error": {"Error": str(e)}}
+        finally:
+            beat.cancel()
+        update["finishedAt"] = _now()
+        self._secrets.pop(job_id, None)
+        res = await self.coll.update_one(mine, {"$set": update, "$unset": {"secrets": ""}})
+        if res.matched_count == 0:
+            logger.warning("scrape job %s attempt %s finished after being reclaimed; result dropped",
+                           job_id, job["attempts"])
+
+    async def _worker(self) -> None:
+        while True:
+            # se limpia antes de reclamar para no perder un submit concurrente
+            self._wakeup.clear()
+            try:
+                await self._fail_abandoned()
+                job = await self._claim()
+            except Exception as e:
+                logger.warning("scrape job claim failed: %s", e)
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=JOB_POLL_SECS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+
+manager = JobManager()
@@ -0,0 +1,162 @@
+# metrics.py
+# Spans de tiempo por etapa (run del actor, páginas del dataset, transform,
+# escritura en Mongo, agregaciones, encoding de la respuesta) con conteo de items
+# y tamaño en bytes, agregados en histogramas en memoria y expuestos en formato
+# de texto de Prometheus en GET /metrics. Cada span también sale por logging
+# (nivel DEBUG) para poder seguir un request puntual.
+import asyncio
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("microservicio3")
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# los runs del actor pueden tardar minutos
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+ITEM_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+BYTE_BUCKETS = (1_024, 10_240, 102_400, 1_048_576, 10_485_760, 104_857_600)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Histogram:
+    """Histograma acumulativo por combinación de labels (formato Prometheus)."""
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float], labelnames: Sequence[str]):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        # labels -> [conteo por bucket (no acumulado), suma, total]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        i = bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self._series.items()):
+            base = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labelnames, labels))
+            sep = "," if base else ""
+            acc = 0
+            for bound, c in zip(self.buckets, counts):
+                acc += c
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{_fmt(bound)}"}} {acc}')
+            lines.append(f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{base}}} {total}")
+            lines.append(f"{self.name}_count{{{base}}} {count}")
+        return lines
+
+    def reset(self) -> None:
+        self._series.clear()
+
+
+class Counter:
+    """Contador monótono por combinación de labels (formato Prometheus)."""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str]):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        if METRICS_ENABLED:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            base = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labelnames, labels))
+            lines.append(f"{self.name}{{{base}}} {_fmt(value)}")
+        return lines
+
+    def reset(self) -> None:
+        self._values.clear()
+
+
+STAGE_SECONDS = Histogram("tiktok_stage_duration_seconds", "Duración de cada etapa del pipeline",
+                          DURATION_BUCKETS, ("stage", "status"))
+STAGE_ITEMS = Histogram("tiktok_stage_items", "Items procesados por cada ejecución de la etapa",
+                        ITEM_BUCKETS, ("stage",))
+STAGE_BYTES = Histogram("tiktok_stage_bytes", "Bytes producidos por cada ejecución de la etapa",
+                        BYTE_BUCKETS, ("stage",))
+HTTP_SECONDS = Histogram("http_request_duration_seconds", "Duración de los requests HTTP (hasta los headers)",
+                         DURATION_BUCKETS, ("method", "route", "status"))
+
+APIFY_RUNS = Counter("tiktok_apify_runs_total",
+                     "Pedidos de run del actor: started (run nuevo), coalesced (se sumó a uno en curso), reused (run reciente)",
+                     ("outcome",))
+
+REGISTRY: List[Any] = [STAGE_SECONDS, STAGE_ITEMS, STAGE_BYTES, HTTP_SECONDS, APIFY_RUNS]
+
+
+class Span:
+    __slots__ = ("stage", "items", "bytes", "status")
+
+    def __init__(self, stage: str, items: Optional[int] = None, nbytes: Optional[int] = None):
+        self.stage = stage
+        self.items = items
+        self.bytes = nbytes
+        self.status = "ok"
+
+
+@contextmanager
+def span(stage: str, items: Optional[int] = None, nbytes: Optional[int] = None) -> Iterator[Span]:
+    """Mide el bloque como una etapa; items/bytes se pueden completar dentro (s.items = ...)."""
+    s = Span(stage, items, nbytes)
+    t0 = time.perf_counter()
+    try:
+        yield s
+    except asyncio.CancelledError:
+        s.status = "cancelled"
+        raise
+    except BaseException:
+        s.status = "error"
+        raise
+    finally:
+        _finish(s, time.perf_counter() - t0)
+
+
+def _finish(s: Span, secs: float) -> None:
+    if METRICS_ENABLED:
+        STAGE_SECONDS.observe(secs, s.stage, s.status)
+        if s.items is not None:
+            STAGE_ITEMS.observe(s.items, s.stage)
+        if s.bytes is not None:
+            STAGE_BYTES.observe(s.bytes, s.stage)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("span stage=%s status=%s secs=%.6f items=%s bytes=%s",
+                     s.stage, s.status, secs, s.items, s.bytes)
+
+
+def observe_request(method: str, route: str, status: int, secs: float) -> None:
+    if METRICS_ENABLED:
+        HTTP_SECONDS.observe(secs, method, route, str(status))
+
+
+def render() -> str:
+    lines: List[str] = []
+    for h in REGISTRY:
+        lines.extend(h.render())
+    return "\n".join(lines) + "\n"
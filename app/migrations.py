@@ -0,0 +1,275 @@
+# migrations.py
+# Migraciones de datos idempotentes. Se ejecutan en el arranque (lifespan) y también
+# se pueden lanzar a mano:  python migrations.py
+# Cada paso terminado se registra en SchemaMigrations y no se repite.
+# Los pasos "online" (start_online_migrations) corren por lotes en segundo plano
+# con el servicio ya atendiendo; si se cortan, el siguiente arranque sigue donde quedaron.
+import asyncio
+import os
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from db_mongo import (
+    get_collection_by, get_series_collection, ensure_series_collections,
+    COLL_NAME, ADMIN_COLL_NAME, HISTORY_SUFFIX,
+)
+from ingestion import series_snapshots
+from rollups import rebuild_rollups
+from tiktok_metrics_processor import parse_tracking, LEGACY_DATE_FIELDS
+from metrics import logger
+
+MIGRATIONS_COLL_NAME = os.getenv("MONGODB_MIGRATIONS_COLLECTION", "SchemaMigrations")
+OWNER_FIELDS = {COLL_NAME: "userId", ADMIN_COLL_NAME: "adminId"}
+
+# lo que dedupe_latest copia a *History de cada duplicado (y backfill_series pasa a *Series)
+_HISTORY_SNAPSHOT_FIELDS = (
+    "views", "likes", "comments", "saves", "reposts",
+    "totalInteractions", "engagement", "dateTracking", "timeTracking",
+)
+
+def _unique(array: Any) -> Dict[str, Any]:
+    # sin repetidos y en el orden en que aparecen (como tiktok_metrics_processor._hashtag_list):
+    # el rebuild de los rollups hace $unwind y contaría dos veces un tag repetido
+    return {"$reduce": {
+        "input": array,
+        "initialValue": [],
+        "in": {"$cond": [{"$in": ["$$this", "$$value"]}, "$$value", {"$concatArrays": ["$$value", ["$$this"]]}]},
+    }}
+
+# hashtags guardado como "#a #B #A" -> hashtagList ["#a", "#b"]
+_HASHTAG_LIST_FROM_STRING = {
+    "$let": {
+        "vars": {
+            "parts": {
+                "$split": [{"$toLower": {"$ifNull": ["$hashtags", ""]}}, " "]
+            }
+        },
+        "in": _unique({
+            "$filter": {
+                "input": "$$parts",
+                "cond": {
+                    "$and": [
+                        {"$ne": ["$$this", ""]},
+                        {"$ne": ["$$this", "n/a"]},
+                    ]
+                },
+            }
+        }),
+    }
+}
+
+async def backfill_hashtag_list(coll_name: str) -> int:
+    """Completa hashtagList en documentos guardados antes de que existiera el campo."""
+    coll = get_collection_by(coll_name)
+    result = await coll.update_many(
+        {"hashtagList": {"$exists": False}},
+        [{"$set": {"hashtagList": _HASHTAG_LIST_FROM_STRING}}],
+    )
+    return result.modified_count
+
+async def dedupe_hashtag_list(coll_name: str) -> int:
+    """Quita tags repetidos de hashtagList (backfill anterior); si hubo, reconstruye los rollups."""
+    coll = get_collection_by(coll_name)
+    result = await coll.update_many(
+        {"hashtagList.1": {"$exists": True},
+         "$expr": {"$lt": [{"$size": {"$setUnion": ["$hashtagList", []]}}, {"$size": "$hashtagList"}]}},
+        [{"$set": {"hashtagList": _unique("$hashtagList")}}],
+    )
+    if result.modified_count:
+        await rebuild_rollups(coll_name)
+    return result.modified_count
+
+async def dedupe_latest(coll_name: str) -> int:
+    """Deja un solo documento (el más reciente) por (postId, dueño).
+
+    Antes de borrar, copia todos los documentos como snapshots a la colección
+    *History con su mismo _id ($merge keepExisting), así el paso es re-ejecutable
+    y no se pierde la historia de métricas que hoy vive en los duplicados.
+    """
+    owner = OWNER_FIELDS[coll_name]
+    coll = get_collection_by(coll_name)
+    project = {"_id": 1, "postId": 1, owner: 1, **{f: 1 for f in _HISTORY_SNAPSHOT_FIELDS}}
+    await coll.aggregate([
+        {"$project": project},
+        {"$merge": {"into": coll_name + HISTORY_SUFFIX, "on": "_id",
+                    "whenMatched": "keepExisting", "whenNotMatched": "insert"}},
+    ], allowDiskUse=True).to_list(None)
+    removed = 0
+    groups = coll.aggregate([
+        {"$group": {"_id": {"postId": "$postId", "owner": f"${owner}"},
+                    "ids": {"$push": "$_id"}, "n": {"$sum": 1}}},
+        {"$match": {"n": {"$gt": 1}}},
+    ], allowDiskUse=True)
+    async for g in groups:
+        # ObjectId crece con el tiempo de inserción -> el mayor es el último scrape
+        older = sorted(g["ids"])[:-1]
+        res = await coll.delete_many({"_id": {"$in": older}})
+        removed += res.deleted_count
+    # índice que servía al $group por postId; lo reemplaza el único (dueño, postId)
+    if f"{owner}_postId_id" in await coll.index_information():
+        await coll.drop_index(f"{owner}_postId_id")
+    return removed
+
+async def _once(step: str, fn: Callable[[], Awaitable[int]]) -> int:
+    done = get_collection_by(MIGRATIONS_COLL_NAME)
+    if await done.find_one({"_id": step}):
+        return 0
+    n = await fn()
+    await done.update_one(
+        {"_id": step},
+        {"$set": {"doneAt": datetime.now(tz=timezone.utc), "affected": n}},
+        upsert=True,
+    )
+    return n
+
+SERIES_BACKFILL_BATCH = 1000
+
+async def _copy_to_series(coll_name: str, owner: str, batch: List[Dict[str, Any]]) -> int:
+    # account y hashtags (meta de la time-series) salen del último estado del post
+    base = {}
+    async for d in get_collection_by(coll_name).find(
+        {"postId": {"$in": list({s.get("postId") for s in batch})}},
+        {"_id": 0, "postId": 1, owner: 1, "usernameTiktokAccount": 1, "hashtagList": 1},
+    ):
+        base[(d.get("postId"), d.get(owner))] = d
+    docs = [{**base.get((s.get("postId"), s.get(owner)), {}), **s} for s in batch]
+    snapshots = series_snapshots(docs, owner)
+    if snapshots:
+        await get_series_collection(coll_name).insert_many(snapshots, ordered=False)
+    return len(snapshots)
+
+async def backfill_series(coll_name: str) -> int:
+    """Copia los snapshots de *History a la time-series *Series (trackedAt desde
+    dateTracking/timeTracking). Desde esta versión la ingesta escribe solo en *Series."""
+    owner = OWNER_FIELDS[coll_name]
+    history = get_collection_by(coll_name + HISTORY_SUFFIX)
+    n = 0
+    batch: List[Dict[str, Any]] = []
+    async for snap in history.find({}, {"_id": 0}).batch_size(SERIES_BACKFILL_BATCH):
+        batch.append(snap)
+        if len(batch) >= SERIES_BACKFILL_BATCH:
+            n += await _copy_to_series(coll_name, owner, batch)
+            batch = []
+    if batch:
+        n += await _copy_to_series(coll_name, owner, batch)
+    return n
+
+TYPED_MIGRATION_BATCH = int(os.getenv("TYPED_MIGRATION_BATCH", "1000"))
+# textos que el formato anterior guardaba como "N/A"
+_NA_TEXT_FIELDS = ("postId", "usernameTiktokAccount", "postURL", "hashtags", "soundId", "soundURL", "regionPost")
+
+def _owner_id(value: Any) -> Optional[int]:
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return None  # "N/A"
+
+def _utc(dt: Optional[datetime]) -> Optional[datetime]:
+    return dt.astimezone(timezone.utc) if dt else None
+
+def _typed_fields(doc: Dict[str, Any], owner: str, keep_key: bool = False) -> Dict[str, Any]:
+    typed: Dict[str, Any] = {
+        "postedAt": _utc(parse_tracking(doc.get("datePosted"), doc.get("hourPosted"))),
+        # siempre se escribe (aunque sea None): marca el documento como migrado
+        "trackedAt": _utc(parse_tracking(doc.get("dateTracking"), doc.get("timeTracking"))),
+    }
+    if not keep_key:
+        typed[owner] = _owner_id(doc.get(owner))
+    for f in _NA_TEXT_FIELDS:
+        if doc.get(f) == "N/A" and not (keep_key and f == "postId"):
+            typed[f] = None
+    return typed
+
+async def type_storage(coll_name: str) -> int:
+    """Pasa los documentos del formato anterior al tipado: postedAt/trackedAt como
+    datetime en lugar de los strings de fecha/hora, None en lugar de "N/A" y el id
+    del dueño como int. Por lotes y solo sobre lo que falta (sin trackedAt): se puede
+    cortar y relanzar, y no pisa un post que la ingesta re-escribió mientras tanto."""
+    owner = OWNER_FIELDS[coll_name]
+    coll = get_collection_by(coll_name)
+    pending = {"trackedAt": {"$exists": False}}
+    unset = {f: "" for f in LEGACY_DATE_FIELDS}
+    project = {"_id": 1, owner: 1, **{f: 1 for f in LEGACY_DATE_FIELDS + _NA_TEXT_FIELDS}}
+    n = 0
+    while True:
+        batch = await coll.find(pending, project).limit(TYPED_MIGRATION_BATCH).to_list(TYPED_MIGRATION_BATCH)
+        if not batch:
+            return n
+        ops = [UpdateOne({"_id": d["_id"], **pending}, {"$set": _typed_fields(d, owner), "$unset": unset})
+               for d in batch]
+        try:
+            n += (await coll.bulk_write(ops, ordered=False)).modified_count
+        except BulkWriteError as e:
+            n += e.details.get("nModified", 0)
+            # "N/A" -> None en el dueño o el postId choca con el índice único (dueño, postId)
+            # si ya existe ese post con la clave tipada: se migra igual, conservando la clave
+            # anterior (sin tocarla el update no puede volver a chocar)
+            retry = [UpdateOne({"_id": batch[err["index"]]["_id"], **pending},
+                               {"$set": _typed_fields(batch[err["index"]], owner, keep_key=True), "$unset": unset})
+                     for err in e.details.get("writeErrors", [])]
+            if retry:
+                n += (await coll.bulk_write(retry, ordered=False)).modified_count
+        # cede el loop entre lotes: los requests siguen atendiéndose
+        await asyncio.sleep(0)
+
+# colecciones con typedStorage terminado (una vez visto no vuelve a consultarse)
+_typed_done: Dict[str, bool] = {}
+
+async def typed_storage_done(coll_name: str) -> bool:
+    """True si ya no quedan documentos con el formato anterior en `coll_name`.
+    Mientras sea False las consultas también filtran por los campos legacy."""
+    if _typed_done.get(coll_name):
+        return True
+    if await get_collection_by(MIGRATIONS_COLL_NAME).find_one({"_id": f"{coll_name}.typedStorage"}, {"_id": 1}):
+        _typed_done[coll_name] = True
+    return bool(_typed_done.get(coll_name))
+
+def _print_report(report: Dict[str, Dict[str, int]]) -> None:
+    for coll_name, steps in report.items():
+        for step, n in steps.items():
+            if n:
+                print(f"[migrations] {coll_name}.{step}: {n} documentos actualizados")
+
+async def run_online_migrations() -> Dict[str, Dict[str, int]]:
+    report: Dict[str, Dict[str, int]] = {}
+    for coll_name in (COLL_NAME, ADMIN_COLL_NAME):
+        report[coll_name] = {
+            "typedStorage": await _once(f"{coll_name}.typedStorage", lambda: type_storage(coll_name)),
+        }
+    _print_report(report)
+    return report
+
+def start_online_migrations() -> "asyncio.Task[Any]":
+    async def run() -> None:
+        try:
+            await run_online_migrations()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("migraciones online: falló, se reintenta en el próximo arranque")
+    return asyncio.create_task(run())
+
+async def run_migrations() -> Dict[str, Dict[str, int]]:
+    report: Dict[str, Dict[str, int]] = {}
+    # las time-series tienen que existir antes del primer insert
+    await ensure_series_collections()
+    for coll_name in (COLL_NAME, ADMIN_COLL_NAME):
+        report[coll_name] = {
+            "hashtagList": await _once(f"{coll_name}.hashtagList", lambda: backfill_hashtag_list(coll_name)),
+            "hashtagListDedupe": await _once(f"{coll_name}.hashtagListDedupe", lambda: dedupe_hashtag_list(coll_name)),
+            "dedupeLatest": await _once(f"{coll_name}.dedupeLatest", lambda: dedupe_latest(coll_name)),
+            # primera carga de los rollups desde lo que ya estaba guardado
+            "rollups": await _once(f"{coll_name}.rollups", lambda: rebuild_rollups(coll_name)),
+            "series": await _once(f"{coll_name}.series", lambda: backfill_series(coll_name)),
+        }
+    _print_report(report)
+    return report
+
+async def _main() -> None:
+    await run_migrations()
+    await run_online_migrations()
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -1,5 +1,7 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Literal
+from datetime import datetime
+from tiktok_metrics_processor import local_date_time
 
 
 class ApifyRequest(BaseModel):
@@ -14,6 +16,16 @@ class ApifyRequest(BaseModel):
     profileSorting: Optional[str] = Field(None, description="Ordenamiento de perfiles (e.g., 'latest')")
     userId: Optional[int] = Field(None, description="ID del usuario (para endpoint /normalized)")
     adminId: Optional[int] = Field(None, description="ID del admin (para endpoint /admin/normalized)")
+    chunkSize: Optional[int] = Field(None, ge=1, description="Tamaño de cada chunk de inserción (por defecto INSERT_CHUNK_SIZE)")
+    includeData: Optional[bool] = Field(True, description="Devolver los documentos en la respuesta (False = solo conteos y progreso)")
+    asyncJob: Optional[bool] = Field(False, description="Encolar como job y responder de inmediato con su jobId")
+    topN: Optional[int] = Field(5, ge=1, description="Posts por hashtag en la respuesta admin")
+    rankBy: Optional[Literal["views", "engagement", "totalInteractions"]] = Field("views", description="Métrica del ranking admin")
+    incremental: Optional[bool] = Field(False, description="Traer solo posts desde el último scrape de estos profiles/hashtags (oldestPostDate automático)")
+    refreshDays: Optional[int] = Field(None, ge=0, description="Días antes del watermark que se vuelven a scrapear para refrescar métricas (por defecto INCREMENTAL_REFRESH_DAYS)")
+    fanOut: Optional[bool] = Field(False, description="Un run del actor por target (profile/hashtag/keyword) en paralelo, con estado por target")
+    fanOutBatchSize: Optional[int] = Field(1, ge=1, description="Targets por run en modo fanOut")
+    fanOutConcurrency: Optional[int] = Field(None, ge=1, description="Runs simultáneos en modo fanOut (por defecto APIFY_FANOUT_CONCURRENCY)")
 
 
 class MetricOut(BaseModel):
@@ -40,14 +52,85 @@ class MetricOut(BaseModel):
     adminId: Optional[int] = None
 
 
+METRIC_OUT_FIELDS = tuple(MetricOut.model_fields)
+# campos de texto que en Mongo quedan en None cuando falta el dato; la respuesta mantiene "N/A"
+_NA_FIELDS = tuple(k for k, f in MetricOut.model_fields.items() if f.annotation is str)
+
+
+def shape_metric(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Dict con las claves de MetricOut en su orden, sin validar con Pydantic.
+
+    Para documentos que armamos nosotros (normalizados o leídos de Mongo): arma
+    datePosted/hourPosted y dateTracking/timeTracking (hora de Lima) desde
+    postedAt/trackedAt, pone "N/A" en los textos que faltan, deja fuera los campos
+    extra (hashtagList, _id...) y replica las coerciones que MetricOut aplicaba
+    (engagement float, ids no numéricos -> None). Acepta también documentos
+    guardados con el formato anterior (strings), mientras dura la migración.
+    """
+    out = {k: doc.get(k) for k in METRIC_OUT_FIELDS}
+    posted, tracked = doc.get("postedAt"), doc.get("trackedAt")
+    if isinstance(posted, datetime):
+        out["datePosted"], out["hourPosted"] = local_date_time(posted)
+    if isinstance(tracked, datetime):
+        out["dateTracking"], out["timeTracking"] = local_date_time(tracked)
+    for k in _NA_FIELDS:
+        if out[k] is None:
+            out[k] = "N/A"
+    engagement = out["engagement"]
+    if engagement is not None:
+        out["engagement"] = float(engagement)
+    for owner in ("userId", "adminId"):
+        if not isinstance(out[owner], int) or isinstance(out[owner], bool):
+            out[owner] = None
+    return out
+
+
+class ChunkProgress(BaseModel):
+    chunk: int = Field(..., description="Número de chunk (1..n)")
+    received: int = Field(..., description="Documentos normalizados en el chunk")
+    inserted: int = Field(..., description="Documentos escritos (nuevos + actualizados) en el chunk")
+    upserted: int = Field(0, description="Posts nuevos en el chunk")
+    totalInserted: int = Field(..., description="Acumulado insertado hasta este chunk")
+
+
+class TargetStatus(BaseModel):
+    target: str = Field(..., description="Target del run (p.ej. profiles:usuario o hashtags:fyp)")
+    status: Literal["succeeded", "failed"]
+    received: int = Field(0, description="Documentos normalizados (sin repetidos de otros targets)")
+    inserted: int = 0
+    upserted: int = 0
+    duplicates: int = Field(0, description="Posts descartados porque ya los trajo otro target")
+    error: Optional[Dict[str, Any]] = None
+
+
 class InsertResponse(BaseModel):
-    inserted: int = Field(..., description="Número de documentos insertados")
+    inserted: int = Field(..., description="Número de documentos escritos (nuevos + actualizados)")
+    upserted: int = Field(0, description="Número de posts nuevos (no existían para este dueño)")
     data: List[MetricOut] = Field(..., description="Lista de métricas de TikTok")
+    chunks: List[ChunkProgress] = Field(default_factory=list, description="Progreso de inserción por chunk")
+    targets: List[TargetStatus] = Field(default_factory=list, description="Estado por target (solo con fanOut)")
 
 
-class QueryRequest(BaseModel):
-    """Request para consultar métricas almacenadas en la base de datos"""
-    
+class JobStatus(BaseModel):
+    """Estado de un scrape ejecutado en modo job"""
+    jobId: str = Field(..., description="Id del job")
+    kind: str = Field(..., description="user | admin")
+    status: str = Field(..., description="queued | running | succeeded | failed")
+    createdAt: datetime
+    startedAt: Optional[datetime] = None
+    finishedAt: Optional[datetime] = None
+    attempts: int = Field(0, description="Veces que un worker tomó el job")
+    progress: Dict[str, int] = Field(default_factory=dict, description="Chunks e insertados hasta ahora")
+    inserted: Optional[int] = Field(None, description="Documentos escritos (al terminar)")
+    upserted: Optional[int] = Field(None, description="Posts nuevos (al terminar)")
+    chunks: List[ChunkProgress] = Field(default_factory=list, description="Progreso por chunk (al terminar)")
+    targets: List[TargetStatus] = Field(default_factory=list, description="Estado por target (fanOut, al terminar)")
+    error: Optional[Any] = None
+
+
+class QueryFilters(BaseModel):
+    """Filtros de /dbquery (compartidos con la exportación)"""
+
     # Identificadores (usa UNO: userId para /user, adminId para /admin)
     userId: Optional[int] = Field(None, description="Id del usuario (para /dbquery/user)")
     adminId: Optional[int] = Field(None, description="Id del admin (para /dbquery/admin)")
@@ -76,8 +159,89 @@ class QueryRequest(BaseModel):
     maxEngagement: Optional[float] = Field(None, description="Máximo de engagement")
 
 
+class QueryRequest(QueryFilters):
+    """Request para consultar métricas almacenadas en la base de datos"""
+
+    # Paginación (keyset sobre postedAt, postId)
+    pageSize: Optional[int] = Field(None, ge=1, le=10_000, description="Items por página (por defecto y máximo 10000)")
+    cursor: Optional[str] = Field(None, description="nextCursor devuelto por la página anterior")
+    stream: Optional[bool] = Field(False, description="Responder NDJSON en streaming directo desde el cursor")
+    dashboardOnly: Optional[bool] = Field(False, description="Solo dashboard, sin items (sin otros filtros se responde desde los rollups)")
+
+
 class QueryResponse(BaseModel):
     """Response con métricas y dashboard"""
     items: List[MetricOut] = Field(..., description="Lista de métricas encontradas")
     count: int = Field(..., description="Número total de items")
-    dashboard: List[Dict[str, Any]] = Field(..., description="Datos del dashboard/estadísticas")
\ No newline at end of file
+    dashboard: List[Dict[str, Any]] = Field(..., description="Datos del dashboard/estadísticas (solo en la primera página; vacío con cursor)")
+    nextCursor: Optional[str] = Field(None, description="Cursor para la siguiente página (None si no hay más)")
+
+
+class ExportRequest(QueryFilters):
+    """Exportación completa (sin tope de items) de lo que matchean los filtros"""
+    format: Literal["csv", "arrow", "parquet"] = Field("csv", description="csv | arrow (Arrow IPC stream) | parquet")
+    fields: Optional[str] = Field(None, description="Columnas separadas por coma (por defecto todas las de MetricOut)")
+    limit: Optional[int] = Field(None, ge=1, description="Máximo de filas (por defecto sin límite)")
+
+
+class SeriesRequest(BaseModel):
+    """Serie temporal de métricas de UN post, cuenta o hashtag (usa uno solo)"""
+    userId: Optional[int] = Field(None, description="Id del usuario (para /dbquery/user/*)")
+    adminId: Optional[int] = Field(None, description="Id del admin (para /dbquery/admin/*)")
+    postId: Optional[str] = Field(None, description="Id del post")
+    tiktokUsername: Optional[str] = Field(None, description="Username de la cuenta")
+    hashtag: Optional[str] = Field(None, description="Hashtag (con o sin #)")
+    trackedFrom: Optional[datetime] = Field(None, description="Desde (por defecto SERIES_DEFAULT_DAYS atrás)")
+    trackedTo: Optional[datetime] = Field(None, description="Hasta (por defecto ahora)")
+    bucket: Literal["hour", "day", "week"] = Field("day", description="Tamaño de cada punto de la serie")
+
+
+class SeriesPoint(BaseModel):
+    t: datetime = Field(..., description="Inicio del bucket")
+    posts: int = Field(..., description="Posts con datos en el bucket")
+    views: int
+    likes: int
+    comments: int
+    saves: int
+    reposts: int
+    totalInteractions: int
+    engagement: float
+    viewsDelta: Optional[int] = Field(None, description="Vistas ganadas desde el bucket anterior")
+    likesDelta: Optional[int] = None
+    viewsPerHour: Optional[float] = None
+    likesPerHour: Optional[float] = None
+    engagementChange: Optional[float] = Field(None, description="Cambio de engagement desde el bucket anterior")
+
+
+class SeriesResponse(BaseModel):
+    scope: Dict[str, str] = Field(..., description="Post, cuenta o hashtag consultado")
+    bucket: str
+    points: List[SeriesPoint]
+
+
+class GrowthRequest(SeriesRequest):
+    """Crecimiento por post en el rango (para una cuenta/hashtag: ranking de posts)"""
+    rankBy: Literal["viewsPerHour", "likesPerHour", "engagementChange"] = Field("viewsPerHour")
+    limit: int = Field(20, ge=1, le=500, description="Posts en la respuesta")
+
+
+class PostGrowth(BaseModel):
+    postId: str
+    account: Optional[str] = None
+    firstTrackedAt: datetime
+    lastTrackedAt: datetime
+    snapshots: int
+    views: int
+    likes: int
+    engagement: float
+    viewsDelta: int
+    likesDelta: int
+    viewsPerHour: Optional[float] = None
+    likesPerHour: Optional[float] = None
+    engagementChange: float
+
+
+class GrowthResponse(BaseModel):
+    scope: Dict[str, str]
+    rankBy: str
+    posts: List[PostGrowth]
@@ -0,0 +1,74 @@
+# parallel_transform.py
+# Modo paralelo opcional de transform_batch: reparte los items crudos de Apify en
+# shards sobre un ProcessPoolExecutor y junta los resultados en el orden de entrada.
+# Por debajo del umbral se queda inline (mandar dicts entre procesos cuesta más que
+# normalizarlos); ver benchmarks/bench_parallel_transform.py para el punto de cruce.
+# La ingesta transforma de a una página del dataset (APIFY_PAGE_SIZE items), así que
+# el umbral por defecto es una página y cada página se reparte en varios shards.
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from tiktok_metrics_processor import transform_batch, LIMA_TZ
+from ingestion import APIFY_PAGE_SIZE
+
+TRANSFORM_PARALLEL = os.getenv("TRANSFORM_PARALLEL", "false").lower() in ("1", "true", "yes")
+TRANSFORM_PARALLEL_THRESHOLD = int(os.getenv("TRANSFORM_PARALLEL_THRESHOLD", str(APIFY_PAGE_SIZE)))
+TRANSFORM_POOL_SIZE = int(os.getenv("TRANSFORM_POOL_SIZE", str(os.cpu_count() or 2)))
+TRANSFORM_CHUNK_SIZE = int(os.getenv("TRANSFORM_CHUNK_SIZE", str(max(1, APIFY_PAGE_SIZE // 4))))
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: no heredar el estado del loop/cliente Mongo del proceso padre
+        _pool = ProcessPoolExecutor(
+            max_workers=max(1, TRANSFORM_POOL_SIZE),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def transform_batch_async(
+    items: List[Dict[str, Any]],
+    username_fallback: Optional[str] = None,
+    owner_field: str = "userId",
+    owner_id: Optional[int] = None,
+    tracked_at: Optional[datetime] = None,
+    parallel: Optional[bool] = None,
+    threshold: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Igual que transform_batch; en modo paralelo no bloquea el event loop."""
+    parallel = TRANSFORM_PARALLEL if parallel is None else parallel
+    threshold = TRANSFORM_PARALLEL_THRESHOLD if threshold is None else threshold
+    if not parallel or len(items) < threshold:
+        return transform_batch(items, username_fallback, owner_field, owner_id, tracked_at)
+
+    size = max(1, chunk_size or TRANSFORM_CHUNK_SIZE)
+    # todos los shards comparten la misma marca de tracking
+    tracked_at = tracked_at or datetime.now(tz=LIMA_TZ)
+    loop = asyncio.get_running_loop()
+    pool = get_pool()
+    shards = [
+        loop.run_in_executor(
+            pool, transform_batch, items[i:i + size], username_fallback, owner_field, owner_id, tracked_at
+        )
+        for i in range(0, len(items), size)
+    ]
+    out: List[Dict[str, Any]] = []
+    for part in await asyncio.gather(*shards):
+        out.extend(part)
+    return out
@@ -1,9 +1,20 @@
 # queries_controller.py
+import asyncio
+import base64
+import json
+import os
 from typing import Any, Dict, List, Optional
 from fastapi import HTTPException, APIRouter
-from datetime import datetime
-from db_mongo import get_collection, get_collection_by
-from models import QueryRequest, QueryResponse
+from fastapi.responses import StreamingResponse
+from datetime import date, datetime, timedelta
+from db_mongo import get_collection, get_admin_collection
+from models import QueryRequest, QueryResponse, shape_metric
+from fast_json import FastJSONResponse
+from tiktok_metrics_processor import normalize_hashtag, LIMA_TZ
+from rollups import dashboard_facets
+from query_cache import query_cache
+from metrics import span
+from migrations import typed_storage_done
 
 router = APIRouter()
 
@@ -25,7 +36,17 @@ def _add_range(match: Dict[str, Any], field: str, min_v: Optional[float], max_v:
     if cond:
         match[field] = cond
 
-def _build_match_from_request(req: Dict[str, Any], id_field_name: str = "userId") -> Dict[str, Any]:
+def _local_day_start(day: str, field: str) -> datetime:
+    # "YYYY-MM-DD" (día de Lima) -> inicio de ese día como datetime con zona
+    try:
+        return datetime.combine(date.fromisoformat(day), datetime.min.time(), tzinfo=LIMA_TZ)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail={"Error": f"{field} debe ser YYYY-MM-DD"})
+
+def _build_match_from_request(req: Dict[str, Any], id_field_name: str = "userId",
+                              legacy_dates: bool = False) -> Dict[str, Any]:
+    """`legacy_dates`: mientras corre la migración a typedStorage, los documentos sin
+    migrar (sin trackedAt) se filtran por los strings datePosted."""
     match: Dict[str, Any] = {}
     if req.get(id_field_name) is not None:
         match[id_field_name] = req[id_field_name]
@@ -35,96 +56,252 @@ def _build_match_from_request(req: Dict[str, Any], id_field_name: str = "userId"
     _add_in(match, "regionPost", req.get("regionPost"))
     _add_in(match, "soundId", req.get("soundId"))
     _add_in(match, "soundURL", req.get("soundURL"))
+    # los días se interpretan en hora de Lima; datePostedTo incluye el día completo
     if req.get("datePostedFrom"):
-        match.setdefault("datePosted", {})["$gte"] = req["datePostedFrom"]
+        match.setdefault("postedAt", {})["$gte"] = _local_day_start(req["datePostedFrom"], "datePostedFrom")
     if req.get("datePostedTo"):
-        match.setdefault("datePosted", {})["$lte"] = req["datePostedTo"]
+        match.setdefault("postedAt", {})["$lt"] = _local_day_start(req["datePostedTo"], "datePostedTo") + timedelta(days=1)
+    if legacy_dates and "postedAt" in match:
+        legacy = {}
+        if req.get("datePostedFrom"):
+            legacy["$gte"] = req["datePostedFrom"]
+        if req.get("datePostedTo"):
+            legacy["$lte"] = req["datePostedTo"]
+        match["$or"] = [{"postedAt": match.pop("postedAt")},
+                        {"trackedAt": {"$exists": False}, "datePosted": legacy}]
     tags = _split_csv(req.get("hashtags"))
     if tags:
-        ors = []
-        for t in tags:
-            t_norm = t if t.startswith("#") else f"#{t}"
-            ors.append({"hashtags": {"$regex": rf"(^|\s){t_norm}(\s|$)", "$options": "i"}})
-        match["$or"] = ors
+        # hashtagList está normalizado en minúsculas -> lookup exacto sobre el índice multikey
+        tags_norm = list(dict.fromkeys(normalize_hashtag(t) for t in tags))
+        match["hashtagList"] = {"$in": tags_norm}
     _add_range(match, "views", req.get("minViews"), req.get("maxViews"))
     _add_range(match, "likes", req.get("minLikes"), req.get("maxLikes"))
     _add_range(match, "totalInteractions", req.get("minTotalInteractions"), req.get("maxTotalInteractions"))
     _add_range(match, "engagement", req.get("minEngagement"), req.get("maxEngagement"))
     return match
 
-def _dto_strip_id(doc: Dict[str, Any]) -> Dict[str, Any]:
-    return {k: v for k, v in doc.items() if k != "_id"}
+_ITEM_PROJECTION = {"_id": 0}
+# postId desempata para que el orden sea total y el keyset no salte ni repita posts
+_ITEM_SORT = [("postedAt", -1), ("postId", -1)]
+QUERY_MAX_PAGE_SIZE = 10_000
+STREAM_BATCH_SIZE = int(os.getenv("QUERY_STREAM_BATCH_SIZE", "1000"))
+
+# ---- paginación keyset ----
+def _encode_cursor(doc: Dict[str, Any]) -> str:
+    posted = doc.get("postedAt")
+    key = [posted.isoformat() if isinstance(posted, datetime) else None, doc.get("postId")]
+    raw = json.dumps(key, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(token: str) -> List[Any]:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        key = json.loads(raw)
+        if not isinstance(key, list) or len(key) != 2:
+            raise ValueError(token)
+        if key[0] is not None:
+            key[0] = datetime.fromisoformat(key[0])
+        return key
+    except Exception:
+        raise HTTPException(status_code=400, detail={"Error": "invalid cursor"})
+
+def _keyset_after(key: List[Any]) -> Dict[str, Any]:
+    # siguiente página en orden (postedAt, postId) descendente; los posts sin fecha
+    # (postedAt null) van al final
+    d, p = key
+    if d is None:
+        return {"postedAt": None, "postId": {"$lt": p}}
+    return {"$or": [
+        {"postedAt": {"$lt": d}},
+        {"postedAt": d, "postId": {"$lt": p}},
+        {"postedAt": None},
+    ]}
+
+async def _ndjson_lines(coll, query: Dict[str, Any], limit: Optional[int]):
+    # directo del cursor de Motor: un documento por línea, memoria constante
+    cursor = coll.find(query, _ITEM_PROJECTION).sort(_ITEM_SORT).batch_size(STREAM_BATCH_SIZE)
+    if limit:
+        cursor = cursor.limit(limit)
+    async for doc in cursor:
+        yield json.dumps(shape_metric(doc), ensure_ascii=False, default=str) + "\n"
 
 _DOW_ES = ["lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo"]
 
-def _compute_dashboard(docs: List[Dict[str, Any]], req: Dict[str, Any]) -> List[Dict[str, Any]]:
-    """Calcula métricas de dashboard básicas"""
+DASHBOARD_TOP_N = int(os.getenv("DASHBOARD_TOP_N", "10"))
+DASHBOARD_MAX_ACCOUNTS = int(os.getenv("DASHBOARD_MAX_ACCOUNTS", "50"))
+
+def _sum_fields(*fields: str) -> Dict[str, Any]:
+    return {f: {"$sum": f"${f}"} for f in fields}
+
+def _dashboard_pipeline(match: Dict[str, Any], legacy_dates: bool = False) -> List[Dict[str, Any]]:
+    """Un solo $facet sobre todo el match: totales y desgloses calculados en Mongo."""
+    posted: Any = "$postedAt"
+    if legacy_dates:
+        # documentos todavía sin migrar: la fecha sale de los strings (hora de Lima)
+        posted = {"$ifNull": ["$postedAt", {"$dateFromString": {
+            "dateString": {"$concat": ["$datePosted", "T", "$hourPosted"]}, "format": "%Y-%m-%dT%H:%M:%S",
+            "timezone": LIMA_TZ.key, "onError": None, "onNull": None,
+        }}]}
+    with_posted = {"$set": {"_posted": posted}}
+    per_group = {"posts": {"$sum": 1}, **_sum_fields("views"), "avgEngagement": {"$avg": "$engagement"}}
+    return [
+        {"$match": match},
+        {"$facet": {
+            "totals": [
+                {"$group": {
+                    "_id": None,
+                    "totalPosts": {"$sum": 1},
+                    "totalViews": {"$sum": "$views"},
+                    "totalLikes": {"$sum": "$likes"},
+                    "totalComments": {"$sum": "$comments"},
+                    "totalInteractions": {"$sum": "$totalInteractions"},
+                    "avgEngagement": {"$avg": "$engagement"},
+                }},
+            ],
+            "byDayOfWeek": [
+                with_posted,
+                {"$match": {"_posted": {"$type": "date"}}},
+                {"$group": {"_id": {"$isoDayOfWeek": {"date": "$_posted", "timezone": LIMA_TZ.key}}, **per_group}},
+                {"$sort": {"_id": 1}},
+            ],
+            "byHour": [
+                with_posted,
+                {"$match": {"_posted": {"$type": "date"}}},
+                {"$group": {"_id": {"$hour": {"date": "$_posted", "timezone": LIMA_TZ.key}}, **per_group}},
+                {"$sort": {"_id": 1}},
+            ],
+            "topHashtags": [
+                {"$unwind": "$hashtagList"},
+                {"$group": {"_id": "$hashtagList", **per_group}},
+                {"$sort": {"views": -1, "_id": 1}},
+                {"$limit": DASHBOARD_TOP_N},
+            ],
+            "topSounds": [
+                {"$match": {"soundId": {"$nin": [None, "N/A"]}}},
+                {"$group": {"_id": "$soundId", "soundURL": {"$first": "$soundURL"}, **per_group}},
+                {"$sort": {"views": -1, "_id": 1}},
+                {"$limit": DASHBOARD_TOP_N},
+            ],
+            "byAccount": [
+                {"$group": {
+                    "_id": "$usernameTiktokAccount",
+                    **per_group,
+                    **_sum_fields("likes", "comments", "totalInteractions"),
+                }},
+                {"$sort": {"views": -1, "_id": 1}},
+                {"$limit": DASHBOARD_MAX_ACCOUNTS},
+            ],
+        }},
+    ]
+
+def _round_avg(row: Dict[str, Any]) -> Dict[str, Any]:
+    row["avgEngagement"] = round(row.get("avgEngagement") or 0, 4)
+    return row
+
+def _format_dashboard(facets: Dict[str, Any]) -> List[Dict[str, Any]]:
     dash: List[Dict[str, Any]] = []
-    if not docs:
+    totals = (facets.get("totals") or [None])[0]
+    if not totals:
         return dash
-    
-    # Métricas totales
-    total_views = sum(d.get("views", 0) for d in docs)
-    total_likes = sum(d.get("likes", 0) for d in docs)
-    total_comments = sum(d.get("comments", 0) for d in docs)
-    total_interactions = sum(d.get("totalInteractions", 0) for d in docs)
-    avg_engagement = sum(d.get("engagement", 0) for d in docs) / len(docs) if docs else 0
-    
-    dash.append({
-        "metric": "totals",
-        "totalPosts": len(docs),
-        "totalViews": total_views,
-        "totalLikes": total_likes,
-        "totalComments": total_comments,
-        "totalInteractions": total_interactions,
-        "avgEngagement": round(avg_engagement, 4)
-    })
-    
+    totals.pop("_id", None)
+    dash.append(_round_avg({"metric": "totals", **totals}))
+
+    def rows(name: str, key: str, label=lambda v: v) -> None:
+        data = []
+        for r in facets.get(name) or []:
+            data.append(_round_avg({key: label(r.pop("_id")), **r}))
+        dash.append({"metric": name, "data": data})
+
+    # $isoDayOfWeek: 1 = lunes ... 7 = domingo
+    rows("byDayOfWeek", "day", lambda d: _DOW_ES[d - 1])
+    rows("byHour", "hour")
+    rows("topHashtags", "hashtag")
+    rows("topSounds", "soundId")
+    rows("byAccount", "usernameTiktokAccount")
     return dash
 
+async def _dashboard_from_rollups(coll, id_field_name: str, owner_id: Any) -> List[Dict[str, Any]]:
+    with span("dashboard_rollups"):
+        facets = await dashboard_facets(coll.name, id_field_name, owner_id, DASHBOARD_TOP_N, DASHBOARD_MAX_ACCOUNTS)
+    return _format_dashboard(facets)
+
+async def _compute_dashboard(coll, match: Dict[str, Any], legacy_dates: bool = False) -> List[Dict[str, Any]]:
+    """Calcula el dashboard en Mongo sobre todo el match (no solo la página devuelta)"""
+    with span("dashboard_aggregate"):
+        facets = await coll.aggregate(_dashboard_pipeline(match, legacy_dates), allowDiskUse=True).to_list(1)
+    return _format_dashboard(facets[0] if facets else {})
+
+async def _find_page(coll, query: Dict[str, Any], limit: int) -> List[Dict[str, Any]]:
+    with span("query_find") as s:
+        items = await coll.find(query, _ITEM_PROJECTION).sort(_ITEM_SORT).limit(limit).to_list(limit)
+        s.items = len(items)
+    return items
+
+async def _query_page(coll, id_field_name: str, match: Dict[str, Any], query: Dict[str, Any],
+                      page_size: int, dashboard_only: bool, legacy_dates: bool = False,
+                      first_page: bool = True) -> Dict[str, Any]:
+    if dashboard_only:
+        # sin filtros aparte del dueño -> rollups; con filtros -> $facet sobre los posts
+        if set(match) == {id_field_name}:
+            dashboard = await _dashboard_from_rollups(coll, id_field_name, match[id_field_name])
+        else:
+            dashboard = await _compute_dashboard(coll, match, legacy_dates)
+        return {"items": [], "count": 0, "dashboard": dashboard, "nextCursor": None}
+
+    # un documento por (postId, dueño) gracias al upsert -> find indexado, sin $group
+    # el dashboard (sobre el match completo) va solo en la primera página, en paralelo
+    # con el find: es el mismo para todas, recalcularlo en cada página multiplicaba el costo
+    if first_page:
+        items, dashboard = await asyncio.gather(
+            _find_page(coll, query, page_size + 1),
+            _compute_dashboard(coll, match, legacy_dates),
+        )
+    else:
+        items, dashboard = await _find_page(coll, query, page_size + 1), []
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_cursor = _encode_cursor(items[-1])
+    # ya con la forma de MetricOut: se cachea y se serializa sin re-validar
+    items = [shape_metric(d) for d in items]
+    return {"items": items, "count": len(items), "dashboard": dashboard, "nextCursor": next_cursor}
+
+async def _run_query(req: QueryRequest, coll, id_field_name: str):
+    params = req.model_dump(exclude_none=True)
+    legacy_dates = not await typed_storage_done(coll.name)
+    match = _build_match_from_request(params, id_field_name=id_field_name, legacy_dates=legacy_dates)
+    after = _decode_cursor(req.cursor) if req.cursor else None
+    query = {"$and": [match, _keyset_after(after)]} if after else match
+
+    if req.stream:
+        return StreamingResponse(_ndjson_lines(coll, query, req.pageSize), media_type="application/x-ndjson")
+
+    page_size = req.pageSize or QUERY_MAX_PAGE_SIZE
+    dashboard_only = bool(req.dashboardOnly)
+    result = await query_cache.get_or_compute(
+        coll.name,
+        match.get(id_field_name),
+        match,
+        {"pageSize": page_size, "cursor": req.cursor, "dashboardOnly": dashboard_only, "legacyDates": legacy_dates},
+        lambda: _query_page(coll, id_field_name, match, query, page_size, dashboard_only, legacy_dates,
+                            first_page=after is None),
+    )
+    return FastJSONResponse(result)
+
 @router.post("/dbquery/user",response_model=QueryResponse,
     summary="Consultar métricas de usuario",
     description="Consulta las métricas almacenadas en la base de datos para un usuario específico con múltiples filtros opcionales")
 async def dbquery_user(req: QueryRequest):
-    coll = get_collection()
-    match = _build_match_from_request(req.model_dump(exclude_none=True), id_field_name="userId")
-
-    pipeline = [
-        {"$match": match},
-        {"$sort": {"_id": -1}},
-        {"$group": {"_id": "$postId", "doc": {"$first": "$$ROOT"}}},
-        {"$replaceRoot": {"newRoot": "$doc"}},
-        {"$sort": {"datePosted": -1, "hourPosted": -1}},
-    ]
-    items = await coll.aggregate(pipeline).to_list(10_000)
-    items = [_dto_strip_id(d) for d in items]
-    dashboard = _compute_dashboard(items, req.model_dump(exclude_none=True))
-    return QueryResponse(
-        items=items, 
-        count=len(items), 
-        dashboard=dashboard
-    )
+    return await _run_query(req, get_collection(), "userId")
 
 @router.post("/dbquery/admin",response_model=QueryResponse,
     summary="Consultar métricas de admin",
     description="Consulta las métricas almacenadas en la base de datos para un administrador con múltiples filtros opcionales")
 async def dbquery_admin(req: QueryRequest):
-    coll = get_collection_by("AdminTiktokMetrics")
-    match = _build_match_from_request(req.model_dump(exclude_none=True), id_field_name="adminId")
+    return await _run_query(req, get_admin_collection(), "adminId")
 
-    pipeline = [
-        {"$match": match},
-        {"$sort": {"_id": -1}},
-        {"$group": {"_id": "$postId", "doc": {"$first": "$$ROOT"}}},
-        {"$replaceRoot": {"newRoot": "$doc"}},
-        {"$sort": {"datePosted": -1, "hourPosted": -1}},
-    ]
-    items = await coll.aggregate(pipeline).to_list(10_000)
-    items = [_dto_strip_id(d) for d in items]
-    dashboard = _compute_dashboard(items, req.model_dump(exclude_none=True))
-    
-    return QueryResponse(
-        items=items, 
-        count=len(items), 
-        dashboard=dashboard
-    )
+@router.get("/dbquery/cache/stats",
+    summary="Estadísticas de la caché de consultas",
+    description="Hits, misses, evicciones e invalidaciones de la caché de /dbquery (para dimensionarla)")
+async def dbquery_cache_stats():
+    return query_cache.stats()
@@ -0,0 +1,266 @@
+# query_cache.py
+# Caché de respuestas de /dbquery: LRU + TTL en proceso, con backend compartido
+# opcional (Redis) para varias réplicas. La clave es un hash canónico del match que
+# arma _build_match_from_request (+ paginación) y de la "versión" del dueño:
+# cada ingesta sube la versión de ese userId/adminId, así que sus entradas viejas
+# dejan de usarse sin tener que buscarlas (y en memoria además se borran).
+# En memoria el tope es por entradas y por bytes (tamaño del valor codificado en
+# JSON, aproximado); un valor más grande que QUERY_CACHE_MAX_VALUE_BYTES no se cachea.
+import abc
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set, Tuple
+
+from fast_json import orjson
+from metrics import logger
+
+QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "1024"))
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+QUERY_CACHE_MAX_VALUE_BYTES = int(os.getenv("QUERY_CACHE_MAX_VALUE_BYTES", str(8 * 1024 * 1024)))
+QUERY_CACHE_TTL_SECS = float(os.getenv("QUERY_CACHE_TTL_SECS", "300"))
+# vacío = solo memoria; redis://... = backend compartido (requiere el paquete redis)
+QUERY_CACHE_REDIS_URL = os.getenv("QUERY_CACHE_REDIS_URL", "")
+
+# tag que se invalida en cualquier ingesta del scope (consultas sin dueño)
+_ANY_OWNER = "*"
+
+
+class CacheBackend(abc.ABC):
+    """Interfaz de backend. Los valores son dicts JSON (más datetimes); un hit
+    tiene que devolver los mismos tipos que se guardaron."""
+
+    evictions = 0
+
+    @abc.abstractmethod
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abc.abstractmethod
+    async def set(self, key: str, value: Dict[str, Any], ttl: float, tags: Iterable[str], nbytes: int) -> None:
+        """`nbytes`: tamaño aproximado del valor (JSON codificado)."""
+
+    @abc.abstractmethod
+    async def version(self, tag: str) -> int:
+        ...
+
+    @abc.abstractmethod
+    async def invalidate(self, tag: str) -> None:
+        ...
+
+    def size(self) -> int:
+        return -1
+
+    def nbytes(self) -> int:
+        return -1
+
+
+class MemoryBackend(CacheBackend):
+    def __init__(self, max_entries: int = QUERY_CACHE_MAX_ENTRIES, max_bytes: int = QUERY_CACHE_MAX_BYTES):
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max(1, max_bytes)
+        # key -> (vence, valor, tags, bytes)
+        self._data: "OrderedDict[str, Tuple[float, Dict[str, Any], Tuple[str, ...], int]]" = OrderedDict()
+        self._by_tag: Dict[str, Set[str]] = {}
+        self._versions: Dict[str, int] = {}
+        self._bytes = 0
+        self.evictions = 0
+
+    def _drop(self, key: str) -> None:
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry[3]
+        for tag in entry[2]:
+            keys = self._by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_tag[tag]
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._drop(key)
+            return None
+        self._data.move_to_end(key)
+        return entry[1]
+
+    async def set(self, key: str, value: Dict[str, Any], ttl: float, tags: Iterable[str], nbytes: int) -> None:
+        tags = tuple(tags)
+        self._drop(key)
+        if nbytes > self.max_bytes:
+            return
+        self._data[key] = (time.monotonic() + ttl, value, tags, nbytes)
+        self._bytes += nbytes
+        for tag in tags:
+            self._by_tag.setdefault(tag, set()).add(key)
+        while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+            self._drop(next(iter(self._data)))
+            self.evictions += 1
+
+    async def version(self, tag: str) -> int:
+        return self._versions.get(tag, 0)
+
+    async def invalidate(self, tag: str) -> None:
+        self._versions[tag] = self._versions.get(tag, 0) + 1
+        for key in list(self._by_tag.get(tag, ())):
+            self._drop(key)
+
+    def size(self) -> int:
+        return len(self._data)
+
+    def nbytes(self) -> int:
+        return self._bytes
+
+
+# JSON con tipo para lo que no es JSON nativo: sin esto un datetime vuelve del
+# backend compartido como string y el hit no se parece al miss
+_TAGGED = "$qc"
+
+def _encode_default(obj: Any) -> Dict[str, str]:
+    if isinstance(obj, datetime):
+        return {_TAGGED: "datetime", "v": obj.isoformat()}
+    if isinstance(obj, date):
+        return {_TAGGED: "date", "v": obj.isoformat()}
+    raise TypeError(f"{type(obj).__name__} no se puede cachear")
+
+def _decode_hook(obj: Dict[str, Any]) -> Any:
+    kind = obj.get(_TAGGED)
+    if kind == "datetime":
+        return datetime.fromisoformat(obj["v"])
+    if kind == "date":
+        return date.fromisoformat(obj["v"])
+    return obj
+
+def _encode_value(value: Dict[str, Any]) -> str:
+    return json.dumps(value, default=_encode_default, separators=(",", ":"))
+
+def _decode_value(raw: Any) -> Dict[str, Any]:
+    return json.loads(raw, object_hook=_decode_hook)
+
+def _approx_size(value: Dict[str, Any]) -> int:
+    # el tamaño del JSON es una cota razonable de lo que pesa el valor (TypeError si no es JSON)
+    return len(orjson.dumps(value)) if orjson is not None else len(_encode_value(value))
+
+
+class RedisBackend(CacheBackend):
+    """Backend compartido entre réplicas. La invalidación es un INCR de la versión del tag."""
+
+    def __init__(self, url: str, prefix: str = "tiktokmetrics:qcache:"):
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError as e:
+            raise RuntimeError("QUERY_CACHE_REDIS_URL requiere el paquete 'redis'") from e
+        self._redis = redis_asyncio.from_url(url)
+        self._prefix = prefix
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = await self._redis.get(self._prefix + key)
+        return _decode_value(raw) if raw is not None else None
+
+    async def set(self, key: str, value: Dict[str, Any], ttl: float, tags: Iterable[str], nbytes: int) -> None:
+        try:
+            raw = _encode_value(value)
+        except TypeError as e:
+            # mejor no cachear que devolver otro tipo en el próximo hit
+            logger.warning("query cache: valor no cacheable (%s)", e)
+            return
+        await self._redis.set(self._prefix + key, raw, px=int(ttl * 1000))
+
+    async def version(self, tag: str) -> int:
+        raw = await self._redis.get(self._prefix + "v:" + tag)
+        return int(raw) if raw is not None else 0
+
+    async def invalidate(self, tag: str) -> None:
+        await self._redis.incr(self._prefix + "v:" + tag)
+
+
+class QueryCache:
+    def __init__(self, backend: CacheBackend, ttl: float = QUERY_CACHE_TTL_SECS, enabled: bool = QUERY_CACHE_ENABLED,
+                 max_value_bytes: int = QUERY_CACHE_MAX_VALUE_BYTES):
+        self.backend = backend
+        self.ttl = ttl
+        self.enabled = enabled
+        self.max_value_bytes = max_value_bytes
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.too_large = 0
+
+    @staticmethod
+    def _tags(scope: str, owner: Any) -> Tuple[str, ...]:
+        return (f"{scope}:{_ANY_OWNER}",) if owner is None else (f"{scope}:{owner}", f"{scope}:{_ANY_OWNER}")
+
+    @staticmethod
+    def canonical_key(scope: str, owner: Any, match: Dict[str, Any], extra: Dict[str, Any], versions: Iterable[int]) -> str:
+        payload = json.dumps([scope, owner, match, extra, list(versions)], sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def get_or_compute(
+        self,
+        scope: str,
+        owner: Any,
+        match: Dict[str, Any],
+        extra: Dict[str, Any],
+        compute: Callable[[], Awaitable[Dict[str, Any]]],
+    ) -> Dict[str, Any]:
+        if not self.enabled:
+            return await compute()
+        tags = self._tags(scope, owner)
+        versions = [await self.backend.version(t) for t in tags]
+        key = self.canonical_key(scope, owner, match, extra, versions)
+        cached = await self.backend.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        value = await compute()
+        try:
+            nbytes = _approx_size(value)
+        except TypeError as e:
+            logger.warning("query cache: valor no cacheable (%s)", e)
+            return value
+        if nbytes > self.max_value_bytes:
+            # p.ej. una página de 10k items: recalcularla sale más barato que retenerla
+            self.too_large += 1
+            return value
+        await self.backend.set(key, value, self.ttl, tags, nbytes)
+        return value
+
+    async def invalidate(self, scope: str, owners: Iterable[Any]) -> None:
+        """Se llama tras cada escritura de la ingesta para los dueños afectados."""
+        if not self.enabled:
+            return
+        tags = {f"{scope}:{_ANY_OWNER}"} | {f"{scope}:{o}" for o in owners if o is not None}
+        for tag in tags:
+            await self.backend.invalidate(tag)
+        self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRatio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.backend.evictions,
+            "invalidations": self.invalidations,
+            "entries": self.backend.size(),
+            "maxEntries": getattr(self.backend, "max_entries", -1),
+            "bytes": self.backend.nbytes(),
+            "maxBytes": getattr(self.backend, "max_bytes", -1),
+            "maxValueBytes": self.max_value_bytes,
+            "tooLarge": self.too_large,
+            "ttlSecs": self.ttl,
+        }
+
+
+query_cache = QueryCache(RedisBackend(QUERY_CACHE_REDIS_URL) if QUERY_CACHE_REDIS_URL else MemoryBackend())
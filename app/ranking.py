@@ -0,0 +1,82 @@
+# ranking.py
+# Top-N por hashtag para la respuesta del endpoint admin.
+# Se alimenta chunk a chunk (una sola pasada, índice invertido hashtag -> heap
+# acotado) y al final arma la lista concatenada en el orden de los hashtags
+# pedidos, sin repetir postId entre hashtags, igual que el orden histórico:
+# métrica desc y, a igualdad, el orden de llegada.
+import heapq
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+Doc = Dict[str, Any]
+
+RANK_METRICS: Dict[str, Callable[[Any], float]] = {
+    "views": lambda v: int(v or 0),
+    "engagement": lambda v: float(v or 0),
+    "totalInteractions": lambda v: int(v or 0),
+}
+DEFAULT_TOP_N = 5
+DEFAULT_RANK_BY = "views"
+
+
+def _score_fn(metric: str) -> Callable[[Doc], float]:
+    if metric not in RANK_METRICS:
+        raise ValueError(f"métrica de ranking no soportada: {metric}")
+    conv = RANK_METRICS[metric]
+    return lambda d: conv(d.get(metric))
+
+
+class TopNByHashtag:
+    """Top-N por hashtag con de-duplicación de postId entre hashtags.
+
+    Cada heap guarda hasta n * len(tags) candidatos: en el peor caso los hashtags
+    anteriores se quedan con n posts cada uno que también tienen este hashtag, y
+    aun así quedan n para él.
+    """
+
+    def __init__(self, tags: Iterable[str], n: int = DEFAULT_TOP_N, metric: str = DEFAULT_RANK_BY):
+        self.tags: List[str] = list(dict.fromkeys(tags))
+        self.n = max(1, n)
+        self._score = _score_fn(metric)
+        self._cap = self.n * max(1, len(self.tags))
+        self._heaps: Dict[str, List[Tuple[float, int, Doc]]] = {t: [] for t in self.tags}
+        self._seq = 0
+
+    def add(self, docs: Iterable[Doc]) -> None:
+        heaps, cap = self._heaps, self._cap
+        for d in docs:
+            self._seq += 1
+            entry = None
+            for tag in d.get("hashtagList") or ():
+                heap = heaps.get(tag)
+                if heap is None:
+                    continue
+                if entry is None:
+                    # a igual métrica gana el que llegó antes (-seq mayor)
+                    entry = (self._score(d), -self._seq, d)
+                if len(heap) < cap:
+                    heapq.heappush(heap, entry)
+                elif entry[:2] > heap[0][:2]:
+                    heapq.heapreplace(heap, entry)
+
+    def result(self) -> List[Doc]:
+        ordered: List[Doc] = []
+        seen_post_ids: set = set()
+        for tag in self.tags:
+            top: List[Doc] = []
+            for _, _, d in sorted(self._heaps[tag], key=lambda e: e[:2], reverse=True):
+                if str(d.get("postId")) in seen_post_ids:
+                    continue
+                top.append(d)
+                if len(top) == self.n:
+                    break
+            ordered.extend(top)
+            for d in top:
+                pid = str(d.get("postId"))
+                if pid:
+                    seen_post_ids.add(pid)
+        return ordered
+
+
+def rank_all(docs: List[Doc], metric: str = DEFAULT_RANK_BY) -> List[Doc]:
+    """Sin hashtags pedidos: todos los posts ordenados por la métrica desc (estable)."""
+    return sorted(docs, key=_score_fn(metric), reverse=True)
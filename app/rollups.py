@@ -0,0 +1,286 @@
+# rollups.py
+# Agregados mantenidos en la ingesta para responder dashboards sin tocar los posts:
+#   <base>DailyRollup    por (dueño, día, cuenta) + histograma por hora
+#   <base>HashtagRollup  por (dueño, hashtag)
+#   <base>SoundRollup    por (dueño, soundId)
+# Como la ingesta hace upsert del último estado de cada post, lo que se suma con
+# $inc es la diferencia entre el estado nuevo y el anterior (un post nuevo aporta
+# posts=1 y sus métricas completas; un re-scrape solo el delta de métricas).
+#
+# Reconstrucción / chequeo de consistencia a mano:
+#   python rollups.py rebuild
+#   python rollups.py check
+import asyncio
+import sys
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from db_mongo import (
+    get_collection_by, COLL_NAME, ADMIN_COLL_NAME,
+    DAILY_ROLLUP_SUFFIX, HASHTAG_ROLLUP_SUFFIX, SOUND_ROLLUP_SUFFIX,
+)
+from tiktok_metrics_processor import LIMA_TZ, local_date_time
+
+Doc = Dict[str, Any]
+OWNER_FIELDS = {COLL_NAME: "userId", ADMIN_COLL_NAME: "adminId"}
+
+_METRICS = ("views", "likes", "comments", "saves", "reposts", "totalInteractions")
+
+
+def _day_hour(doc: Doc) -> Tuple[Optional[str], Optional[str]]:
+    """("YYYY-MM-DD", "HH") del post en hora de Lima; los rollups siguen usando esas claves."""
+    posted = doc.get("postedAt")
+    if isinstance(posted, datetime):
+        day, time = local_date_time(posted)
+        return day, time[:2]
+    # documento guardado con el formato anterior (todavía sin migrar)
+    h = doc.get("hourPosted")
+    return doc.get("datePosted"), (h[:2] if isinstance(h, str) and h[:2].isdigit() else None)
+
+def _contributions(doc: Doc, owner_field: str) -> Dict[Tuple[str, Tuple], Dict[str, float]]:
+    """Lo que un post aporta a cada documento de rollup: {(suffix, key): {campo: valor}}."""
+    owner = doc.get(owner_field)
+    views = doc.get("views") or 0
+    engagement = doc.get("engagement") or 0
+    base = {"posts": 1, "views": views, "engagementSum": engagement}
+    out: Dict[Tuple[str, Tuple], Dict[str, float]] = {}
+
+    daily = dict(base)
+    for m in _METRICS[1:]:
+        daily[m] = doc.get(m) or 0
+    day, hour = _day_hour(doc)
+    if hour is not None:
+        daily[f"hours.{hour}.posts"] = 1
+        daily[f"hours.{hour}.views"] = views
+        daily[f"hours.{hour}.engagementSum"] = engagement
+    key = ((owner_field, owner), ("day", day), ("account", doc.get("usernameTiktokAccount")))
+    out[(DAILY_ROLLUP_SUFFIX, key)] = daily
+
+    for tag in doc.get("hashtagList") or ():
+        out[(HASHTAG_ROLLUP_SUFFIX, ((owner_field, owner), ("hashtag", tag)))] = dict(base)
+
+    sound = doc.get("soundId")
+    if sound and sound != "N/A":  # "N/A": formato anterior
+        out[(SOUND_ROLLUP_SUFFIX, ((owner_field, owner), ("soundId", sound)))] = dict(base)
+    return out
+
+async def apply_rollups(coll_name: str, owner_field: str, changes: Iterable[Tuple[Doc, Optional[Doc]]]) -> None:
+    """Aplica (nuevo, anterior) de cada post upserteado a las colecciones de rollup."""
+    deltas: Dict[Tuple[str, Tuple], Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    maxes: Dict[Tuple[str, Tuple], int] = {}
+    latest_sound_url: Dict[Tuple[str, Tuple], Any] = {}
+    for new, old in changes:
+        new_c = _contributions(new, owner_field)
+        old_c = _contributions(old, owner_field) if old else {}
+        for k, counters in new_c.items():
+            for f, v in counters.items():
+                deltas[k][f] += v
+            maxes[k] = max(maxes.get(k, 0), new.get("views") or 0)
+            if k[0] == SOUND_ROLLUP_SUFFIX:
+                latest_sound_url[k] = new.get("soundURL")
+        for k, counters in old_c.items():
+            for f, v in counters.items():
+                deltas[k][f] -= v
+
+    ops: Dict[str, List[UpdateOne]] = defaultdict(list)
+    for k in set(deltas) | set(maxes):
+        suffix, key = k
+        inc = {f: v for f, v in deltas.get(k, {}).items() if v}
+        update: Doc = {}
+        if inc:
+            # los contadores se acumulan como float; solo engagementSum es decimal
+            update["$inc"] = {f: (v if f.endswith("engagementSum") else int(v)) for f, v in inc.items()}
+        if k in maxes:
+            update["$max"] = {"maxViews": maxes[k]}
+        if k in latest_sound_url:
+            update["$set"] = {"soundURL": latest_sound_url[k]}
+        if update:
+            ops[suffix].append(UpdateOne(dict(key), update, upsert=True))
+    for suffix, batch in ops.items():
+        await get_collection_by(coll_name + suffix).bulk_write(batch, ordered=False)
+
+
+# ---- dashboard desde rollups ----
+def _avg(sum_field: str, count_field: str) -> Doc:
+    return {"$cond": [{"$gt": [f"${count_field}", 0]}, {"$divide": [f"${sum_field}", f"${count_field}"]}, 0]}
+
+_PER_GROUP = {"posts": {"$sum": "$posts"}, "views": {"$sum": "$views"}, "engagementSum": {"$sum": "$engagementSum"}}
+_WITH_AVG = {"$set": {"avgEngagement": _avg("engagementSum", "posts")}}
+_DROP_SUM = {"$unset": "engagementSum"}
+
+async def dashboard_facets(coll_name: str, owner_field: str, owner_id: Any, top_n: int, max_accounts: int) -> Doc:
+    """Mismas secciones que queries_controller._dashboard_pipeline, leídas de los rollups."""
+    match = {"$match": {owner_field: owner_id}}
+    daily = get_collection_by(coll_name + DAILY_ROLLUP_SUFFIX)
+    pipeline = [
+        match,
+        {"$facet": {
+            "totals": [
+                {"$group": {
+                    "_id": None,
+                    "totalPosts": {"$sum": "$posts"},
+                    "totalViews": {"$sum": "$views"},
+                    "totalLikes": {"$sum": "$likes"},
+                    "totalComments": {"$sum": "$comments"},
+                    "totalInteractions": {"$sum": "$totalInteractions"},
+                    "engagementSum": {"$sum": "$engagementSum"},
+                }},
+                {"$set": {"avgEngagement": _avg("engagementSum", "totalPosts")}},
+                _DROP_SUM,
+                {"$match": {"totalPosts": {"$gt": 0}}},
+            ],
+            "byDayOfWeek": [
+                {"$group": {
+                    "_id": {"$isoDayOfWeek": {"$dateFromString": {
+                        "dateString": "$day", "format": "%Y-%m-%d", "onError": None, "onNull": None,
+                    }}},
+                    **_PER_GROUP,
+                }},
+                {"$match": {"_id": {"$ne": None}, "posts": {"$gt": 0}}},
+                _WITH_AVG, _DROP_SUM,
+                {"$sort": {"_id": 1}},
+            ],
+            "byHour": [
+                {"$project": {"h": {"$objectToArray": {"$ifNull": ["$hours", {}]}}}},
+                {"$unwind": "$h"},
+                {"$group": {
+                    "_id": {"$toInt": "$h.k"},
+                    "posts": {"$sum": "$h.v.posts"},
+                    "views": {"$sum": "$h.v.views"},
+                    "engagementSum": {"$sum": "$h.v.engagementSum"},
+                }},
+                {"$match": {"posts": {"$gt": 0}}},
+                _WITH_AVG, _DROP_SUM,
+                {"$sort": {"_id": 1}},
+            ],
+            "byAccount": [
+                {"$group": {
+                    "_id": "$account",
+                    **_PER_GROUP,
+                    "likes": {"$sum": "$likes"},
+                    "comments": {"$sum": "$comments"},
+                    "totalInteractions": {"$sum": "$totalInteractions"},
+                }},
+                {"$match": {"posts": {"$gt": 0}}},
+                _WITH_AVG, _DROP_SUM,
+                {"$sort": {"views": -1, "_id": 1}},
+                {"$limit": max_accounts},
+            ],
+        }},
+    ]
+
+    def top(key: str, extra: Doc) -> List[Doc]:
+        return [
+            match,
+            {"$match": {"posts": {"$gt": 0}}},
+            {"$sort": {"views": -1, key: 1}},
+            {"$limit": top_n},
+            {"$project": {"_id": f"${key}", "posts": 1, "views": 1, **extra,
+                          "avgEngagement": _avg("engagementSum", "posts")}},
+        ]
+
+    facets, hashtags, sounds = await asyncio.gather(
+        daily.aggregate(pipeline).to_list(1),
+        get_collection_by(coll_name + HASHTAG_ROLLUP_SUFFIX).aggregate(top("hashtag", {})).to_list(top_n),
+        get_collection_by(coll_name + SOUND_ROLLUP_SUFFIX).aggregate(top("soundId", {"soundURL": 1})).to_list(top_n),
+    )
+    out = facets[0] if facets else {}
+    out["topHashtags"] = hashtags
+    out["topSounds"] = sounds
+    return out
+
+
+# ---- reconstrucción desde las colecciones crudas ----
+def _posted(fmt: str, legacy: Doc) -> Doc:
+    # postedAt en hora de Lima; los documentos sin migrar todavía traen los strings
+    return {"$ifNull": [{"$dateToString": {"date": "$postedAt", "format": fmt, "timezone": LIMA_TZ.key}}, legacy]}
+
+def _rebuild_pipelines(owner_field: str) -> Dict[str, List[Doc]]:
+    owner = f"${owner_field}"
+    legacy_hour = {"$cond": [{"$regexMatch": {"input": {"$ifNull": ["$hourPosted", ""]}, "regex": r"^\d{2}"}},
+                             {"$substrBytes": ["$hourPosted", 0, 2]}, None]}
+    sums = {"posts": {"$sum": 1}, "views": {"$sum": "$views"}, "engagementSum": {"$sum": "$engagement"},
+            "maxViews": {"$max": "$views"}}
+    return {
+        DAILY_ROLLUP_SUFFIX: [
+            {"$group": {
+                "_id": {"o": owner, "day": _posted("%Y-%m-%d", "$datePosted"), "account": "$usernameTiktokAccount",
+                        "hour": _posted("%H", legacy_hour)},
+                **sums,
+                **{m: {"$sum": f"${m}"} for m in _METRICS[1:]},
+            }},
+            {"$group": {
+                "_id": {"o": "$_id.o", "day": "$_id.day", "account": "$_id.account"},
+                **{f: {"$sum": f"${f}"} for f in ("posts", "views", "engagementSum", *_METRICS[1:])},
+                "maxViews": {"$max": "$maxViews"},
+                "hours": {"$push": {"k": "$_id.hour",
+                                    "v": {"posts": "$posts", "views": "$views", "engagementSum": "$engagementSum"}}},
+            }},
+            {"$project": {"_id": 0, owner_field: "$_id.o", "day": "$_id.day", "account": "$_id.account",
+                          "posts": 1, "views": 1, "engagementSum": 1, "maxViews": 1,
+                          **{m: 1 for m in _METRICS[1:]},
+                          "hours": {"$arrayToObject": {"$filter": {
+                              "input": "$hours", "cond": {"$ne": ["$$this.k", None]}}}}}},
+        ],
+        HASHTAG_ROLLUP_SUFFIX: [
+            {"$unwind": "$hashtagList"},
+            {"$group": {"_id": {"o": owner, "hashtag": "$hashtagList"}, **sums}},
+            {"$project": {"_id": 0, owner_field: "$_id.o", "hashtag": "$_id.hashtag",
+                          "posts": 1, "views": 1, "engagementSum": 1, "maxViews": 1}},
+        ],
+        SOUND_ROLLUP_SUFFIX: [
+            {"$match": {"soundId": {"$nin": [None, "N/A"]}}},
+            {"$group": {"_id": {"o": owner, "soundId": "$soundId"}, "soundURL": {"$last": "$soundURL"}, **sums}},
+            {"$project": {"_id": 0, owner_field: "$_id.o", "soundId": "$_id.soundId", "soundURL": 1,
+                          "posts": 1, "views": 1, "engagementSum": 1, "maxViews": 1}},
+        ],
+    }
+
+async def rebuild_rollups(coll_name: str) -> int:
+    """Recalcula los tres rollups de `coll_name` desde cero ($out reemplaza la colección, conserva índices)."""
+    coll = get_collection_by(coll_name)
+    total = 0
+    for suffix, pipeline in _rebuild_pipelines(OWNER_FIELDS[coll_name]).items():
+        await coll.aggregate(pipeline + [{"$out": coll_name + suffix}], allowDiskUse=True).to_list(None)
+        total += await get_collection_by(coll_name + suffix).estimated_document_count()
+    return total
+
+async def check_rollups(coll_name: str) -> List[Doc]:
+    """Compara totales por dueño entre la colección cruda y el rollup diario."""
+    owner_field = OWNER_FIELDS[coll_name]
+    group = lambda posts, views: {"$group": {"_id": f"${owner_field}", "posts": posts, "views": views}}
+    raw = await get_collection_by(coll_name).aggregate(
+        [group({"$sum": 1}, {"$sum": "$views"})], allowDiskUse=True).to_list(None)
+    rolled = await get_collection_by(coll_name + DAILY_ROLLUP_SUFFIX).aggregate(
+        [group({"$sum": "$posts"}, {"$sum": "$views"})], allowDiskUse=True).to_list(None)
+    by_owner = {r["_id"]: r for r in rolled}
+    mismatches = []
+    for r in raw:
+        got = by_owner.pop(r["_id"], {"posts": 0, "views": 0})
+        if (got["posts"], got["views"]) != (r["posts"], r["views"]):
+            mismatches.append({owner_field: r["_id"], "raw": [r["posts"], r["views"]], "rollup": [got["posts"], got["views"]]})
+    for owner, got in by_owner.items():
+        if got["posts"] or got["views"]:
+            mismatches.append({owner_field: owner, "raw": [0, 0], "rollup": [got["posts"], got["views"]]})
+    return mismatches
+
+
+async def _main(cmd: str) -> None:
+    for coll_name in OWNER_FIELDS:
+        if cmd == "rebuild":
+            n = await rebuild_rollups(coll_name)
+            print(f"[rollups] {coll_name}: {n} documentos de rollup reconstruidos")
+        elif cmd == "check":
+            bad = await check_rollups(coll_name)
+            print(f"[rollups] {coll_name}: {len(bad)} dueños con diferencias")
+            for m in bad:
+                print(f"  - {m}")
+        else:
+            raise SystemExit("uso: python rollups.py rebuild|check")
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else ""))
@@ -0,0 +1,220 @@
+# series_controller.py
+# Consultas sobre la time-series *Series (un snapshot por post y scrape):
+#   /dbquery/{user,admin}/series -> serie por bucket (hora/día/semana) de un post,
+#                                   una cuenta o un hashtag, con deltas y tasas por hora
+#   /dbquery/{user,admin}/growth -> crecimiento de cada post en el rango, rankeado
+# Todo se calcula en Mongo ($dateTrunc, $densify/$fill, $setWindowFields): Python
+# solo arma el pipeline y valida. Requiere MongoDB >= 5.3.
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Tuple
+from zoneinfo import ZoneInfo
+from fastapi import HTTPException, APIRouter
+from db_mongo import COLL_NAME, ADMIN_COLL_NAME, get_series_collection
+from models import SeriesRequest, SeriesResponse, GrowthRequest, GrowthResponse
+from tiktok_metrics_processor import normalize_hashtag
+from metrics import span
+
+router = APIRouter()
+
+SERIES_TIMEZONE = os.getenv("SERIES_TIMEZONE", "America/Lima")
+SERIES_DEFAULT_DAYS = int(os.getenv("SERIES_DEFAULT_DAYS", "30"))
+SERIES_MAX_POINTS = int(os.getenv("SERIES_MAX_POINTS", "2000"))
+
+_BUCKET_SECONDS = {"hour": 3600, "day": 86400, "week": 7 * 86400}
+_VALUE_FIELDS = ("views", "likes", "comments", "saves", "reposts", "totalInteractions")
+
+
+# ---- helpers ----
+def _aware(dt: datetime) -> datetime:
+    # sin zona = hora local del scraping (igual que dateTracking/timeTracking)
+    return dt if dt.tzinfo else dt.replace(tzinfo=ZoneInfo(SERIES_TIMEZONE))
+
+def _utc(dt: Any) -> Any:
+    # motor devuelve datetimes UTC sin zona
+    return dt.replace(tzinfo=timezone.utc) if isinstance(dt, datetime) and dt.tzinfo is None else dt
+
+def _scope(req: SeriesRequest) -> Tuple[str, str, Dict[str, str]]:
+    """(campo de meta, valor, scope para la respuesta); exactamente uno de postId/tiktokUsername/hashtag."""
+    given = [(k, v.strip()) for k, v in (("postId", req.postId), ("tiktokUsername", req.tiktokUsername),
+                                          ("hashtag", req.hashtag)) if v and v.strip()]
+    if len(given) != 1:
+        raise HTTPException(status_code=400, detail={"Error": "Indicar exactamente uno de postId, tiktokUsername o hashtag"})
+    kind, value = given[0]
+    if kind == "postId":
+        return "meta.postId", value, {"postId": value}
+    if kind == "tiktokUsername":
+        value = value.lstrip("@")
+        return "meta.account", value, {"tiktokUsername": value}
+    value = normalize_hashtag(value)
+    return "meta.hashtags", value, {"hashtag": value}
+
+def _match(req: SeriesRequest, owner_field: str) -> Tuple[Dict[str, Any], str, Dict[str, str]]:
+    owner_id = getattr(req, owner_field)
+    if owner_id is None:
+        raise HTTPException(status_code=400, detail={"Error": f"{owner_field} es obligatorio"})
+    field, value, scope = _scope(req)
+    tracked_to = _aware(req.trackedTo) if req.trackedTo else datetime.now(timezone.utc)
+    tracked_from = _aware(req.trackedFrom) if req.trackedFrom else tracked_to - timedelta(days=SERIES_DEFAULT_DAYS)
+    if tracked_from > tracked_to:
+        raise HTTPException(status_code=400, detail={"Error": "trackedFrom es posterior a trackedTo"})
+    points = (tracked_to - tracked_from).total_seconds() / _BUCKET_SECONDS[req.bucket]
+    if points > SERIES_MAX_POINTS:
+        raise HTTPException(status_code=400, detail={
+            "Error": f"El rango pide {int(points)} puntos de '{req.bucket}' (máximo {SERIES_MAX_POINTS}); usar un bucket mayor"})
+    match = {
+        f"meta.{owner_field}": owner_id,
+        field: value,
+        "trackedAt": {"$gte": tracked_from, "$lte": tracked_to},
+    }
+    return match, field, scope
+
+def _per_hour(delta: str, start: str, end: str) -> Dict[str, Any]:
+    # delta / horas entre start y end; null si no hay punto anterior
+    hours = {"$divide": [{"$dateDiff": {"startDate": start, "endDate": end, "unit": "second"}}, 3600]}
+    return {"$cond": [{"$gt": [hours, 0]}, {"$divide": [delta, hours]}, None]}
+
+
+# ---- pipelines ----
+def _series_pipeline(match: Dict[str, Any], bucket: str, single_post: bool) -> List[Dict[str, Any]]:
+    values = {f: f"${f}" for f in _VALUE_FIELDS}
+    pipeline: List[Dict[str, Any]] = [
+        {"$match": match},
+        # último snapshot de cada post dentro de cada bucket
+        {"$group": {
+            "_id": {
+                "postId": "$meta.postId",
+                "t": {"$dateTrunc": {"date": "$trackedAt", "unit": bucket, "timezone": SERIES_TIMEZONE}},
+            },
+            "last": {"$top": {"sortBy": {"trackedAt": -1}, "output": values}},
+        }},
+        {"$replaceWith": {"$mergeObjects": [{"postId": "$_id.postId", "t": "$_id.t"}, "$last"]}},
+    ]
+    if not single_post:
+        # un post sin scrape en un bucket sigue contando con su último valor conocido
+        # (si no, el total de la cuenta/hashtag "cae" en los buckets donde falta).
+        # bounds "full": cada post se completa hasta el último bucket de la serie, no
+        # solo hasta su último snapshot; antes de su primer snapshot queda en null
+        pipeline += [
+            {"$densify": {"field": "t", "partitionByFields": ["postId"],
+                          "range": {"step": 1, "unit": bucket, "bounds": "full"}}},
+            {"$fill": {"partitionByFields": ["postId"], "sortBy": {"t": 1},
+                       "output": {f: {"method": "locf"} for f in _VALUE_FIELDS}}},
+        ]
+    pipeline += [
+        # $sum ignora los null: posts cuenta solo los que ya tienen valor en ese bucket
+        {"$group": {"_id": "$t", "posts": {"$sum": {"$cond": [{"$gt": ["$views", None]}, 1, 0]}},
+                    **{f: {"$sum": f"${f}"} for f in _VALUE_FIELDS}}},
+        {"$set": {"engagement": {"$cond": [
+            {"$gt": ["$views", 0]}, {"$round": [{"$divide": ["$totalInteractions", "$views"]}, 6]}, 0.0]}}},
+        {"$setWindowFields": {
+            "sortBy": {"_id": 1},
+            "output": {
+                "prevT": {"$shift": {"output": "$_id", "by": -1}},
+                "prevViews": {"$shift": {"output": "$views", "by": -1}},
+                "prevLikes": {"$shift": {"output": "$likes", "by": -1}},
+                "prevEngagement": {"$shift": {"output": "$engagement", "by": -1}},
+            },
+        }},
+        {"$set": {
+            "viewsDelta": {"$subtract": ["$views", "$prevViews"]},
+            "likesDelta": {"$subtract": ["$likes", "$prevLikes"]},
+            "engagementChange": {"$round": [{"$subtract": ["$engagement", "$prevEngagement"]}, 6]},
+        }},
+        {"$project": {
+            "_id": 0, "t": "$_id", "posts": 1, "engagement": 1,
+            **{f: 1 for f in _VALUE_FIELDS},
+            "viewsDelta": 1, "likesDelta": 1, "engagementChange": 1,
+            "viewsPerHour": _per_hour("$viewsDelta", "$prevT", "$_id"),
+            "likesPerHour": _per_hour("$likesDelta", "$prevT", "$_id"),
+        }},
+        {"$sort": {"t": 1}},
+    ]
+    return pipeline
+
+def _growth_pipeline(match: Dict[str, Any], rank_by: str, limit: int) -> List[Dict[str, Any]]:
+    whole = {"documents": ["unbounded", "unbounded"]}
+    return [
+        {"$match": match},
+        {"$setWindowFields": {
+            "partitionBy": "$meta.postId",
+            "sortBy": {"trackedAt": 1},
+            "output": {
+                "firstTrackedAt": {"$first": "$trackedAt", "window": whole},
+                "firstViews": {"$first": "$views", "window": whole},
+                "firstLikes": {"$first": "$likes", "window": whole},
+                "firstEngagement": {"$first": "$engagement", "window": whole},
+                "snapshots": {"$count": {}, "window": whole},
+                "n": {"$documentNumber": {}},
+            },
+        }},
+        # queda el último snapshot de cada post, ya con los valores del primero
+        {"$match": {"$expr": {"$eq": ["$n", "$snapshots"]}}},
+        {"$project": {
+            "_id": 0,
+            "postId": "$meta.postId",
+            "account": "$meta.account",
+            "firstTrackedAt": 1,
+            "lastTrackedAt": "$trackedAt",
+            "snapshots": 1,
+            "views": 1, "likes": 1, "engagement": 1,
+            "viewsDelta": {"$subtract": ["$views", "$firstViews"]},
+            "likesDelta": {"$subtract": ["$likes", "$firstLikes"]},
+            "engagementChange": {"$round": [{"$subtract": ["$engagement", "$firstEngagement"]}, 6]},
+            "viewsPerHour": _per_hour({"$subtract": ["$views", "$firstViews"]}, "$firstTrackedAt", "$trackedAt"),
+            "likesPerHour": _per_hour({"$subtract": ["$likes", "$firstLikes"]}, "$firstTrackedAt", "$trackedAt"),
+        }},
+        {"$sort": {rank_by: -1, "postId": 1}},
+        {"$limit": limit},
+    ]
+
+
+async def _run_series(req: SeriesRequest, coll_name: str, owner_field: str) -> SeriesResponse:
+    match, field, scope = _match(req, owner_field)
+    coll = get_series_collection(coll_name)
+    with span("series_aggregate") as s:
+        points = await coll.aggregate(
+            _series_pipeline(match, req.bucket, single_post=field == "meta.postId"), allowDiskUse=True
+        ).to_list(None)
+        s.items = len(points)
+    for p in points:
+        p["t"] = _utc(p["t"])
+    return SeriesResponse(scope=scope, bucket=req.bucket, points=points)
+
+async def _run_growth(req: GrowthRequest, coll_name: str, owner_field: str) -> GrowthResponse:
+    match, _, scope = _match(req, owner_field)
+    coll = get_series_collection(coll_name)
+    with span("growth_aggregate") as s:
+        posts = await coll.aggregate(
+            _growth_pipeline(match, req.rankBy, req.limit), allowDiskUse=True
+        ).to_list(req.limit)
+        s.items = len(posts)
+    for p in posts:
+        p["firstTrackedAt"] = _utc(p["firstTrackedAt"])
+        p["lastTrackedAt"] = _utc(p["lastTrackedAt"])
+    return GrowthResponse(scope=scope, rankBy=req.rankBy, posts=posts)
+
+
+@router.post("/dbquery/user/series", response_model=SeriesResponse,
+    summary="Serie temporal de métricas (usuario)",
+    description="Métricas por hora/día/semana de un post, cuenta o hashtag del usuario, con deltas y vistas/likes por hora")
+async def dbquery_user_series(req: SeriesRequest):
+    return await _run_series(req, COLL_NAME, "userId")
+
+@router.post("/dbquery/admin/series", response_model=SeriesResponse,
+    summary="Serie temporal de métricas (admin)",
+    description="Métricas por hora/día/semana de un post, cuenta o hashtag del admin, con deltas y vistas/likes por hora")
+async def dbquery_admin_series(req: SeriesRequest):
+    return await _run_series(req, ADMIN_COLL_NAME, "adminId")
+
+@router.post("/dbquery/user/growth", response_model=GrowthResponse,
+    summary="Crecimiento por post (usuario)",
+    description="Vistas/likes por hora y cambio de engagement de cada post en el rango, ordenados por rankBy")
+async def dbquery_user_growth(req: GrowthRequest):
+    return await _run_growth(req, COLL_NAME, "userId")
+
+@router.post("/dbquery/admin/growth", response_model=GrowthResponse,
+    summary="Crecimiento por post (admin)",
+    description="Vistas/likes por hora y cambio de engagement de cada post en el rango, ordenados por rankBy")
+async def dbquery_admin_growth(req: GrowthRequest):
+    return await _run_growth(req, ADMIN_COLL_NAME, "adminId")
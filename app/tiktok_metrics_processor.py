@@ -1,20 +1,23 @@
 # tiktok_metrics_processor.py
 from __future__ import annotations
-from dataclasses import dataclass, asdict
-from typing import Any, Dict, List, Optional
-from datetime import datetime
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
 from urllib.parse import urlparse, parse_qs
 
 LIMA_TZ = ZoneInfo("America/Lima")
+UTC_TZ = timezone.utc
 
-@dataclass
+# Formato de almacenamiento: fechas como datetime (BSON date, UTC) y None donde
+# falta el dato. Los strings datePosted/hourPosted/dateTracking/timeTracking (hora
+# de Lima) y los "N/A" de la respuesta los arma models.shape_metric.
+@dataclass(slots=True)
 class TiktokMetricOut:
-    postId: str
-    datePosted: str
-    hourPosted: str
-    usernameTiktokAccount: str
-    postURL: str
+    postId: Optional[str]
+    postedAt: Optional[datetime]
+    usernameTiktokAccount: Optional[str]
+    postURL: Optional[str]
     views: int
     likes: int
     comments: int
@@ -23,12 +26,15 @@ class TiktokMetricOut:
     totalInteractions: int
     engagement: float
     numberHashtags: int
-    hashtags: str
-    soundId: str
-    soundURL: str
-    regionPost: str
-    dateTracking: str
-    timeTracking: str
+    hashtags: Optional[str]
+    hashtagList: List[str]
+    soundId: Optional[str]
+    soundURL: Optional[str]
+    regionPost: Optional[str]
+    trackedAt: datetime
+
+# campos de texto del formato anterior, reemplazados por postedAt/trackedAt (ver migrations.type_storage)
+LEGACY_DATE_FIELDS = ("datePosted", "hourPosted", "dateTracking", "timeTracking")
 
 def _safe_int(v: Any, default: int = 0) -> int:
     try:
@@ -36,8 +42,8 @@ def _safe_int(v: Any, default: int = 0) -> int:
     except Exception:
         return default
 
-def _na_if_blank(s: Optional[str]) -> str:
-    return s.strip() if isinstance(s, str) and s.strip() else "N/A"
+def _none_if_blank(s: Optional[str]) -> Optional[str]:
+    return s.strip() if isinstance(s, str) and s.strip() else None
 
 
 
@@ -51,13 +57,33 @@ def _parse_dt_optional(create_time_iso: Optional[str], create_time_epoch: Option
             pass
     if create_time_epoch:
         try:
-            return datetime.fromtimestamp(int(create_time_epoch), tz=ZoneInfo("UTC")).astimezone(LIMA_TZ)
+            return datetime.fromtimestamp(int(create_time_epoch), tz=UTC_TZ).astimezone(LIMA_TZ)
         except Exception:
             pass
     return None
 
+# equivalentes a strftime("%Y-%m-%d") / strftime("%H:%M:%S"), sin pasar por el parser de formato
+def _fmt_date(dt: datetime) -> str:
+    return f"{dt.year:04d}-{dt.month:02d}-{dt.day:02d}"
+
+def _fmt_time(dt: datetime) -> str:
+    return f"{dt.hour:02d}:{dt.minute:02d}:{dt.second:02d}"
+
+def local_date_time(dt: datetime) -> Tuple[str, str]:
+    """datetime (sin zona = UTC, como lo devuelve Mongo) -> ("YYYY-MM-DD", "HH:MM:SS") en hora de Lima."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=UTC_TZ)
+    dt = dt.astimezone(LIMA_TZ)
+    return _fmt_date(dt), _fmt_time(dt)
+
+def parse_tracking(date_str: Optional[str], time_str: Optional[str]) -> Optional[datetime]:
+    """Fecha + hora en el formato anterior (hora de Lima) -> datetime con zona, o None."""
+    try:
+        return datetime.fromisoformat(f"{date_str}T{time_str}").replace(tzinfo=LIMA_TZ)
+    except (TypeError, ValueError):
+        return None
+
 def _join_hashtags(hashtags: List[Dict[str, Any]]) -> str:
-    print(hashtags)
     tags = []
     for h in hashtags or []:
         name = h.get("name")
@@ -65,24 +91,39 @@ def _join_hashtags(hashtags: List[Dict[str, Any]]) -> str:
             if not name.startswith("#"):
                 name = "#" + name
             tags.append(name)
-    return " ".join(tags) if tags else "N/A"
+    return " ".join(tags) if tags else None
 
-def transform_item(item: Dict[str, Any], username_fallback: Optional[str] = None) -> TiktokMetricOut:
-    # postId
-    post_id = _na_if_blank(str(item.get("id", "")))
-
-    # fecha/hora del post (no inventamos si no viene)
-    dt = _parse_dt_optional(item.get("createTimeISO"), item.get("createTime"))
-    date_posted = dt.strftime("%Y-%m-%d") if dt else "N/A"
-    hour_posted = dt.strftime("%H:%M:%S") if dt else "N/A"
+def _hashtag_list(hashtags: List[Dict[str, Any]]) -> List[str]:
+    # versión normalizada (minúsculas, con '#', sin repetidos) para el índice multikey
+    seen: Dict[str, None] = {}
+    for h in hashtags or []:
+        name = h.get("name")
+        if isinstance(name, str) and name.strip():
+            tag = normalize_hashtag(name)
+            seen.setdefault(tag, None)
+    return list(seen)
+
+def normalize_hashtag(tag: str) -> str:
+    tag = tag.strip().lower()
+    return tag if tag.startswith("#") else f"#{tag}"
+
+def _record(
+    item: Dict[str, Any],
+    username_fallback: Optional[str],
+    tracked_at: datetime,
+    posted_cache: Dict[Any, Optional[datetime]],
+) -> Dict[str, Any]:
+    """Arma el documento listo para Mongo, con las claves en el orden de TiktokMetricOut."""
+    # fecha/hora del post (no inventamos si no viene); el mismo timestamp se parsea una vez por batch
+    key = (item.get("createTimeISO"), item.get("createTime"))
+    if key in posted_cache:
+        posted = posted_cache[key]
+    else:
+        dt = _parse_dt_optional(*key)
+        posted = posted_cache[key] = dt.astimezone(UTC_TZ) if dt else None
 
-    # username
     author_meta = item.get("authorMeta") or {}
     username = author_meta.get("name") or item.get("input") or username_fallback or ""
-    username = _na_if_blank(username)
-
-    # url del post
-    post_url = _na_if_blank(item.get("webVideoUrl") or "")
 
     # métricas
     views = _safe_int(item.get("playCount"))
@@ -91,61 +132,63 @@ def transform_item(item: Dict[str, Any], username_fallback: Optional[str] = None
     saves = _safe_int(item.get("collectCount"))
     reposts = _safe_int(item.get("shareCount"))  # usamos shareCount como 'reposts'
     total_interactions = likes + comments + saves + reposts
-    engagement = round((total_interactions / views), 6) if views > 0 else 0.0
 
-    # hashtags
     hashtags_list = item.get("hashtags") or []
-    number_hashtags = len(hashtags_list)
-    print(hashtags_list)
-    hashtags = _join_hashtags(hashtags_list)
-
-    # música
     music = item.get("musicMeta") or {}
-    sound_id = _na_if_blank(str(music.get("musicId") or ""))
-    sound_url = _na_if_blank(str(music.get("playUrl") or ""))
-
-    # región (si no hay 'idc' en ninguna URL -> "N/A")
-    candidate_urls: List[str] = [post_url if post_url != "N/A" else ""]
-    vm = item.get("videoMeta") or {}
-    if vm.get("coverUrl"): candidate_urls.append(vm["coverUrl"])
-    if vm.get("originalCoverUrl"): candidate_urls.append(vm["originalCoverUrl"])
-    for link in item.get("slideshowImageLinks") or []:
-        for k in ("tiktokLink", "downloadLink"):
-            if link.get(k): candidate_urls.append(link[k])
-    region = "N/A"
 
-    # tracking ahora (esto sí es interno y siempre lo registramos)
-    now = datetime.now(tz=LIMA_TZ)
-
-    return TiktokMetricOut(
-        postId=post_id,
-        datePosted=date_posted,
-        hourPosted=hour_posted,
-        usernameTiktokAccount=username,
-        postURL=post_url,
-        views=views,
-        likes=likes,
-        comments=comments,
-        saves=saves,
-        reposts=reposts,
-        totalInteractions=total_interactions,
-        engagement=engagement,
-        numberHashtags=number_hashtags,
-        hashtags=hashtags,
-        soundId=sound_id,
-        soundURL=sound_url,
-        regionPost=region,
-        dateTracking=now.strftime("%Y-%m-%d"),
-        timeTracking=now.strftime("%H:%M:%S"),
-    )
+    return {
+        "postId": _none_if_blank(str(item.get("id", ""))),
+        "postedAt": posted,
+        "usernameTiktokAccount": _none_if_blank(username),
+        "postURL": _none_if_blank(item.get("webVideoUrl") or ""),
+        "views": views,
+        "likes": likes,
+        "comments": comments,
+        "saves": saves,
+        "reposts": reposts,
+        "totalInteractions": total_interactions,
+        "engagement": round((total_interactions / views), 6) if views > 0 else 0.0,
+        "numberHashtags": len(hashtags_list),
+        "hashtags": _join_hashtags(hashtags_list),
+        "hashtagList": _hashtag_list(hashtags_list),
+        "soundId": _none_if_blank(str(music.get("musicId") or "")),
+        "soundURL": _none_if_blank(str(music.get("playUrl") or "")),
+        # región: ninguna URL de Apify trae 'idc' utilizable hoy -> siempre None
+        "regionPost": None,
+        "trackedAt": tracked_at,
+    }
+
+def _tracking_now(tracked_at: Optional[datetime] = None) -> datetime:
+    # UTC y truncado al segundo: es lo que guarda Mongo y lo que se muestra (HH:MM:SS)
+    return (tracked_at or datetime.now(tz=UTC_TZ)).astimezone(UTC_TZ).replace(microsecond=0)
 
-def transform_items(apify_response: Dict[str, Any], username_fallback: Optional[str] = None, user_id: Optional[int] = None) -> List[Dict[str, Any]]:
-    items = (apify_response or {}).get("Success") or []
+def transform_item(item: Dict[str, Any], username_fallback: Optional[str] = None) -> TiktokMetricOut:
+    # tracking ahora (esto sí es interno y siempre lo registramos)
+    return TiktokMetricOut(**_record(item, username_fallback, _tracking_now(), {}))
+
+def transform_batch(
+    items: List[Dict[str, Any]],
+    username_fallback: Optional[str] = None,
+    owner_field: str = "userId",
+    owner_id: Optional[int] = None,
+    tracked_at: Optional[datetime] = None,
+) -> List[Dict[str, Any]]:
+    """Normaliza un batch de items de Apify directo a dicts listos para insert/upsert.
+
+    El tracking se toma una sola vez para todo el batch (o se recibe en `tracked_at`
+    para que varios batches de un mismo scrape compartan la misma marca).
+    """
+    now = _tracking_now(tracked_at)
+    posted_cache: Dict[Any, Optional[datetime]] = {}
     out: List[Dict[str, Any]] = []
+    append = out.append
     for item in items:
-        model = transform_item(item, username_fallback=username_fallback)
-        record = asdict(model)
-        # 👇 Agregar userId, con fallback a "N/A" si no viene
-        record["userId"] = user_id if user_id is not None else "N/A"
-        out.append(record)
+        record = _record(item, username_fallback, now, posted_cache)
+        record[owner_field] = owner_id
+        append(record)
     return out
+
+def transform_items(apify_response: Dict[str, Any], username_fallback: Optional[str] = None, user_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    items = (apify_response or {}).get("Success") or []
+    # 👇 Agregar userId (None si no viene)
+    return transform_batch(items, username_fallback=username_fallback, owner_field="userId", owner_id=user_id)
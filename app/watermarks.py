@@ -0,0 +1,98 @@
+# watermarks.py
+# Scraping incremental: por (colección, dueño, profile/hashtag) se guarda el
+# día (hora de Lima) del post más nuevo ya ingerido. En el siguiente scrape incremental el actor
+# recibe oldestPostDate = watermark más viejo de los targets - ventana de refresh:
+# trae solo lo nuevo más los posts recientes cuyas métricas todavía se mueven.
+import os
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from db_mongo import get_collection_by
+from tiktok_metrics_processor import normalize_hashtag, local_date_time
+
+WATERMARKS_COLL_NAME = os.getenv("MONGODB_WATERMARKS_COLLECTION", "ScrapeWatermarks")
+INCREMENTAL_REFRESH_DAYS = int(os.getenv("INCREMENTAL_REFRESH_DAYS", "3"))
+
+PROFILE, HASHTAG = "profile", "hashtag"
+
+Target = Tuple[str, str]
+
+
+def normalize_profile(p: str) -> str:
+    return p.strip().lstrip("@").lower()
+
+
+def targets_of(profiles: Optional[List[str]], hashtags: Optional[List[str]]) -> List[Target]:
+    out: List[Target] = [(PROFILE, normalize_profile(p)) for p in profiles or [] if p and p.strip()]
+    # el endpoint admin también acepta "a,b" en un solo elemento
+    tags = [t for h in hashtags or [] for t in (h or "").split(",") if t.strip().lstrip("#")]
+    out += [(HASHTAG, normalize_hashtag(t)) for t in tags]
+    return list(dict.fromkeys(out))
+
+
+def _wm_id(coll_name: str, owner_id: Any, target: Target) -> str:
+    kind, name = target
+    return f"{coll_name}|{owner_id}|{kind}|{name}"
+
+
+async def since_date(coll_name: str, owner_id: Any, targets: List[Target], refresh_days: int) -> Optional[str]:
+    """oldestPostDate para el run incremental, o None si algún target nunca se scrapeó."""
+    if not targets or owner_id is None:
+        return None
+    ids = [_wm_id(coll_name, owner_id, t) for t in targets]
+    found = await get_collection_by(WATERMARKS_COLL_NAME).find(
+        {"_id": {"$in": ids}}, {"newestDatePosted": 1}
+    ).to_list(len(ids))
+    if len(found) < len(ids):
+        return None
+    # un solo run para todos los targets: manda el más atrasado
+    oldest = min(d["newestDatePosted"] for d in found)
+    return (date.fromisoformat(oldest) - timedelta(days=max(0, refresh_days))).isoformat()
+
+
+class WatermarkTracker:
+    """Junta el día de publicación más nuevo por target mientras se ingieren los chunks."""
+
+    def __init__(self, targets: Iterable[Target]):
+        targets = list(targets)
+        self._profiles = {name for kind, name in targets if kind == PROFILE}
+        self._tags = {name for kind, name in targets if kind == HASHTAG}
+        self.newest: Dict[Target, str] = {}
+
+    def _bump(self, target: Target, day: str) -> None:
+        if day > self.newest.get(target, ""):
+            self.newest[target] = day
+
+    def add(self, docs: List[Dict[str, Any]]) -> None:
+        for d in docs:
+            posted = d.get("postedAt")
+            if posted is None:
+                continue
+            day = local_date_time(posted)[0]
+            user = (d.get("usernameTiktokAccount") or "").lower()
+            if user in self._profiles:
+                self._bump((PROFILE, user), day)
+            if self._tags:
+                for tag in d.get("hashtagList") or ():
+                    if tag in self._tags:
+                        self._bump((HASHTAG, tag), day)
+
+    async def save(self, coll_name: str, owner_id: Any) -> int:
+        """Avanza los watermarks ($max: nunca retroceden). Solo tras un scrape completo."""
+        if owner_id is None or not self.newest:
+            return 0
+        now = datetime.now(timezone.utc)
+        ops = [
+            UpdateOne(
+                {"_id": _wm_id(coll_name, owner_id, target)},
+                {"$max": {"newestDatePosted": day},
+                 "$set": {"coll": coll_name, "ownerId": owner_id, "kind": target[0],
+                          "target": target[1], "updatedAt": now}},
+                upsert=True,
+            )
+            for target, day in self.newest.items()
+        ]
+        await get_collection_by(WATERMARKS_COLL_NAME).bulk_write(ops, ordered=False)
+        return len(ops)
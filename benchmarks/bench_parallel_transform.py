@@ -0,0 +1,69 @@
+# bench_parallel_transform.py
+# Punto de cruce entre transform_batch inline y el modo por process pool.
+#   python benchmarks/bench_parallel_transform.py --sizes 500 2000 10000 50000 --out bench.json
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from synthetic import generate_items  # noqa: E402
+from tiktok_metrics_processor import transform_batch  # noqa: E402
+import parallel_transform  # noqa: E402
+
+
+def _best(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+async def run(sizes, repeat: int, pool_size: int, chunk_size: int):
+    parallel_transform.TRANSFORM_POOL_SIZE = pool_size
+    # calentar el pool: el primer spawn no cuenta
+    await parallel_transform.transform_batch_async(generate_items(pool_size * 2), parallel=True, threshold=0, chunk_size=1)
+    results = []
+    for n in sizes:
+        items = generate_items(n, seed=n)
+        inline = _best(lambda: transform_batch(items, owner_id=1), repeat)
+        par = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            await parallel_transform.transform_batch_async(items, owner_id=1, parallel=True, threshold=0, chunk_size=chunk_size)
+            par = min(par, time.perf_counter() - t0)
+        results.append({
+            "items": n,
+            "inlineSecs": round(inline, 6),
+            "parallelSecs": round(par, 6),
+            "speedup": round(inline / par, 3) if par else None,
+        })
+        print(f"{n:>8} items  inline {inline * 1000:9.2f} ms  parallel {par * 1000:9.2f} ms  x{inline / par:.2f}")
+    parallel_transform.shutdown_pool()
+    crossover = next((r["items"] for r in results if r["speedup"] and r["speedup"] > 1), None)
+    return {"benchmark": "parallel_transform", "poolSize": pool_size, "chunkSize": chunk_size,
+            "results": results, "crossoverItems": crossover}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[250, 1000, 2000, 5000, 10000, 50000])
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--pool-size", type=int, default=os.cpu_count() or 2)
+    ap.add_argument("--chunk-size", type=int, default=parallel_transform.TRANSFORM_CHUNK_SIZE)
+    ap.add_argument("--out", default=None)
+    args = ap.parse_args()
+    report = asyncio.run(run(args.sizes, args.repeat, args.pool_size, args.chunk_size))
+    print(f"cruce (primer tamaño con speedup > 1): {report['crossoverItems']}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+# bench_suite.py
+# Suite de benchmarks del microservicio con datos sintéticos (synthetic.py),
+# Apify falso (fake_apify.py) y Mongo local o en memoria (mongo_standin.py).
+# Casos: transform_items, _build_match_from_request, top-N admin, ingest,
+# _compute_dashboard y los endpoints completos (httpx + ASGITransport).
+# Escribe JSON comparable entre corridas; con --baseline marca las regresiones.
+#   python benchmarks/bench_suite.py --sizes 1000 5000 --out bench.json
+#   python benchmarks/bench_suite.py --mongo-uri mongodb://localhost:27017 --sizes 10000 50000 --baseline bench.json
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import httpx  # noqa: E402
+
+from synthetic import generate_items  # noqa: E402
+from fake_apify import FakeApify  # noqa: E402
+from mongo_standin import use_mongo, reset_db  # noqa: E402
+import check_fast_json  # noqa: E402
+
+PROFILES = [f"creator_{i}" for i in range(10)]
+OWNER_ID = 1
+
+
+class Suite:
+    def __init__(self, repeat: int):
+        self.repeat = repeat
+        self.results: List[Dict[str, Any]] = []
+
+    def record(self, case: str, items: Optional[int], secs: float, **extra: Any) -> None:
+        row: Dict[str, Any] = {"case": case, "items": items, "secs": round(secs, 6)}
+        if items:
+            row["itemsPerSec"] = round(items / secs) if secs else None
+        row.update(extra)
+        self.results.append(row)
+        print(f"{case:<28} {items or '':>8}  {secs * 1000:10.2f} ms")
+
+    def skip(self, case: str, items: Optional[int], reason: str) -> None:
+        self.results.append({"case": case, "items": items, "skipped": reason})
+        print(f"{case:<28} {items or '':>8}  omitido: {reason}")
+
+    def best(self, fn: Callable[[], Any]) -> float:
+        best = float("inf")
+        for _ in range(self.repeat):
+            t0 = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - t0)
+        return best
+
+    async def abest(self, fn: Callable[[], Awaitable[Any]], setup: Optional[Callable[[], Awaitable[Any]]] = None) -> float:
+        best = float("inf")
+        for _ in range(self.repeat):
+            if setup is not None:
+                await setup()
+            t0 = time.perf_counter()
+            await fn()
+            best = min(best, time.perf_counter() - t0)
+        return best
+
+    async def guarded(self, case: str, items: Optional[int], coro: Awaitable[None]) -> None:
+        # mongomock no implementa todos los operadores de agregación ($isoDayOfWeek,
+        # $unset...): esos casos quedan como omitidos y hay que correrlos con --mongo-uri
+        try:
+            await coro
+        except NotImplementedError as e:
+            self.skip(case, items, f"NotImplementedError: {e}"[:200])
+
+
+def _top_tags(docs: List[Dict[str, Any]], k: int) -> List[str]:
+    counts = Counter(t for d in docs for t in d.get("hashtagList") or ())
+    return [t for t, _ in counts.most_common(k)]
+
+
+def bench_pure(suite: Suite, n: int, seed: int) -> None:
+    from tiktok_metrics_processor import transform_items, transform_batch
+    from ranking import TopNByHashtag
+
+    items = generate_items(n, seed=seed, profiles=PROFILES)
+    apify_response = {"Success": items}
+    suite.record("transform_items", n, suite.best(lambda: transform_items(apify_response, PROFILES[0], OWNER_ID)))
+
+    docs = transform_batch(items, PROFILES[0], "adminId", OWNER_ID)
+    tags = _top_tags(docs, 5)
+
+    def rank() -> None:
+        ranker = TopNByHashtag(tags, n=5, metric="views")
+        for i in range(0, len(docs), 500):
+            ranker.add(docs[i:i + 500])
+        ranker.result()
+    suite.record("top_n_by_hashtag", n, suite.best(rank), hashtags=len(tags))
+
+
+def bench_build_match(suite: Suite, calls: int = 10_000) -> None:
+    from queries_controller import _build_match_from_request
+
+    params = {
+        "userId": OWNER_ID,
+        "tiktokUsernames": ",".join(PROFILES[:3]),
+        "hashtags": "#FYP, viral,booktok",
+        "datePostedFrom": "2025-01-01",
+        "datePostedTo": "2025-03-31",
+        "minViews": 1000,
+        "maxEngagement": 0.5,
+    }
+
+    def run() -> None:
+        for _ in range(calls):
+            _build_match_from_request(params, id_field_name="userId")
+    secs = suite.best(run)
+    suite.record("build_match_from_request", None, secs, calls=calls, perCallUs=round(secs / calls * 1e6, 3))
+
+
+async def bench_storage(suite: Suite, n: int, seed: int) -> None:
+    from db_mongo import get_collection
+    from ingestion import ingest_pages, APIFY_PAGE_SIZE
+    from tiktok_metrics_processor import transform_batch
+    import queries_controller
+
+    items = generate_items(n, seed=seed, profiles=PROFILES)
+    coll = get_collection()
+
+    async def pages():
+        for i in range(0, len(items), APIFY_PAGE_SIZE):
+            yield items[i:i + APIFY_PAGE_SIZE]
+
+    async def ingest() -> None:
+        await ingest_pages(pages(), lambda p: transform_batch(p, PROFILES[0], "userId", OWNER_ID), coll, "userId")
+
+    # cada repetición arranca de la base vacía: mide inserts, no updates
+    suite.record("ingest_pages", n, await suite.abest(ingest, setup=reset_db))
+
+    async def dashboard() -> None:
+        suite.record("compute_dashboard", n, await suite.abest(
+            lambda: queries_controller._compute_dashboard(coll, {"userId": OWNER_ID})))
+    await suite.guarded("compute_dashboard", n, dashboard())
+
+    async def rollups() -> None:
+        suite.record("dashboard_from_rollups", n, await suite.abest(
+            lambda: queries_controller._dashboard_from_rollups(coll, "userId", OWNER_ID)))
+    await suite.guarded("dashboard_from_rollups", n, rollups())
+
+
+async def bench_endpoints(suite: Suite, n: int, fake: FakeApify) -> None:
+    import apify_connector
+    from ApifyConnectionController import app
+    from db_mongo import COLL_NAME
+    from query_cache import query_cache
+
+    apify_connector.APIFY_API_URL = fake.url
+    per_target = max(1, n // len(PROFILES))
+    user_body = {"apifyToken": "bench", "profiles": PROFILES, "resultsPerPage": per_target, "userId": OWNER_ID}
+    tags = ["fyp", "viral", "booktok", "lima", "food"]
+    admin_body = {"apifyToken": "bench", "hashtags": tags, "resultsPerPage": max(1, n // len(tags)), "adminId": OWNER_ID}
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def post(path: str, body: Dict[str, Any]) -> None:
+            resp = await client.post(path, json=body)
+            if resp.status_code != 200:
+                raise RuntimeError(f"{path} -> {resp.status_code}: {resp.text[:300]}")
+
+        suite.record("endpoint_scrape_user", n, await suite.abest(
+            lambda: post("/apify-connection/normalized", user_body), setup=reset_db))
+        suite.record("endpoint_scrape_admin", n, await suite.abest(
+            lambda: post("/apify-connection/admin/normalized", admin_body), setup=reset_db))
+
+        # base con n posts del usuario para las consultas
+        await reset_db()
+        await post("/apify-connection/normalized", {**user_body, "includeData": False})
+        query = {"userId": OWNER_ID}
+
+        async def cold() -> None:
+            await query_cache.invalidate(COLL_NAME, [OWNER_ID])
+
+        async def queries() -> None:
+            suite.record("endpoint_dbquery_cold", n, await suite.abest(
+                lambda: post("/dbquery/user", query), setup=cold))
+            suite.record("endpoint_dbquery_cached", n, await suite.abest(
+                lambda: post("/dbquery/user", query)))
+        await suite.guarded("endpoint_dbquery", n, queries())
+
+
+async def run(args) -> Dict[str, Any]:
+    backend = use_mongo(args.mongo_uri)
+    suite = Suite(args.repeat)
+    bench_build_match(suite)
+    with FakeApify(seed=args.seed) as fake:
+        for n in args.sizes:
+            bench_pure(suite, n, args.seed + n)
+            await bench_storage(suite, n, args.seed + n)
+            if not args.skip_endpoints:
+                await bench_endpoints(suite, n, fake)
+            fast = await check_fast_json.run(n, args.repeat)
+            for row in fast["results"]:
+                suite.record(f"fast_json_{row['endpoint']}", n, row["fastSecs"],
+                             validatedSecs=row["validatedSecs"], speedup=row["speedup"])
+    await reset_db()
+    import fast_json
+    return {
+        "benchmark": "suite",
+        "createdAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "mongo": backend,
+        "orjson": fast_json.orjson is not None,
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "results": suite.results,
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Casos que tardan más de (1 + tolerance) veces lo del baseline."""
+    before = {(r["case"], r["items"]): r for r in baseline.get("results", []) if "secs" in r}
+    regressions = []
+    for r in report["results"]:
+        old = before.get((r["case"], r["items"]))
+        if "secs" not in r or old is None or not old["secs"]:
+            continue
+        ratio = r["secs"] / old["secs"]
+        flag = "REGRESIÓN" if ratio > 1 + tolerance else ""
+        print(f"{r['case']:<28} {r['items'] or '':>8}  x{ratio:6.2f} vs baseline  {flag}")
+        if flag:
+            regressions.append(f"{r['case']}@{r['items']}")
+    return regressions
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000])
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGODB_URI"),
+                    help="mongod para los benchmarks (por defecto mongomock-motor en memoria)")
+    ap.add_argument("--skip-endpoints", action="store_true")
+    ap.add_argument("--out", default=None)
+    ap.add_argument("--baseline", default=None, help="JSON de una corrida anterior para comparar")
+    ap.add_argument("--tolerance", type=float, default=0.2)
+    args = ap.parse_args()
+    report = asyncio.run(run(args))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("mongo") != report["mongo"]:
+            print(f"aviso: baseline con mongo={baseline.get('mongo')}, esta corrida con mongo={report['mongo']}")
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print("regresiones: " + ", ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
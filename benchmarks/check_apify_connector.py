@@ -0,0 +1,80 @@
+# check_apify_connector.py
+# apify_connector.run_actor / iter_dataset_pages contra el Apify falso
+# (fake_apify.py): el run devuelve su dataset, las páginas cubren el dataset
+# entero sin repetir items, y un run que termina FAILED o un dataset que no
+# existe salen como ApifyRunError (el 502 del controller), no como datos vacíos.
+# RunCoalescer: mismo token + input comparten run (y un run reutilizado conserva su
+# finishedAt); otro token lanza el suyo.
+#   python benchmarks/check_apify_connector.py
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import apify_connector  # noqa: E402
+from apify_connector import ApifyRunError, RunCoalescer, iter_dataset_pages, run_actor  # noqa: E402
+from fake_apify import FakeApify  # noqa: E402
+
+TOKEN = "fake-token"
+PAGE_SIZE = 40
+RUN_INPUT = {"profiles": ["creator_a", "creator_b"], "resultsPerPage": 50}
+
+
+async def _pages(dataset_id: str):
+    return [page async for page in iter_dataset_pages(TOKEN, dataset_id, PAGE_SIZE)]
+
+
+async def _expect_run_error(name: str, coro) -> None:
+    try:
+        await coro
+    except ApifyRunError as e:
+        print(f"{name:<20} OK {e.detail}")
+        return
+    raise AssertionError(f"{name}: se esperaba ApifyRunError")
+
+
+async def run(fake: FakeApify) -> None:
+    try:
+        dataset_id, finished_at = await run_actor(TOKEN, RUN_INPUT)
+        assert finished_at.tzinfo is not None, finished_at
+        expected = fake.datasets[dataset_id]
+        pages = await _pages(dataset_id)
+        items = [it for page in pages for it in page]
+        assert [len(p) for p in pages[:-1]] == [PAGE_SIZE] * (len(pages) - 1), [len(p) for p in pages]
+        assert [it["id"] for it in items] == [it["id"] for it in expected], "páginas incompletas o repetidas"
+        print(f"{'run_y_paginas':<20} OK {len(items)} items en {len(pages)} páginas de {PAGE_SIZE}")
+
+        fake.fail_status = "FAILED"
+        await _expect_run_error("run_failed", run_actor(TOKEN, RUN_INPUT))
+        fake.fail_status = None
+
+        await _expect_run_error("dataset_inexistente", _pages("ds-missing"))
+
+        coalescer = RunCoalescer()
+        before = len(fake.runs)
+        same = await asyncio.gather(*(coalescer.run(TOKEN, RUN_INPUT) for _ in range(3)))
+        other = await coalescer.run("other-token", RUN_INPUT)
+        assert len(set(same)) == 1 and other not in same, (same, other)
+        assert len(fake.runs) - before == 2, f"{len(fake.runs) - before} runs"
+        print(f"{'coalescer_por_token':<20} OK 3 requests -> {same[0][0]}, otro token -> {other[0]}")
+
+        # run reutilizado: vuelve con el finishedAt del run original, no con la hora actual
+        await asyncio.sleep(1.1)
+        again = await coalescer.run(TOKEN, RUN_INPUT)
+        assert again == same[0], (again, same[0])
+        print(f"{'run_reutilizado':<20} OK {again[0]} finishedAt {again[1].isoformat()}")
+    finally:
+        await apify_connector.pool.close()
+
+
+def main() -> None:
+    with FakeApify() as fake:
+        apify_connector.APIFY_API_URL = fake.url
+        # sin reintentos con backoff: el 404 del dataset tiene que fallar al toque
+        apify_connector.APIFY_MAX_RETRIES = 0
+        asyncio.run(run(fake))
+
+
+if __name__ == "__main__":
+    main()
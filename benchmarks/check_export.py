@@ -0,0 +1,110 @@
+# check_export.py
+# Las exportaciones de /dbquery/{user,admin}/export contra shape_metric: CSV,
+# Arrow y Parquet tienen que traer exactamente las filas y valores que devuelve
+# /dbquery (mismo orden), con todas las columnas o con `fields`; y sin pyarrow
+# arrow/parquet responden 501 en vez de romper a mitad del stream.
+# Mongo local si se pasa --mongo-uri; si no, mongomock en memoria.
+#   python benchmarks/check_export.py --items 12000
+import argparse
+import asyncio
+import csv
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import httpx  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+
+from mongo_standin import use_mongo, reset_db  # noqa: E402
+from synthetic import generate_items  # noqa: E402
+
+OWNER_ID = 7
+SUBSET = "postId,usernameTiktokAccount,datePosted,hourPosted,views,engagement,userId"
+
+
+def _csv_value(v) -> str:
+    return "" if v is None else str(v)
+
+
+def _expected(rows, cols):
+    return [[r[c] for c in cols] for r in rows]
+
+
+async def _export(client: httpx.AsyncClient, fmt: str, fields=None) -> httpx.Response:
+    body = {"userId": OWNER_ID, "format": fmt}
+    if fields:
+        body["fields"] = fields
+    return await client.post("/dbquery/user/export", json=body)
+
+
+async def run(n: int) -> None:
+    import export_controller
+    from db_mongo import get_collection
+    from models import METRIC_OUT_FIELDS, shape_metric
+    from queries_controller import _ITEM_SORT
+    from tiktok_metrics_processor import transform_batch
+
+    await reset_db()
+    coll = get_collection()
+    await coll.insert_many(transform_batch(generate_items(n, seed=n), owner_field="userId", owner_id=OWNER_ID))
+    # lo mismo que devuelve /dbquery, en su orden
+    rows = [shape_metric(d) async for d in coll.find({"userId": OWNER_ID}, {"_id": 0}).sort(_ITEM_SORT)]
+    # lotes chicos para que haya varios record batches / row groups
+    export_controller.EXPORT_BATCH_SIZE = max(1, n // 5)
+
+    app = FastAPI()
+    app.include_router(export_controller.router)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://check") as client:
+        for fields in (None, SUBSET):
+            cols = fields.split(",") if fields else list(METRIC_OUT_FIELDS)
+            expected = _expected(rows, cols)
+            label = "subset" if fields else "todas"
+
+            resp = await _export(client, "csv", fields)
+            assert resp.status_code == 200, resp.text
+            got = list(csv.reader(io.StringIO(resp.text)))
+            assert got[0] == cols, got[0]
+            assert got[1:] == [[_csv_value(v) for v in r] for r in expected], f"csv/{label}: filas distintas"
+            print(f"{'csv/' + label:<16} OK {len(got) - 1} filas, {len(resp.content)} bytes")
+
+            if export_controller.pa is None:
+                continue
+            pa, pq = export_controller.pa, export_controller.pq
+            for fmt in ("arrow", "parquet"):
+                resp = await _export(client, fmt, fields)
+                assert resp.status_code == 200, resp.text
+                if fmt == "arrow":
+                    table = pa.ipc.open_stream(resp.content).read_all()
+                else:
+                    table = pq.read_table(io.BytesIO(resp.content))
+                assert table.column_names == cols, table.column_names
+                got = [[r[c] for c in cols] for r in table.to_pylist()]
+                assert got == expected, f"{fmt}/{label}: filas distintas"
+                print(f"{fmt + '/' + label:<16} OK {table.num_rows} filas, {len(resp.content)} bytes")
+
+        # sin pyarrow: 501 antes de empezar el stream (csv sigue andando)
+        saved = export_controller.pa
+        export_controller.pa = None
+        try:
+            for fmt in ("arrow", "parquet"):
+                resp = await _export(client, fmt)
+                assert resp.status_code == 501, f"{fmt} sin pyarrow: {resp.status_code}"
+            print(f"{'sin_pyarrow':<16} OK 501 {resp.json()}")
+        finally:
+            export_controller.pa = saved
+    await reset_db()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--items", type=int, default=12000)
+    ap.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGODB_URI"))
+    args = ap.parse_args()
+    use_mongo(args.mongo_uri)
+    asyncio.run(run(args.items))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# check_fast_json.py
+# Compatibilidad del camino rápido (shape_metric + FastJSONResponse) contra la
+# respuesta de siempre (InsertResponse/QueryResponse validados por FastAPI con
+# response_model): el body tiene que ser idéntico byte a byte. Los dos lados parten
+# de shape_metric (en Mongo las fechas son datetime y los faltantes None). FastAPI
+# serializa con el encoder de pydantic-core, que escribe los floats igual que orjson
+# (0.000012, no 1.2e-05); sin orjson se compara por valores y orden de claves.
+#   python benchmarks/check_fast_json.py --items 10000 --out fast_json.json
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import httpx  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+
+from synthetic import generate_items  # noqa: E402
+from tiktok_metrics_processor import transform_batch  # noqa: E402
+from models import InsertResponse, QueryResponse, shape_metric  # noqa: E402
+import fast_json  # noqa: E402
+from fast_json import FastJSONResponse  # noqa: E402
+from ingestion import IngestResult  # noqa: E402
+from ApifyConnectionController import _insert_response  # noqa: E402
+
+
+def _build_app(docs, result: IngestResult, dashboard) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/insert/old", response_model=InsertResponse)
+    async def insert_old():
+        return InsertResponse(inserted=result.inserted, upserted=result.upserted, data=[shape_metric(d) for d in docs],
+                              chunks=result.chunks, targets=result.targets)
+
+    @app.get("/insert/fast", response_model=InsertResponse)
+    async def insert_fast():
+        # el mismo armado que usan los endpoints de scrape
+        return FastJSONResponse(_insert_response(result, docs))
+
+    @app.get("/query/old", response_model=QueryResponse)
+    async def query_old():
+        return QueryResponse(items=[shape_metric(d) for d in docs], count=len(docs), dashboard=dashboard, nextCursor="abc")
+
+    @app.get("/query/fast", response_model=QueryResponse)
+    async def query_fast():
+        return FastJSONResponse({"items": [shape_metric(d) for d in docs], "count": len(docs),
+                                 "dashboard": dashboard, "nextCursor": "abc"})
+
+    return app
+
+
+def _pairs(body: bytes):
+    # json.loads con pares: compara también el orden de las claves
+    return json.loads(body, object_pairs_hook=lambda kv: kv)
+
+
+async def _get(client: httpx.AsyncClient, path: str, repeat: int):
+    best, body = float("inf"), b""
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        resp = await client.get(path)
+        best = min(best, time.perf_counter() - t0)
+        body = resp.content
+    return body, best
+
+
+async def run(n: int, repeat: int):
+    docs = transform_batch(generate_items(n, seed=n), owner_field="userId", owner_id=7)
+    for d in docs[::50]:
+        d["engagement"] = 0.000012  # fuerza la notación exponencial de json
+    result = IngestResult()
+    result.add_chunk(n, n, n)
+    result.targets = [{"target": "profiles:creator_0", "status": "succeeded", "received": n, "inserted": n,
+                       "upserted": n, "duplicates": 0, "error": None}]
+    dashboard = [{"type": "kpis", "totalViews": 1, "avgEngagement": 0.5, "label": "miércoles"}]
+    app = _build_app(docs, result, dashboard)
+    report = {"benchmark": "fast_json", "items": n, "orjson": fast_json.orjson is not None, "results": []}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for kind in ("insert", "query"):
+            old, old_secs = await _get(client, f"/{kind}/old", repeat)
+            fast, fast_secs = await _get(client, f"/{kind}/fast", repeat)
+            assert _pairs(fast) == _pairs(old), f"{kind}: el body rápido no coincide con el de siempre"
+            if fast_json.orjson is not None:
+                assert fast == old, f"{kind}: el body rápido no es idéntico byte a byte"
+            report["results"].append({
+                "endpoint": kind,
+                "bytes": len(old),
+                "validatedSecs": round(old_secs, 6),
+                "fastSecs": round(fast_secs, 6),
+                "speedup": round(old_secs / fast_secs, 3) if fast_secs else None,
+            })
+            print(f"{kind:>7}  {len(old):>10} bytes  validado {old_secs * 1000:9.2f} ms"
+                  f"  rápido {fast_secs * 1000:9.2f} ms  x{old_secs / fast_secs:.2f}  OK")
+    return report
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--items", type=int, default=10000)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--out", default=None)
+    args = ap.parse_args()
+    report = asyncio.run(run(args.items, args.repeat))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# check_ingestion.py
+# Regresiones de ingestion.ingest_pages: un error a mitad del scrape (upsert que
+# falla o páginas que fallan) tiene que propagarse al que llama, sin quedar
+# colgado esperando al productor de páginas con la cola llena. Y dos ingestas
+# concurrentes de los mismos posts (doble submit, sync + job) no pueden contar dos
+# veces los posts nuevos en los rollups (mongomock, o --mongo-uri).
+#   python benchmarks/check_ingestion.py
+import argparse
+import asyncio
+import inspect
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import ingestion  # noqa: E402
+from mongo_standin import use_mongo, reset_db  # noqa: E402
+from synthetic import generate_items  # noqa: E402
+
+TIMEOUT_SECS = 5
+PAGES = 20  # más que INGEST_PAGE_BUFFER: el productor queda bloqueado en queue.put
+
+
+async def _pages(fail_at=None):
+    for i in range(PAGES):
+        if i == fail_at:
+            raise RuntimeError("apify down")
+        yield [{"postId": str(i * 10 + j), "userId": 1} for j in range(10)]
+        await asyncio.sleep(0)
+
+
+async def _failing_upsert(coll, docs, owner_field):
+    # como un Mongo real: cede el loop antes de fallar y el productor vuelve a llenar la cola
+    await asyncio.sleep(0.01)
+    raise RuntimeError("mongo down")
+
+
+async def _ok_upsert(coll, docs, owner_field):
+    return len(docs), len(docs)
+
+
+async def _expect_error(name: str, pages, message: str) -> None:
+    # sin wait_for: un wait_for cancelaría la tarea y escondería el cuelgue
+    task = asyncio.ensure_future(ingestion.ingest_pages(pages, lambda p: p, None, "userId"))
+    done, _ = await asyncio.wait({task}, timeout=TIMEOUT_SECS)
+    if not done:
+        task.cancel()
+        raise AssertionError(f"{name}: ingest_pages no terminó en {TIMEOUT_SECS}s")
+    exc = task.exception()
+    assert isinstance(exc, RuntimeError) and str(exc) == message, f"{name}: se esperaba '{message}', llegó {exc!r}"
+    print(f"{name:<20} OK ({message})")
+
+
+class _Yielding:
+    """Colección que cede el loop antes de cada operación, como Motor contra un mongod
+    real (mongomock responde sin ceder y esconde las carreras entre ingestas)."""
+
+    def __init__(self, coll):
+        self._coll = coll
+        self.name = coll.name
+
+    def __getattr__(self, name):
+        attr = getattr(self._coll, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            res = attr(*args, **kwargs)
+            if not inspect.isawaitable(res):
+                return res
+
+            async def later():
+                await asyncio.sleep(0)
+                return await res
+            return later()
+        return call
+
+
+async def _concurrent_rollups() -> None:
+    from db_mongo import get_collection
+    from rollups import check_rollups
+    from tiktok_metrics_processor import transform_batch
+
+    await reset_db()
+    coll = get_collection()
+    await coll.create_index([("postId", 1), ("userId", 1)], unique=True)
+    items = generate_items(50, seed=50)
+
+    async def pages():
+        yield items
+
+    transform = lambda page: transform_batch(page, owner_field="userId", owner_id=1)
+    await asyncio.gather(*(ingestion.ingest_pages(pages(), transform, _Yielding(coll), "userId") for _ in range(2)))
+    bad = await check_rollups(coll.name)
+    assert not bad, f"rollups distintos de la colección cruda: {bad}"
+    print(f"{'ingesta_concurrente':<20} OK ({await coll.count_documents({})} posts, rollups consistentes)")
+    await reset_db()
+
+
+async def run() -> None:
+    original = ingestion.upsert_latest
+    try:
+        ingestion.upsert_latest = _failing_upsert
+        await _expect_error("upsert_falla", _pages(), "mongo down")
+        ingestion.upsert_latest = _ok_upsert
+        await _expect_error("paginas_fallan", _pages(fail_at=PAGES // 2), "apify down")
+    finally:
+        ingestion.upsert_latest = original
+    await _concurrent_rollups()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGODB_URI"))
+    args = ap.parse_args()
+    use_mongo(args.mongo_uri)
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
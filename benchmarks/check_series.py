@@ -0,0 +1,76 @@
+# check_series.py
+# Serie de una cuenta con dos posts donde uno deja de scrapearse: el total del
+# bucket tiene que arrastrar el último valor de ese post ($densify + $fill) y no
+# caer. Necesita un mongod >= 5.3 ($densify, $fill, $top); mongomock no los tiene.
+#   python benchmarks/check_series.py --mongo-uri mongodb://localhost:27017
+import argparse
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from mongo_standin import use_mongo, reset_db  # noqa: E402
+
+OWNER_ID = 1
+ACCOUNT = "creator_series"
+
+
+def _doc(post_id: str, day: int, views: int) -> dict:
+    from tiktok_metrics_processor import LIMA_TZ
+    return {
+        "postId": post_id, "userId": OWNER_ID, "usernameTiktokAccount": ACCOUNT, "hashtagList": ["#fyp"],
+        "trackedAt": datetime(2025, 1, day, 12, tzinfo=LIMA_TZ),
+        "views": views, "likes": views // 10, "comments": 0, "saves": 0, "reposts": 0,
+        "totalInteractions": views // 10, "engagement": 0.1,
+    }
+
+
+async def _series(snapshots, days: int):
+    from db_mongo import COLL_NAME, ensure_series_collections, get_series_collection
+    from ingestion import series_snapshots
+    from models import SeriesRequest
+    from series_controller import _run_series
+    from tiktok_metrics_processor import LIMA_TZ
+
+    await reset_db()
+    await ensure_series_collections()
+    await get_series_collection(COLL_NAME).insert_many(series_snapshots(snapshots, "userId"))
+    start = datetime(2025, 1, 1, tzinfo=LIMA_TZ)
+    req = SeriesRequest(userId=OWNER_ID, tiktokUsername=ACCOUNT, bucket="day",
+                        trackedFrom=start, trackedTo=start + timedelta(days=days))
+    res = await _run_series(req, COLL_NAME, "userId")
+    return [(p.views, p.posts) for p in res.points]
+
+
+async def run() -> None:
+    # A se scrapea los 4 días; B solo los 2 primeros: sus 20 vistas siguen contando
+    stops = [_doc("A", d, v) for d, v in ((1, 100), (2, 200), (3, 300), (4, 400))]
+    stops += [_doc("B", d, v) for d, v in ((1, 10), (2, 20))]
+    got = await _series(stops, 4)
+    assert got == [(110, 2), (220, 2), (320, 2), (420, 2)], f"post que deja de scrapearse: {got}"
+    print(f"{'post_deja_de_scrapearse':<26} OK {got}")
+
+    # B aparece recién el día 3: antes no cuenta como post
+    starts = [_doc("A", d, v) for d, v in ((1, 100), (2, 200), (3, 300), (4, 400))]
+    starts += [_doc("B", d, v) for d, v in ((3, 30), (4, 40))]
+    got = await _series(starts, 4)
+    assert got == [(100, 1), (200, 1), (330, 2), (440, 2)], f"post que empieza después: {got}"
+    print(f"{'post_empieza_despues':<26} OK {got}")
+    await reset_db()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGODB_URI"))
+    args = ap.parse_args()
+    if not args.mongo_uri:
+        print("omitido: necesita --mongo-uri (mongod >= 5.3; mongomock no implementa $densify/$fill)")
+        return
+    use_mongo(args.mongo_uri)
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# fake_apify.py
+# Apify falso en un hilo (http.server) con la parte del API v2 que usa
+# apify_connector: iniciar el run del actor, esperar a que termine y paginar el
+# dataset con los headers x-apify-pagination-*. Cada run genera
+# resultsPerPage items por target (profiles/hashtags/searchQueries) con synthetic;
+# oldestPostDate se respeta como en el actor (solo posts desde esa fecha).
+# fail_status (p.ej. "FAILED") hace que los runs siguientes terminen con ese status.
+# Para usarlo apuntar APIFY_API_URL (o apify_connector.APIFY_API_URL) a server.url.
+import gzip
+import json
+import random
+import re
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from synthetic import generate_items
+
+_RUN_PATH = re.compile(r"^/v2/acts/[^/]+/runs$")
+_RUN_GET_PATH = re.compile(r"^/v2/actor-runs/([^/]+)$")
+_ITEMS_PATH = re.compile(r"^/v2/datasets/([^/]+)/items$")
+
+
+class FakeApify:
+    def __init__(self, seed: int = 42, host: str = "127.0.0.1", port: int = 0):
+        self.seed = seed
+        self.runs: Dict[str, Dict[str, Any]] = {}
+        self.datasets: Dict[str, List[Dict[str, Any]]] = {}
+        self.inputs: Dict[str, Dict[str, Any]] = {}
+        self.requests = 0
+        self.fail_status: Optional[str] = None
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeApify":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeApify":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _items_for(self, run_input: Dict[str, Any], seed: int) -> List[Dict[str, Any]]:
+        targets = (run_input.get("profiles") or []) + (run_input.get("hashtags") or []) + (run_input.get("searchQueries") or [])
+        n = int(run_input.get("resultsPerPage") or 100) * max(1, len(targets))
+        items = generate_items(n, seed=seed, profiles=run_input.get("profiles") or None)
+        # los hashtags pedidos tienen que aparecer en los posts (el actor busca por ellos)
+        tags = run_input.get("hashtags") or []
+        if tags:
+            rng = random.Random(seed)
+            for it in items:
+                it["hashtags"].append({"id": "", "name": rng.choice(tags), "title": "", "cover": ""})
+        oldest = run_input.get("oldestPostDate")
+        if oldest:
+            since = datetime.fromisoformat(oldest).replace(tzinfo=timezone.utc).timestamp()
+            items = [it for it in items if it.get("createTime", 0) >= since]
+        return items
+
+    def _start_run(self, run_input: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            n = len(self.runs) + 1
+        items = self._items_for(run_input, self.seed + n)
+        run_id, dataset_id = f"run{n}", f"ds{n}"
+        now = datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+        run = {"id": run_id, "actId": "fake", "status": self.fail_status or "SUCCEEDED", "defaultDatasetId": dataset_id,
+               "startedAt": now, "finishedAt": now}
+        with self._lock:
+            self.runs[run_id] = run
+            self.inputs[run_id] = run_input
+            self.datasets[dataset_id] = items
+        return run
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def _send(self, status: int, body: Any, headers: Optional[Dict[str, str]] = None) -> None:
+                raw = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def do_POST(self) -> None:
+                fake.requests += 1
+                path = urlparse(self.path).path
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length)
+                if self.headers.get("Content-Encoding") == "gzip":
+                    # apify-client comprime los bodies grandes
+                    raw = gzip.decompress(raw)
+                payload = json.loads(raw or b"{}")
+                if not _RUN_PATH.match(path):
+                    return self._send(404, {"error": {"type": "page-not-found", "message": path}})
+                self._send(201, {"data": fake._start_run(payload)})
+
+            def do_GET(self) -> None:
+                fake.requests += 1
+                url = urlparse(self.path)
+                m = _RUN_GET_PATH.match(url.path)
+                if m and m.group(1) in fake.runs:
+                    return self._send(200, {"data": fake.runs[m.group(1)]})
+                m = _ITEMS_PATH.match(url.path)
+                if m and m.group(1) in fake.datasets:
+                    items = fake.datasets[m.group(1)]
+                    qs = parse_qs(url.query)
+                    offset = int(qs.get("offset", ["0"])[0])
+                    limit = int(qs.get("limit", [str(len(items))])[0])
+                    page = items[offset:offset + limit]
+                    return self._send(200, page, {
+                        "x-apify-pagination-total": str(len(items)),
+                        "x-apify-pagination-offset": str(offset),
+                        "x-apify-pagination-count": str(len(page)),
+                        "x-apify-pagination-limit": str(limit),
+                        "x-apify-pagination-desc": "",
+                    })
+                self._send(404, {"error": {"type": "record-not-found", "message": url.path}})
+
+        return Handler
@@ -0,0 +1,50 @@
+# mongo_standin.py
+# Mongo para los benchmarks: un mongod local si se pasa la URI (números
+# representativos) o mongomock-motor en memoria (sin servidor, útil para medir
+# el lado Python y para correr la suite en CI). Siempre en una base aparte.
+import os
+import sys
+from typing import Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import db_mongo  # noqa: E402
+
+BENCH_DB_NAME = os.getenv("BENCH_MONGODB_DB", "Microservicio3Bench")
+
+
+def _patch_mongomock_bulk() -> None:
+    # pymongo >= 4.11 pasa sort= a add_update/add_replace en bulk_write y mongomock
+    # todavía no lo acepta; sin sort el comportamiento es el mismo
+    from mongomock.collection import BulkOperationBuilder
+    for name in ("add_update", "add_replace"):
+        original = getattr(BulkOperationBuilder, name)
+        if getattr(original, "_ignores_sort", False):
+            continue
+
+        def patched(self, *args, _original=original, sort=None, **kwargs):
+            return _original(self, *args, **kwargs)
+        patched._ignores_sort = True
+        setattr(BulkOperationBuilder, name, patched)
+
+
+def use_mongo(uri: Optional[str] = None, db_name: str = BENCH_DB_NAME) -> str:
+    """Apunta db_mongo al Mongo de benchmarks y devuelve qué backend quedó."""
+    if uri:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        db_mongo.client = AsyncIOMotorClient(uri)
+        backend = "mongod"
+    else:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise SystemExit("sin --mongo-uri hace falta mongomock-motor (pip install -r benchmarks/requirements.txt)")
+        _patch_mongomock_bulk()
+        db_mongo.client = AsyncMongoMockClient()
+        backend = "mongomock"
+    db_mongo.DB_NAME = db_name
+    return backend
+
+
+async def reset_db() -> None:
+    await db_mongo.get_client().drop_database(db_mongo.DB_NAME)
@@ -0,0 +1,92 @@
+# synthetic.py
+# Generador determinístico (seed) de items con la forma que devuelve el actor
+# clockworks/free-tiktok-scraper: authorMeta, musicMeta, hashtags, videoMeta,
+# slideshowImageLinks, métricas y fechas (ISO o epoch).
+import hashlib
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+_WORDS = [
+    "fyp", "parati", "viral", "booktok", "lima", "peru", "comedy", "dance", "food",
+    "travel", "fitness", "makeup", "music", "trend", "duet", "tutorial", "pets", "art",
+    "gaming", "fashion", "football", "anime", "diy", "study", "coffee", "vlog",
+]
+
+def _stable_id(name: str) -> str:
+    # hash() cambia entre procesos (PYTHONHASHSEED): un digest da el mismo id siempre
+    return str(int(hashlib.sha1(name.encode("utf-8")).hexdigest(), 16) % 10**12)
+
+def _hashtags(rng: random.Random, vocab: List[str]) -> List[Dict[str, Any]]:
+    n = rng.choice([0, 1, 2, 3, 3, 4, 5, 6, 8, 12])
+    out = []
+    for _ in range(n):
+        name = rng.choice(vocab)
+        if rng.random() < 0.15:
+            name = name.capitalize()
+        out.append({"id": str(rng.randrange(10**6, 10**9)), "name": name, "title": "", "cover": ""})
+    return out
+
+def generate_items(
+    n: int,
+    seed: int = 42,
+    profiles: Optional[List[str]] = None,
+    n_hashtags: int = 200,
+    n_sounds: int = 300,
+    start: datetime = datetime(2025, 1, 1, tzinfo=timezone.utc),
+    days: int = 90,
+) -> List[Dict[str, Any]]:
+    return list(iter_items(n, seed, profiles, n_hashtags, n_sounds, start, days))
+
+def iter_items(
+    n: int,
+    seed: int = 42,
+    profiles: Optional[List[str]] = None,
+    n_hashtags: int = 200,
+    n_sounds: int = 300,
+    start: datetime = datetime(2025, 1, 1, tzinfo=timezone.utc),
+    days: int = 90,
+) -> Iterator[Dict[str, Any]]:
+    rng = random.Random(seed)
+    profiles = profiles or [f"creator_{i}" for i in range(10)]
+    vocab = _WORDS + [f"{rng.choice(_WORDS)}{i}" for i in range(max(0, n_hashtags - len(_WORDS)))]
+    sounds = [str(7_000_000_000_000_000_000 + rng.randrange(10**15)) for _ in range(n_sounds)]
+    for i in range(n):
+        posted = start + timedelta(seconds=rng.randrange(days * 86_400))
+        views = int(rng.paretovariate(1.2) * 500)
+        likes = int(views * rng.uniform(0.01, 0.15))
+        author = rng.choice(profiles)
+        post_id = str(7_400_000_000_000_000_000 + seed * 10_000_000 + i)
+        item: Dict[str, Any] = {
+            "id": post_id,
+            "text": " ".join(rng.choice(_WORDS) for _ in range(rng.randrange(3, 15))),
+            "authorMeta": {"id": _stable_id(author), "name": author, "nickName": author.title(),
+                           "verified": rng.random() < 0.05, "fans": rng.randrange(10**7)},
+            "musicMeta": {"musicId": rng.choice(sounds), "musicName": "sonido original",
+                          "musicAuthor": author, "playUrl": f"https://sf16.tiktokcdn.com/obj/{rng.randrange(10**9)}.mp3",
+                          "musicOriginal": rng.random() < 0.3},
+            "webVideoUrl": f"https://www.tiktok.com/@{author}/video/{post_id}",
+            "videoMeta": {"height": 1024, "width": 576, "duration": rng.randrange(5, 180),
+                          "coverUrl": f"https://p16-sign.tiktokcdn-us.com/{rng.randrange(10**9)}~tplv.jpeg?idc=useast5",
+                          "originalCoverUrl": f"https://p16-sign.tiktokcdn-us.com/{rng.randrange(10**9)}.jpeg"},
+            "playCount": views,
+            "diggCount": likes,
+            "shareCount": int(likes * rng.uniform(0, 0.2)),
+            "commentCount": int(likes * rng.uniform(0, 0.1)),
+            "collectCount": int(likes * rng.uniform(0, 0.3)),
+            "hashtags": _hashtags(rng, vocab),
+            "isPinned": False,
+            "input": author,
+        }
+        if rng.random() < 0.8:
+            item["createTimeISO"] = posted.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+            item["createTime"] = int(posted.timestamp())
+        elif rng.random() < 0.9:
+            item["createTime"] = int(posted.timestamp())
+        if rng.random() < 0.1:
+            item["slideshowImageLinks"] = [
+                {"tiktokLink": f"https://p16-sign.tiktokcdn.com/{rng.randrange(10**9)}.jpeg?idc=maliva",
+                 "downloadLink": f"https://p16-sign.tiktokcdn.com/{rng.randrange(10**9)}.jpeg"}
+                for _ in range(rng.randrange(1, 6))
+            ]
+        yield item